@@ -139,10 +139,20 @@ CORS_ALLOW_HEADERS = [
 REST_FRAMEWORK = {
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
     'TEST_REQUEST_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'users.renderers.ORJSONRenderer',
+    ],
+    # JSON кодируется и разбирается orjson (users.renderers)
+    'DEFAULT_RENDERER_CLASSES': [
+        'users.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'users.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.BasicAuthentication',
+        'users.authentication.AsyncBasicAuthentication',
         'users.authentication.SafeJWTAuthentication'
     ]
 }
@@ -247,3 +257,84 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REDIS_HOST = os.getenv('REDIS_HOST')
 REDIS_PORT = os.getenv('REDIS_PORT')
 REDIS_DB = os.getenv('REDIS_DB')
+REDIS_ASYNC_MAX_CONNECTIONS = int(os.getenv('REDIS_ASYNC_MAX_CONNECTIONS', 50))
+
+# Кеш проверенных JWT токенов
+JWT_CACHE_MAX_SIZE = int(os.getenv('JWT_CACHE_MAX_SIZE', 10000))
+JWT_CACHE_LOCAL_TTL = int(os.getenv('JWT_CACHE_LOCAL_TTL', 30))
+JWT_CACHE_USE_REDIS = os.getenv('JWT_CACHE_USE_REDIS', 'False') == 'True'
+# подписка воркера на сброс токенов пользователя в других воркерах
+JWT_CACHE_LISTEN = os.getenv('JWT_CACHE_LISTEN', 'True') == 'True'
+
+# Список отозванных refresh токенов
+REVOCATION_USE_BLOOM = os.getenv('REVOCATION_USE_BLOOM', 'False') == 'True'
+REVOCATION_BLOOM_CAPACITY = int(os.getenv('REVOCATION_BLOOM_CAPACITY', 1_000_000))
+REVOCATION_BLOOM_ERROR_RATE = float(os.getenv('REVOCATION_BLOOM_ERROR_RATE', 0.001))
+REVOCATION_SYNC_INTERVAL = float(os.getenv('REVOCATION_SYNC_INTERVAL', 1.0))
+
+# Число воркеров uvicorn (server.py), у каждого свой пул хеширования паролей
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', 4))
+
+# Хеширование паролей в выделенном пуле: 'process' или 'thread'.
+# Пулы всех воркеров uvicorn делят ядра машины, поэтому по умолчанию ядра делятся между ними
+PASSWORD_HASHING_EXECUTOR = os.getenv('PASSWORD_HASHING_EXECUTOR', 'process')
+PASSWORD_HASHING_WORKERS = int(os.getenv('PASSWORD_HASHING_WORKERS', max(1, (os.cpu_count() or 2) // SERVER_WORKERS)))
+PASSWORD_HASHING_MAX_PENDING = int(os.getenv('PASSWORD_HASHING_MAX_PENDING', 64))
+
+# Воркеры outbox почты (manage.py run_mail_workers)
+MAIL_WORKER_CONCURRENCY = int(os.getenv('MAIL_WORKER_CONCURRENCY', 10))
+MAIL_MAX_ATTEMPTS = int(os.getenv('MAIL_MAX_ATTEMPTS', 8))
+MAIL_BACKOFF_BASE = float(os.getenv('MAIL_BACKOFF_BASE', 5.0))
+MAIL_BACKOFF_MAX = float(os.getenv('MAIL_BACKOFF_MAX', 3600.0))
+MAIL_LEASE = float(os.getenv('MAIL_LEASE', 300.0))
+MAIL_POLL_INTERVAL = float(os.getenv('MAIL_POLL_INTERVAL', 1.0))
+
+# Пул SMTP соединений по профилям почты
+SMTP_POOL_ENABLED = os.getenv('SMTP_POOL_ENABLED', 'True') == 'True'
+SMTP_POOL_MAX_SIZE = int(os.getenv('SMTP_POOL_MAX_SIZE', 10))
+SMTP_POOL_IDLE_TIMEOUT = float(os.getenv('SMTP_POOL_IDLE_TIMEOUT', 60.0))
+
+# Кеш конфигураций ProfileMail
+MAIL_CONFIG_LOCAL_TTL = float(os.getenv('MAIL_CONFIG_LOCAL_TTL', 300.0))
+MAIL_CONFIG_REDIS_TTL = int(os.getenv('MAIL_CONFIG_REDIS_TTL', 3600))
+MAIL_CONFIG_LISTEN = os.getenv('MAIL_CONFIG_LISTEN', 'True') == 'True'
+
+# Ограничение скорости отправки писем на один SMTP хост, писем в секунду (0 - без ограничения)
+MAIL_RATE_LIMIT_PER_HOST = float(os.getenv('MAIL_RATE_LIMIT_PER_HOST', 0))
+MAIL_RATE_BURST = float(os.getenv('MAIL_RATE_BURST', 50))
+
+# Асинхронный SMTP транспорт для профилей с SMTP бэкендом
+MAIL_ASYNC_SMTP = os.getenv('MAIL_ASYNC_SMTP', 'True') == 'True'
+
+# Локали шаблонов писем (users/templates/mail), первая для неизвестных языков - LANGUAGE_CODE
+MAIL_LOCALES = ('ru', 'en')
+
+# Фоновая обработка изображений профилей: 'process', 'thread' или 'sync' (сразу, в том же потоке).
+# Пул свой у каждого воркера uvicorn, поэтому ядра делятся между ними, как у хеширования паролей
+PROFILE_IMAGE_EXECUTOR = os.getenv('PROFILE_IMAGE_EXECUTOR', 'process')
+PROFILE_IMAGE_WORKERS = int(os.getenv('PROFILE_IMAGE_WORKERS', max(1, (os.cpu_count() or 2) // SERVER_WORKERS)))
+PROFILE_IMAGE_MAX_PENDING = int(os.getenv('PROFILE_IMAGE_MAX_PENDING', 256))
+# Ограничения загружаемых изображений: размер файла в байтах и число пикселей
+PROFILE_IMAGE_MAX_UPLOAD_SIZE = int(os.getenv('PROFILE_IMAGE_MAX_UPLOAD_SIZE', 10 * 1024 * 1024))
+PROFILE_IMAGE_MAX_PIXELS = int(os.getenv('PROFILE_IMAGE_MAX_PIXELS', 64_000_000))
+
+# Отдача файлов MEDIA_URL: 'django' (стримит сервис), 'x-accel' (nginx X-Accel-Redirect) или 'x-sendfile'
+MEDIA_SENDFILE = os.getenv('MEDIA_SENDFILE', 'django')
+# internal location nginx, который смотрит в MEDIA_ROOT
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/protected-media/')
+
+# Read-through кеш JSON профилей в Redis: время жизни и ожидание загрузки холодного ключа, секунды
+PROFILE_CACHE_TTL = int(os.getenv('PROFILE_CACHE_TTL', 300))
+PROFILE_CACHE_LOCK_TIMEOUT = float(os.getenv('PROFILE_CACHE_LOCK_TIMEOUT', 2))
+
+# Сколько профилей можно запросить одним запросом api/user/profile/batch/
+PROFILE_BATCH_MAX_SIZE = int(os.getenv('PROFILE_BATCH_MAX_SIZE', 300))
+
+# Admin списки (users.pagination): размер страницы по умолчанию и максимальный (параметр page_size)
+ADMIN_PAGE_SIZE = int(os.getenv('ADMIN_PAGE_SIZE', 50))
+ADMIN_MAX_PAGE_SIZE = int(os.getenv('ADMIN_MAX_PAGE_SIZE', 500))
+# Admin поиск профилей (users.search): минимальная длина запроса, глубина выдачи
+# и сколько компаний, найденных по названию, учитывается
+ADMIN_SEARCH_MIN_LENGTH = int(os.getenv('ADMIN_SEARCH_MIN_LENGTH', 3))
+ADMIN_SEARCH_MAX_OFFSET = int(os.getenv('ADMIN_SEARCH_MAX_OFFSET', 1000))
+ADMIN_SEARCH_MAX_COMPANIES = int(os.getenv('ADMIN_SEARCH_MAX_COMPANIES', 1000))
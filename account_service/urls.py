@@ -5,6 +5,8 @@ from django.urls import include, path
 from django.views.generic import TemplateView
 from rest_framework.schemas import get_schema_view
 
+from users.views import ProfileMedia
+
 urlpatterns = [
     path('api_schema/', get_schema_view(
         title='API Schema',
@@ -15,9 +17,10 @@ urlpatterns = [
         extra_context={'schema_url': 'api_schema'}
     ), name='swagger-ui'),
     path('admin/', admin.site.urls),
-    path('api/', include('users.urls'))
+    path('api/', include('users.urls')),
+    # изображения профилей отдаются и в production, не только при DEBUG: оригиналы загрузок по подписанной ссылке
+    path(f'{settings.MEDIA_URL.lstrip("/")}<path:name>', ProfileMedia.as_view(), name='media'),
 ]
 
 if settings.DEBUG:
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
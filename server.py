@@ -1,9 +1,19 @@
+import os
+
+import django
 import uvicorn
+from django.conf import settings
+from django.core.management import call_command
 
 if __name__ == '__main__':
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'account_service.settings')
+    django.setup()
+    # список отозванных токенов в Redis восстанавливается по журналу в бд
+    call_command('rebuild_revoked_tokens')
+
     uvicorn.run("account_service.asgi:application",
                 reload=True,
                 port=8001,
                 log_level='info',
-                workers=4,
+                workers=settings.SERVER_WORKERS,
                 lifespan='auto')
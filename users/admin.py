@@ -1,9 +1,11 @@
 from django.contrib import admin
 
-from .models import Account, BlackListedToken, Company, Profile, ProfileMail
+from .models import (Account, BlackListedToken, Company, OutboxMail, Profile,
+                     ProfileMail)
 
 admin.site.register(Profile)
 admin.site.register(Account)
 admin.site.register(Company)
 admin.site.register(ProfileMail)
 admin.site.register(BlackListedToken)
+admin.site.register(OutboxMail)
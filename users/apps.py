@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "users"
+
+    def ready(self) -> None:
+        # подключает обработчики сигналов моделей
+        from . import signals  # noqa: F401
+        from .mail_templates import mail_templates
+
+        # шаблоны писем компилируются при старте, а не на первой регистрации
+        mail_templates.warm_up()
@@ -0,0 +1,344 @@
+import asyncio
+import base64
+import logging
+import re
+import smtplib
+import ssl
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.core.mail.message import sanitize_address
+from django.core.mail.utils import DNS_NAME
+
+from .models import ProfileMail
+from .smtp_pool import connection_fingerprint, is_transport_error
+
+logger = logging.getLogger(__name__)
+
+SMTP_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+
+
+def supports_async(config: ProfileMail) -> bool:
+    """Асинхронный транспорт заменяет только SMTP бэкенд Django, остальные бэкенды работают как раньше"""
+    return settings.MAIL_ASYNC_SMTP and config.email_backend == SMTP_BACKEND
+
+
+class AsyncSMTPConnection:
+    """
+    SMTP клиент на asyncio streams: соединение, STARTTLS или SSL, AUTH PLAIN/LOGIN.
+    При расширении PIPELINING команды MAIL, RCPT и DATA письма уходят одной записью в сокет.
+    Ошибки - те же исключения smtplib, что и у синхронного бэкенда
+    """
+
+    def __init__(self, host: str, port: int, username: str = '', password: str = '', use_tls: bool = False,
+                 use_ssl: bool = False, timeout: Optional[float] = None, ssl_certfile: Optional[str] = None,
+                 ssl_keyfile: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.ssl_certfile = ssl_certfile
+        self.ssl_keyfile = ssl_keyfile
+        self.extensions: Dict[str, str] = {}
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    @classmethod
+    def from_config(cls, config: ProfileMail) -> 'AsyncSMTPConnection':
+        return cls(host=config.email_host, port=config.email_port, username=config.email_host_user,
+                   password=config.email_host_password, use_tls=config.email_use_tls,
+                   use_ssl=config.email_use_ssl, timeout=config.email_timeout or None,
+                   ssl_certfile=config.email_ssl_certfile.path if config.email_ssl_certfile else None,
+                   ssl_keyfile=config.email_ssl_keyfile.path if config.email_ssl_keyfile else None)
+
+    @property
+    def is_connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    def ssl_context(self) -> ssl.SSLContext:
+        if self.ssl_certfile or self.ssl_keyfile:
+            context = ssl.SSLContext(protocol=ssl.PROTOCOL_TLS_CLIENT)
+            context.load_cert_chain(self.ssl_certfile, self.ssl_keyfile)
+            return context
+        return ssl.create_default_context()
+
+    async def connect(self) -> None:
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=self.ssl_context() if self.use_ssl else None),
+                self.timeout)
+            await self.expect(220)
+            await self.ehlo()
+            if self.use_tls and not self.use_ssl:
+                await self.command('STARTTLS', 220)
+                await self._writer.start_tls(self.ssl_context(), server_hostname=self.host)
+                await self.ehlo()
+            if self.username and self.password:
+                await self.login()
+        except BaseException:
+            self.abort()
+            raise
+
+    async def read_reply(self) -> Tuple[int, str]:
+        lines: List[str] = []
+        while True:
+            try:
+                line: bytes = await asyncio.wait_for(self._reader.readline(), self.timeout)
+            except (asyncio.TimeoutError, ConnectionError) as e:
+                self.abort()
+                raise smtplib.SMTPServerDisconnected(f'Соединение с {self.host} прервано: {e!r}')
+            if not line:
+                self.abort()
+                raise smtplib.SMTPServerDisconnected(f'Сервер {self.host} закрыл соединение')
+            text: str = line.decode('utf-8', 'replace').rstrip('\r\n')
+            lines.append(text[4:])
+            if len(text) < 4 or text[3] != '-':
+                try:
+                    return int(text[:3]), '\n'.join(lines)
+                except ValueError:
+                    self.abort()
+                    raise smtplib.SMTPServerDisconnected(f'Некорректный ответ сервера: {text!r}')
+
+    async def expect(self, *codes: int) -> Tuple[int, str]:
+        code, text = await self.read_reply()
+        if code not in codes:
+            raise smtplib.SMTPResponseException(code, text)
+        return code, text
+
+    async def write(self, data: bytes) -> None:
+        if not self.is_connected:
+            raise smtplib.SMTPServerDisconnected('Нет соединения с SMTP сервером')
+        self._writer.write(data)
+        try:
+            await self._writer.drain()
+        except ConnectionError as e:
+            self.abort()
+            raise smtplib.SMTPServerDisconnected(f'Соединение с {self.host} прервано: {e!r}')
+
+    async def command(self, line: str, *codes: int) -> Tuple[int, str]:
+        await self.write(f'{line}\r\n'.encode())
+        return await self.expect(*codes)
+
+    async def ehlo(self) -> None:
+        local_hostname: str = DNS_NAME.get_fqdn()
+        await self.write(f'EHLO {local_hostname}\r\n'.encode())
+        code, text = await self.read_reply()
+        if code != 250:
+            await self.command(f'HELO {local_hostname}', 250)
+            self.extensions = {}
+            return
+        self.extensions = {}
+        for line in text.split('\n')[1:]:
+            match = re.match(r'(?P<name>[A-Za-z0-9][A-Za-z0-9\-]*) ?(?P<params>.*)', line)
+            if match:
+                self.extensions[match['name'].lower()] = match['params'].strip()
+
+    async def login(self) -> None:
+        methods: List[str] = self.extensions.get('auth', '').upper().split()
+        if 'PLAIN' in methods:
+            token: str = base64.b64encode(f'\0{self.username}\0{self.password}'.encode()).decode()
+            await self.command(f'AUTH PLAIN {token}', 235)
+        elif 'LOGIN' in methods:
+            await self.command('AUTH LOGIN', 334)
+            await self.command(base64.b64encode(self.username.encode()).decode(), 334)
+            await self.command(base64.b64encode(self.password.encode()).decode(), 235)
+        else:
+            raise smtplib.SMTPNotSupportedError('SMTP AUTH extension not supported by server.')
+
+    async def send_email(self, email_message: EmailMessage) -> bool:
+        """Отправляет EmailMessage так же, как EmailBackend._send синхронного бэкенда"""
+        if not email_message.recipients():
+            return False
+        encoding: str = email_message.encoding or settings.DEFAULT_CHARSET
+        from_email: str = sanitize_address(email_message.from_email, encoding)
+        recipients: List[str] = [sanitize_address(address, encoding) for address in email_message.recipients()]
+        await self.sendmail(from_email, recipients, email_message.message().as_bytes(linesep='\r\n'))
+        return True
+
+    async def sendmail(self, from_email: str, recipients: List[str], data: bytes) -> None:
+        envelope: List[str] = [f'MAIL FROM:<{from_email}>', *(f'RCPT TO:<{recipient}>' for recipient in recipients)]
+        if 'pipelining' in self.extensions:
+            # одна запись в сокет и один круг ожидания вместо 2 + N
+            await self.write(''.join(f'{line}\r\n' for line in [*envelope, 'DATA']).encode())
+            replies: List[Tuple[int, str]] = [await self.read_reply() for _ in range(len(envelope) + 1)]
+        else:
+            replies = []
+            for line in envelope:
+                await self.write(f'{line}\r\n'.encode())
+                replies.append(await self.read_reply())
+                if replies[0][0] != 250:
+                    break
+            if replies[0][0] == 250 and any(code in (250, 251) for code, _ in replies[1:]):
+                await self.write(b'DATA\r\n')
+                replies.append(await self.read_reply())
+            else:
+                # DATA не отправлялась
+                replies.append((0, ''))
+
+        mail_code, mail_text = replies[0]
+        refused: Dict[str, Tuple[int, str]] = {recipient: reply for recipient, reply in zip(recipients, replies[1:])
+                                               if reply[0] not in (250, 251)}
+        data_code, data_text = replies[-1]
+        if mail_code != 250 or len(refused) == len(recipients) or data_code != 354:
+            if data_code == 354:
+                # сервер уже ждет тело письма: завершаем его пустым, чтобы не отправить
+                await self.write(b'.\r\n')
+                await self.read_reply()
+            await self.command('RSET', 250)
+            if mail_code != 250:
+                raise smtplib.SMTPSenderRefused(mail_code, mail_text, from_email)
+            if len(refused) == len(recipients):
+                raise smtplib.SMTPRecipientsRefused(refused)
+            raise smtplib.SMTPDataError(data_code, data_text)
+
+        # точка в начале строки удваивается, чтобы не завершить DATA раньше времени
+        body: bytes = re.sub(rb'(?m)^\.', b'..', data)
+        if not body.endswith(b'\r\n'):
+            body += b'\r\n'
+        await self.write(body + b'.\r\n')
+        code, text = await self.read_reply()
+        if code != 250:
+            await self.command('RSET', 250)
+            raise smtplib.SMTPDataError(code, text)
+        if refused:
+            logger.warning(f'Часть получателей отклонена сервером: {refused}')
+
+    async def noop(self) -> bool:
+        try:
+            return (await self.command('NOOP', 250))[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def abort(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def close(self) -> None:
+        if not self.is_connected:
+            self.abort()
+            return
+        try:
+            await asyncio.wait_for(self.command('QUIT', 221), 1)
+        except Exception as e:
+            logger.debug(f'Ошибка при закрытии SMTP соединения: {e}')
+        self.abort()
+
+
+class AsyncSMTPPool:
+    """
+    Асинхронный аналог SMTPConnectionPool: до max_size соединений профиля, ожидающие отправки
+    висят на семафоре корутинами и не занимают потоки
+    """
+
+    def __init__(self, config: ProfileMail, max_size: int, idle_timeout: float,
+                 health_check_interval: float = 5.0):
+        self.config = config
+        self.fingerprint: Tuple = connection_fingerprint(config)
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.opened: int = 0
+        self.reused: int = 0
+        self._idle: List[Tuple[float, AsyncSMTPConnection]] = []
+        self._slots = asyncio.Semaphore(max_size)
+        self._closed: bool = False
+
+    async def acquire(self) -> AsyncSMTPConnection:
+        await self._slots.acquire()
+        try:
+            while self._idle:
+                released_at, connection = self._idle.pop()
+                idle: float = time.monotonic() - released_at
+                if not connection.is_connected or idle > self.idle_timeout or \
+                        (idle > self.health_check_interval and not await connection.noop()):
+                    await connection.close()
+                    continue
+                self.reused += 1
+                return connection
+            connection = AsyncSMTPConnection.from_config(self.config)
+            await connection.connect()
+            self.opened += 1
+            return connection
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def release(self, connection: AsyncSMTPConnection, broken: bool = False) -> None:
+        try:
+            if broken or self._closed or not connection.is_connected:
+                await connection.close()
+            else:
+                self._idle.append((time.monotonic(), connection))
+        finally:
+            self._slots.release()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[AsyncSMTPConnection]:
+        connection: AsyncSMTPConnection = await self.acquire()
+        broken: bool = True
+        try:
+            yield connection
+            broken = False
+        except Exception as e:
+            broken = is_transport_error(e)
+            raise
+        finally:
+            await self.release(connection, broken)
+
+    async def close(self) -> None:
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for _, connection in idle:
+            await connection.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {'idle': len(self._idle), 'opened': self.opened, 'reused': self.reused}
+
+
+class AsyncSMTPPoolRegistry:
+    """Асинхронные пулы по ProfileMail.id, свои для каждого event loop, так как соединения к нему привязаны"""
+
+    def __init__(self, max_size: int, idle_timeout: float):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._pools: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, AsyncSMTPPool]]' = \
+            weakref.WeakKeyDictionary()
+
+    def _loop_pools(self) -> Dict[str, AsyncSMTPPool]:
+        return self._pools.setdefault(asyncio.get_running_loop(), {})
+
+    async def get(self, config: ProfileMail) -> AsyncSMTPPool:
+        pools: Dict[str, AsyncSMTPPool] = self._loop_pools()
+        key: str = str(config.id)
+        pool: Optional[AsyncSMTPPool] = pools.get(key)
+        if pool is not None and pool.fingerprint == connection_fingerprint(config):
+            return pool
+        stale, pools[key] = pool, AsyncSMTPPool(config, self.max_size, self.idle_timeout)
+        if stale is not None:
+            await stale.close()
+        return pools[key]
+
+    @asynccontextmanager
+    async def connection(self, config: ProfileMail) -> AsyncIterator[AsyncSMTPConnection]:
+        async with (await self.get(config)).connection() as connection:
+            yield connection
+
+    async def close_all(self) -> None:
+        pools: Dict[str, AsyncSMTPPool] = self._pools.pop(asyncio.get_running_loop(), {})
+        for pool in pools.values():
+            await pool.close()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {key: pool.stats() for pools in list(self._pools.values()) for key, pool in pools.items()}
+
+
+async_smtp_pools = AsyncSMTPPoolRegistry(max_size=settings.SMTP_POOL_MAX_SIZE,
+                                         idle_timeout=settings.SMTP_POOL_IDLE_TIMEOUT)
@@ -0,0 +1,102 @@
+from inspect import iscoroutinefunction
+
+from adrf.decorators import api_view as adrf_api_view
+from adrf.views import APIView as AdrfAPIView
+from asgiref.sync import sync_to_async
+from rest_framework import exceptions, permissions
+
+# встроенные права DRF смотрят только на request.user и метод, их можно звать прямо в event loop
+NON_BLOCKING_PERMISSIONS = (permissions.AllowAny, permissions.IsAuthenticated,
+                            permissions.IsAdminUser, permissions.IsAuthenticatedOrReadOnly)
+
+
+class AsyncAPIView(AdrfAPIView):
+    """
+    APIView из adrf, который проводит аутентификацию и проверку прав прямо в event loop.
+    adrf выполняет initial() целиком через sync_to_async, здесь же ожидаются
+    aauthenticate и ahas_permission, а классы без асинхронных методов
+    вызываются через sync_to_async как и раньше
+    """
+
+    async def async_dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await self.ainitial(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            if iscoroutinefunction(handler):
+                response = await handler(request, *args, **kwargs)
+            else:
+                response = await sync_to_async(handler)(request, *args, **kwargs)
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def ainitial(self, request, *args, **kwargs) -> None:
+        """То же, что APIView.initial, но с асинхронной аутентификацией и проверкой прав"""
+        self.format_kwarg = self.get_format_suffix(**kwargs)
+
+        neg = self.perform_content_negotiation(request)
+        request.accepted_renderer, request.accepted_media_type = neg
+
+        version, scheme = self.determine_version(request, *args, **kwargs)
+        request.version, request.versioning_scheme = version, scheme
+
+        await self.aperform_authentication(request)
+        await self.acheck_permissions(request)
+        self.check_throttles(request)
+
+    async def aperform_authentication(self, request) -> None:
+        for authenticator in request.authenticators:
+            try:
+                if hasattr(authenticator, 'aauthenticate'):
+                    user_auth_tuple = await authenticator.aauthenticate(request)
+                else:
+                    user_auth_tuple = await sync_to_async(authenticator.authenticate)(request)
+            except exceptions.APIException:
+                request._not_authenticated()
+                raise
+
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+
+        request._not_authenticated()
+
+    async def acheck_permissions(self, request) -> None:
+        for permission in self.get_permissions():
+            if hasattr(permission, 'ahas_permission'):
+                allowed: bool = await permission.ahas_permission(request, self)
+            elif isinstance(permission, NON_BLOCKING_PERMISSIONS):
+                allowed = permission.has_permission(request, self)
+            else:
+                allowed = await sync_to_async(permission.has_permission)(request, self)
+            if not allowed:
+                self.permission_denied(request,
+                                       message=getattr(permission, 'message', None),
+                                       code=getattr(permission, 'code', None))
+
+
+def async_api_view(http_method_names=None):
+    """api_view из adrf, построенный на AsyncAPIView"""
+
+    def decorator(func):
+        wrapped_class = adrf_api_view(http_method_names)(func).cls
+        view_class = type(wrapped_class.__name__, (AsyncAPIView, wrapped_class),
+                          {'__doc__': func.__doc__, '__module__': func.__module__})
+        return view_class.as_view()
+
+    return decorator
@@ -1,11 +1,20 @@
-from typing import Dict, Optional
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
 
 import jwt
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.db.models import QuerySet
 from django.middleware.csrf import CsrfViewMiddleware
 from rest_framework import exceptions
-from rest_framework.authentication import BaseAuthentication
+from rest_framework.authentication import (BaseAuthentication,
+                                           BasicAuthentication,
+                                           get_authorization_header)
+
+from .cache import (ACCOUNT_SNAPSHOT_FIELDS, USER_SNAPSHOT_FIELDS,
+                    AccountSnapshot, UserSnapshot, VerifiedToken, token_cache)
+from .models import Account
 
 
 class CSRFCheck(CsrfViewMiddleware):
@@ -28,31 +37,107 @@ def enforce_csrf(request) -> Optional[exceptions.PermissionDenied]:
     check = CSRFCheck(dummy_get_response)
     check.process_request(request)
     reason = check.process_view(request, None, (), {})
-    print(reason)
     if reason:
         return exceptions.PermissionDenied(f'CSRF Failed: {reason}')
 
 
+@dataclass(slots=True)
+class Principal:
+    """Результат аутентификации на время запроса, доступен в request.auth"""
+    claims: Dict[str, Any]
+    user: User
+    account: Optional[Account]
+
+    @classmethod
+    def from_verified(cls, verified: VerifiedToken) -> 'Principal':
+        user: User = verified.user.to_user()
+        account: Optional[Account] = verified.account.to_account(user) if verified.account else None
+        return cls(claims=verified.payload, user=user, account=account)
+
+
+class AsyncBasicAuthentication(BasicAuthentication):
+    """BasicAuthentication, который в асинхронных представлениях уходит в поток только при заголовке Basic"""
+
+    async def aauthenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != b'basic':
+            return None
+        return await sync_to_async(self.authenticate)(request)
+
+
 class SafeJWTAuthentication(BaseAuthentication):
     def authenticate(self, request):
         """
         Переопределение метода authenticate на аутентификацию по JWT токенам
         """
+        access_token: Optional[str] = self.get_access_token(request)
+        if access_token is None:
+            return None
+
+        verified: Optional[VerifiedToken] = token_cache.get(access_token)
+        if verified is None:
+            payload: Dict[str] = self.decode_token(access_token)
+            verified = self.build_verified(payload, self.user_query(payload).first())
+            token_cache.set(access_token, verified)
+
+        enforce_csrf(request)
+        principal: Principal = Principal.from_verified(verified)
+        return principal.user, principal
+
+    async def aauthenticate(self, request):
+        """
+        Асинхронный вариант authenticate для асинхронных представлений,
+        при попадании в кеш не покидает event loop
+        """
+        access_token: Optional[str] = self.get_access_token(request)
+        if access_token is None:
+            return None
+
+        verified: Optional[VerifiedToken] = await token_cache.aget(access_token)
+        if verified is None:
+            payload: Dict[str] = self.decode_token(access_token)
+            verified = self.build_verified(payload, await self.user_query(payload).afirst())
+            await token_cache.aset(access_token, verified)
+
+        enforce_csrf(request)
+        principal: Principal = Principal.from_verified(verified)
+        return principal.user, principal
+
+    @staticmethod
+    def get_access_token(request) -> Optional[str]:
         authorization_header: Optional[str] = request.headers.get('Authorization')
 
         if not authorization_header:
             return None
         try:
-            access_token: Optional[str] = authorization_header.split()[1]
-            payload: Dict[str] = jwt.decode(access_token, settings.SECRET_KEY, algorithms=['HS256'])
-        except jwt.ExpiredSignatureError:
-            raise exceptions.AuthenticationFailed('access_token expired')
+            return authorization_header.split()[1]
         except IndexError:
             raise exceptions.AuthenticationFailed('Token prefix missing')
 
-        user: User = User.objects.get(id=payload['user_id'])
-        if user is None:
+    @staticmethod
+    def decode_token(access_token: str) -> Dict[str, Any]:
+        try:
+            return jwt.decode(access_token, settings.SECRET_KEY, algorithms=['HS256'])
+        except jwt.ExpiredSignatureError:
+            raise exceptions.AuthenticationFailed('access_token expired')
+
+    @staticmethod
+    def user_query(payload: Dict[str, Any]) -> QuerySet:
+        """
+        Один запрос за снимками пользователя и его аккаунта. Аккаунтов у пользователя может быть несколько:
+        первым берется админский, как в проверке IsAdminAccount без кеша, затем самый ранний
+        """
+        return User.objects.filter(id=payload['user_id']).values(
+            *USER_SNAPSHOT_FIELDS, *(f'account__{field}' for field in ACCOUNT_SNAPSHOT_FIELDS)) \
+            .order_by('-account__is_admin', 'account__id')
+
+    @staticmethod
+    def build_verified(payload: Dict[str, Any], row: Optional[Dict]) -> VerifiedToken:
+        if row is None:
             raise exceptions.AuthenticationFailed('User not found')
 
-        enforce_csrf(request)
-        return user, None
+        user = UserSnapshot(**{field: row[field] for field in USER_SNAPSHOT_FIELDS})
+        account: Optional[AccountSnapshot] = None
+        if row['account__id'] is not None:
+            account = AccountSnapshot(**{field: row[f'account__{field}'] for field in ACCOUNT_SNAPSHOT_FIELDS})
+        return VerifiedToken(payload=payload, user=user, account=account)
@@ -0,0 +1,311 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+import redis
+import redis.asyncio
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Model
+
+from .models import Account
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+redis_obj = redis.StrictRedis(host=settings.REDIS_HOST,
+                              port=settings.REDIS_PORT,
+                              db=settings.REDIS_DB,
+                              decode_responses=True)
+
+
+_async_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, redis.asyncio.StrictRedis]' = \
+    weakref.WeakKeyDictionary()
+
+
+def get_async_redis() -> redis.asyncio.StrictRedis:
+    """Асинхронный клиент Redis, свой для каждого event loop, потому что соединения к нему привязаны"""
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    client: Optional[redis.asyncio.StrictRedis] = _async_clients.get(loop)
+    if client is None:
+        # ограниченный пул: при сотнях конкурентных запросов они ждут соединение, а не открывают новые
+        pool = redis.asyncio.BlockingConnectionPool(host=settings.REDIS_HOST,
+                                                    port=settings.REDIS_PORT,
+                                                    db=settings.REDIS_DB,
+                                                    max_connections=settings.REDIS_ASYNC_MAX_CONNECTIONS,
+                                                    decode_responses=True)
+        client = redis.asyncio.StrictRedis(connection_pool=pool)
+        _async_clients[loop] = client
+    return client
+
+
+class LRUCache(Generic[T]):
+    """Ограниченный по размеру LRU-кеш внутри процесса с истечением записей по времени"""
+    __slots__ = ("max_size", "_data", "_lock")
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: OrderedDict[Hashable, Tuple[float, T]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[T]:
+        with self._lock:
+            item: Optional[Tuple[float, T]] = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: T, expires_at: float) -> None:
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate: Callable[[T], bool]) -> None:
+        """Удаляет все записи, значения которых удовлетворяют условию"""
+        with self._lock:
+            for key in [k for k, (_, v) in self._data.items() if predicate(v)]:
+                del self._data[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def from_snapshot(model: type[Model], snapshot: Any, fields: Tuple[str, ...]) -> Model:
+    """
+    Собирает экземпляр модели как загруженный из бд с отложенными остальными полями,
+    поэтому save() обновит только эти поля и не затрет остальные
+    """
+    # from_db ожидает значения в порядке полей модели
+    values = [getattr(snapshot, field.attname) for field in model._meta.concrete_fields if field.attname in fields]
+    return model.from_db('default', fields, values)
+
+
+# Поля пользователя и аккаунта, которых достаточно для аутентификации и проверки прав
+USER_SNAPSHOT_FIELDS: Tuple[str, ...] = ('id', 'username', 'email', 'is_active', 'is_staff', 'is_superuser')
+ACCOUNT_SNAPSHOT_FIELDS: Tuple[str, ...] = ('id', 'user_id', 'is_admin')
+
+
+@dataclass(frozen=True, slots=True)
+class UserSnapshot:
+    id: int
+    username: str
+    email: str
+    is_active: bool
+    is_staff: bool
+    is_superuser: bool
+
+    def to_user(self) -> User:
+        return from_snapshot(User, self, USER_SNAPSHOT_FIELDS)
+
+
+@dataclass(frozen=True, slots=True)
+class AccountSnapshot:
+    id: int
+    user_id: int
+    is_admin: bool
+
+    def to_account(self, user: User) -> Account:
+        account: Account = from_snapshot(Account, self, ACCOUNT_SNAPSHOT_FIELDS)
+        account.user = user
+        return account
+
+
+@dataclass(frozen=True, slots=True)
+class VerifiedToken:
+    payload: Dict[str, Any]
+    user: UserSnapshot
+    account: Optional[AccountSnapshot] = None
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class VerifiedTokenCache:
+    """
+    Кеш проверенных access токенов: локальный LRU в каждом воркере
+    и опциональный общий уровень в Redis. Сброс токенов пользователя рассылается в канал,
+    по которому все воркеры удаляют его записи из локального кеша, как в ProfileMailConfigCache
+    """
+    redis_prefix = 'jwt:verified'
+    channel = 'jwt:verified:invalidate'
+
+    def __init__(self, max_size: int, local_ttl: int, use_redis: bool, listen: bool = True):
+        self.local: LRUCache[VerifiedToken] = LRUCache(max_size)
+        self.local_ttl = local_ttl
+        self.use_redis = use_redis
+        self.listen = listen
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self._listener_pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _local_expires_at(self, exp: float) -> float:
+        # при общем уровне локальная запись живет недолго, чтобы инвалидация
+        # в другом воркере доходила сюда не позже local_ttl
+        if self.use_redis:
+            return min(exp, time.time() + self.local_ttl)
+        return exp
+
+    def _get_local(self, digest: str) -> Optional[VerifiedToken]:
+        self.ensure_listener()
+        verified: Optional[VerifiedToken] = self.local.get(digest)
+        if verified is not None:
+            self.hits += 1
+        elif not self.use_redis:
+            self.misses += 1
+        return verified
+
+    def _from_redis(self, digest: str, raw: Optional[str]) -> Optional[VerifiedToken]:
+        if raw is None:
+            self.misses += 1
+            return None
+        data: Dict[str, Any] = json.loads(raw)
+        verified = VerifiedToken(payload=data['payload'], user=UserSnapshot(**data['user']),
+                                 account=AccountSnapshot(**data['account']) if data['account'] else None)
+        self.local.set(digest, verified, self._local_expires_at(verified.payload['exp']))
+        self.redis_hits += 1
+        return verified
+
+    def _store(self, pipe, digest: str, verified: VerifiedToken) -> bool:
+        """Кладет запись в локальный кеш и ставит команды записи в Redis в конвейер"""
+        exp: float = verified.payload['exp']
+        self.local.set(digest, verified, self._local_expires_at(exp))
+        ttl: int = int(exp - time.time())
+        if not self.use_redis or ttl <= 0:
+            return False
+        user_key: str = f'{self.redis_prefix}:user:{verified.user.id}'
+        pipe.set(f'{self.redis_prefix}:{digest}', json.dumps(asdict(verified)), ex=ttl)
+        pipe.sadd(user_key, digest)
+        # новые токены выпускаются позже, поэтому живут дольше прежних
+        pipe.expire(user_key, ttl)
+        return True
+
+    def get(self, token: str) -> Optional[VerifiedToken]:
+        digest: str = token_digest(token)
+        verified: Optional[VerifiedToken] = self._get_local(digest)
+        if verified is not None or not self.use_redis:
+            return verified
+        try:
+            raw: Optional[str] = redis_obj.get(f'{self.redis_prefix}:{digest}')
+        except redis.RedisError as e:
+            logger.warning(f'Кеш токенов в Redis недоступен: {e}')
+            raw = None
+        return self._from_redis(digest, raw)
+
+    async def aget(self, token: str) -> Optional[VerifiedToken]:
+        digest: str = token_digest(token)
+        verified: Optional[VerifiedToken] = self._get_local(digest)
+        if verified is not None or not self.use_redis:
+            return verified
+        try:
+            raw: Optional[str] = await get_async_redis().get(f'{self.redis_prefix}:{digest}')
+        except redis.RedisError as e:
+            logger.warning(f'Кеш токенов в Redis недоступен: {e}')
+            raw = None
+        return self._from_redis(digest, raw)
+
+    def set(self, token: str, verified: VerifiedToken) -> None:
+        pipe = redis_obj.pipeline(transaction=False)
+        if self._store(pipe, token_digest(token), verified):
+            try:
+                pipe.execute()
+            except redis.RedisError as e:
+                logger.warning(f'Кеш токенов в Redis недоступен: {e}')
+
+    async def aset(self, token: str, verified: VerifiedToken) -> None:
+        pipe = get_async_redis().pipeline(transaction=False)
+        if self._store(pipe, token_digest(token), verified):
+            try:
+                await pipe.execute()
+            except redis.RedisError as e:
+                logger.warning(f'Кеш токенов в Redis недоступен: {e}')
+
+    def invalidate_user(self, user_id: int) -> None:
+        """Сбрасывает все закешированные токены пользователя во всех воркерах"""
+        self.drop_local(user_id)
+        try:
+            if self.use_redis:
+                user_key: str = f'{self.redis_prefix}:user:{user_id}'
+                digests = redis_obj.smembers(user_key)
+                redis_obj.delete(user_key, *(f'{self.redis_prefix}:{digest}' for digest in digests))
+            redis_obj.publish(self.channel, user_id)
+        except redis.RedisError as e:
+            logger.warning(f'Не удалось сбросить кеш токенов в Redis: {e}')
+
+    async def ainvalidate_user(self, user_id: int) -> None:
+        self.drop_local(user_id)
+        client = get_async_redis()
+        try:
+            if self.use_redis:
+                user_key: str = f'{self.redis_prefix}:user:{user_id}'
+                digests = await client.smembers(user_key)
+                await client.delete(user_key, *(f'{self.redis_prefix}:{digest}' for digest in digests))
+            await client.publish(self.channel, user_id)
+        except redis.RedisError as e:
+            logger.warning(f'Не удалось сбросить кеш токенов в Redis: {e}')
+
+    def drop_local(self, user_id: int) -> None:
+        self.local.delete_where(lambda verified: verified.user.id == user_id)
+
+    def ensure_listener(self) -> None:
+        """Поток подписки на канал сброса, один на процесс, перезапускается после fork"""
+        if not self.listen or self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            threading.Thread(target=self._listen, name='jwt-cache-listener', daemon=True).start()
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                pubsub = redis_obj.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # за время переподключения сброс мог потеряться
+                self.local.clear()
+                for message in pubsub.listen():
+                    self.drop_local(int(message['data']))
+            except redis.RedisError as e:
+                logger.warning(f'Подписка на сброс кеша токенов прервана: {e}')
+                time.sleep(1)
+
+    def clear(self) -> None:
+        self.local.clear()
+        self.hits = self.redis_hits = self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'redis_hits': self.redis_hits,
+                'misses': self.misses, 'size': len(self.local)}
+
+
+token_cache = VerifiedTokenCache(max_size=settings.JWT_CACHE_MAX_SIZE,
+                                 local_ttl=settings.JWT_CACHE_LOCAL_TTL,
+                                 use_redis=settings.JWT_CACHE_USE_REDIS,
+                                 listen=settings.JWT_CACHE_LISTEN)
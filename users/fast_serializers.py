@@ -0,0 +1,205 @@
+import threading
+from dataclasses import dataclass
+from datetime import datetime, tzinfo
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+from .serializers import (AccountSerializer, CompanySerializer,
+                          ProfileSerializer, media_url, srcset_urls,
+                          thumbnail_url)
+
+
+@dataclass(frozen=True, slots=True)
+class Context:
+    """Общее для всех объектов одного вызова: request для абсолютных URL и текущий часовой пояс"""
+    request: Any
+    timezone: Optional[tzinfo]
+
+    @classmethod
+    def current(cls, request=None, dates: bool = True) -> 'Context':
+        # get_current_timezone() читает asgiref Local, это дороже самого поля, поэтому один раз на вызов
+        return cls(request=request, timezone=timezone.get_current_timezone() if dates and settings.USE_TZ else None)
+
+
+# значение поля и Context -> представление, как field.to_representation()
+Converter = Callable[[Any, Context], Any]
+# виды полей: обычное, SerializerMethodField, вложенный сериализатор
+FIELD, COMPUTED, NESTED = range(3)
+
+
+def identity(value, context: Context) -> Any:
+    return value
+
+
+def converter(field: serializers.Field) -> Converter:
+    """Представление значения поля DRF без вызова его методов, где это возможно"""
+    if isinstance(field, serializers.FileField):
+        # значение - имя файла, и у экземпляра, и у строки values()
+        return lambda name, context: media_url(name, context.request) if name else None
+    if isinstance(field, serializers.CharField):
+        return lambda value, context: str(value)
+    if isinstance(field, serializers.IntegerField):
+        return lambda value, context: int(value)
+    if isinstance(field, serializers.BooleanField):
+        return lambda value, context: bool(value)
+    if isinstance(field, serializers.UUIDField) and field.uuid_format == 'hex_verbose':
+        return lambda value, context: str(value)
+    if isinstance(field, serializers.JSONField) and not field.binary:
+        return identity
+    if isinstance(field, serializers.DateTimeField) and not hasattr(field, 'timezone') \
+            and (getattr(field, 'format', api_settings.DATETIME_FORMAT) or '').lower() == ISO_8601:
+        def convert_datetime(value: datetime, context: Context) -> str:
+            if context.timezone is not None and timezone.is_aware(value):
+                value = value.astimezone(context.timezone)
+            else:
+                value = field.enforce_timezone(value)
+            representation: str = value.isoformat()
+            return representation[:-6] + 'Z' if representation.endswith('+00:00') else representation
+        return convert_datetime
+    return lambda value, context: field.to_representation(value)
+
+
+class FastSerializer:
+    """
+    Read-only сериализация по полям DRF сериализатора, разобранным один раз на класс.
+    Вывод совпадает с serializer_class(...).data, но поля не строятся заново на каждый объект.
+    Работает с экземплярами моделей и со строками .values(*cls.values_fields())
+    """
+    serializer_class: Type[serializers.Serializer]
+    # вложенные сериализаторы: имя поля -> FastSerializer
+    nested: Dict[str, Type['FastSerializer']] = {}
+    # SerializerMethodField: имя поля -> (поля модели, функция(значения полей..., request))
+    computed: Dict[str, Tuple[Tuple[str, ...], Callable]] = {}
+
+    # заполняются compile(): поля в порядке сериализатора, (имя, вид, источник, конвертер / функция / класс)
+    _fields: List[Tuple[str, int, Any, Any]]
+    _files: frozenset
+    # есть ли даты, которым нужен текущий часовой пояс
+    _dates: bool
+    # общий для всех классов: compile() вложенных сериализаторов идет под ним же
+    _compile_lock = threading.RLock()
+
+    @classmethod
+    def compile(cls) -> None:
+        # _fields присваивается последним, по нему остальные потоки считают разбор законченным
+        if '_fields' in cls.__dict__:
+            return
+        with cls._compile_lock:
+            if '_fields' not in cls.__dict__:
+                cls._compile()
+
+    @classmethod
+    def _compile(cls) -> None:
+        fields: List[Tuple[str, int, Any, Any]] = []
+        files: set = set()
+        dates: bool = False
+        for name, field in cls.serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.SerializerMethodField):
+                if name not in cls.computed:
+                    raise ImproperlyConfigured(f'{cls.__name__}: нет функции для поля {name}')
+                fields.append((name, COMPUTED, *cls.computed[name]))
+            elif isinstance(field, serializers.BaseSerializer):
+                cls.nested[name].compile()
+                fields.append((name, NESTED, field.source, cls.nested[name]))
+                dates = dates or cls.nested[name]._dates
+            else:
+                if isinstance(field, serializers.FileField):
+                    files.add(field.source)
+                dates = dates or isinstance(field, serializers.DateTimeField)
+                fields.append((name, FIELD, field.source, converter(field)))
+        cls._files, cls._dates = frozenset(files), dates
+        cls._fields = fields
+
+    @classmethod
+    def values_fields(cls) -> List[str]:
+        """Аргументы .values() для from_row(): поля и, с префиксом, поля вложенных моделей"""
+        cls.compile()
+        names: List[str] = []
+        for _, kind, source, nested in cls._fields:
+            if kind == NESTED:
+                # сам внешний ключ нужен, чтобы отличить отсутствующую связь
+                names.append(source)
+                names.extend(f'{source}__{name}' for name in nested.values_fields())
+            else:
+                names.extend(name for name in (source if kind == COMPUTED else (source,)) if name not in names)
+        return names
+
+    @classmethod
+    def attribute(cls, instance, source: str) -> Any:
+        value = getattr(instance, source)
+        # у файлов значение - имя, как в строке values()
+        return value.name if source in cls._files else value
+
+    @classmethod
+    def represent_instance(cls, instance, context: Context) -> Dict[str, Any]:
+        data: Dict[str, Any] = {}
+        for name, kind, source, convert in cls._fields:
+            if kind == FIELD:
+                value = cls.attribute(instance, source)
+                data[name] = None if value is None else convert(value, context)
+            elif kind == COMPUTED:
+                data[name] = convert(*(cls.attribute(instance, attribute) for attribute in source), context.request)
+            else:
+                value = getattr(instance, source)
+                data[name] = None if value is None else convert.represent_instance(value, context)
+        return data
+
+    @classmethod
+    def represent_row(cls, row: Dict[str, Any], context: Context, prefix: str = '') -> Dict[str, Any]:
+        data: Dict[str, Any] = {}
+        for name, kind, source, convert in cls._fields:
+            if kind == FIELD:
+                value = row[prefix + source]
+                data[name] = None if value is None else convert(value, context)
+            elif kind == COMPUTED:
+                data[name] = convert(*(row[prefix + attribute] for attribute in source), context.request)
+            else:
+                data[name] = None if row[prefix + source] is None \
+                    else convert.represent_row(row, context, f'{prefix}{source}__')
+        return data
+
+    @classmethod
+    def to_representation(cls, instance, request=None) -> Dict[str, Any]:
+        """Представление экземпляра модели: связанные объекты должны быть загружены (select_related)"""
+        cls.compile()
+        return cls.represent_instance(instance, Context.current(request, cls._dates))
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any], request=None) -> Dict[str, Any]:
+        """Представление строки .values(*cls.values_fields())"""
+        cls.compile()
+        return cls.represent_row(row, Context.current(request, cls._dates))
+
+    @classmethod
+    def many(cls, instances: Iterable, request=None) -> List[Dict[str, Any]]:
+        cls.compile()
+        context: Context = Context.current(request, cls._dates)
+        return [cls.represent_instance(instance, context) for instance in instances]
+
+    @classmethod
+    def many_rows(cls, rows: Iterable[Dict[str, Any]], request=None) -> List[Dict[str, Any]]:
+        cls.compile()
+        context: Context = Context.current(request, cls._dates)
+        return [cls.represent_row(row, context) for row in rows]
+
+
+class FastCompanySerializer(FastSerializer):
+    serializer_class = CompanySerializer
+
+
+class FastProfileSerializer(FastSerializer):
+    serializer_class = ProfileSerializer
+    nested = {'company': FastCompanySerializer}
+    computed = {'thumbnail': (('image', 'image_hash'), thumbnail_url),
+                'srcset': (('image_hash',), srcset_urls)}
+
+
+class FastAccountSerializer(FastSerializer):
+    serializer_class = AccountSerializer
@@ -0,0 +1,58 @@
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+def parse_bool(value: str) -> bool:
+    if value.lower() in ('true', '1'):
+        return True
+    if value.lower() in ('false', '0'):
+        return False
+    raise ValueError('Ожидается true или false')
+
+
+def parse_moment(value: str) -> datetime:
+    """Дата и время ISO 8601, дата без времени - ее начало, без часового пояса - в текущем"""
+    moment: Optional[datetime] = parse_datetime(value)
+    if moment is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError('Ожидается дата или дата и время в формате ISO 8601')
+        moment = datetime.combine(date, datetime.min.time())
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+def choice(choices: Iterable[tuple]) -> Callable[[str], str]:
+    values = frozenset(value for value, _ in choices)
+
+    def parse(value: str) -> str:
+        if value not in values:
+            raise ValueError(f'Допустимые значения: {", ".join(sorted(values))}')
+        return value
+    return parse
+
+
+class QueryParamsFilter(BaseFilterBackend):
+    """
+    Фильтры списков из параметров запроса: view.query_filters = {параметр: (lookup, разбор значения)}.
+    Некорректное значение - 400, а не пустой или полный список
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        lookups: Dict[str, Any] = {}
+        errors: Dict[str, str] = {}
+        for param, (lookup, parse) in getattr(view, 'query_filters', {}).items():
+            value: Optional[str] = request.query_params.get(param)
+            if value is None:
+                continue
+            try:
+                lookups[lookup] = parse(value)
+            except ValueError as e:
+                errors[param] = str(e)
+        if errors:
+            raise ValidationError(errors)
+        return queryset.filter(**lookups)
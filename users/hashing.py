@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Deque, Dict, Optional
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from rest_framework import exceptions, status
+
+logger = logging.getLogger(__name__)
+
+
+class HashingBusy(exceptions.APIException):
+    """Очередь хеширования переполнена, клиенту отдается 503 с Retry-After"""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Сервис перегружен, повторите запрос позже'
+    default_code = 'hashing_busy'
+
+    def __init__(self, wait: int):
+        super().__init__()
+        # DRF выставляет заголовок Retry-After по атрибуту wait
+        self.wait = wait
+
+
+def _init_worker() -> None:
+    """Дочерний процесс запускается через spawn и настраивает Django заново"""
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'account_service.settings')
+    django.setup()
+
+
+class HashingExecutor:
+    """
+    Выделенный пул для PBKDF2: хеширование не занимает потоки event loop и sync_to_async.
+    Число ожидающих задач ограничено max_pending, сверх него запрос сразу получает HashingBusy
+    """
+
+    def __init__(self, kind: str, workers: int, max_pending: int):
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending: int = 0
+        self.hashed: int = 0
+        self.rejected: int = 0
+        self._latencies: Deque[float] = deque(maxlen=1000)
+        self._executor: Optional[Executor] = None
+
+    @property
+    def executor(self) -> Executor:
+        # пул создается при первом хешировании, а не при импорте модуля
+        if self._executor is None:
+            if self.kind == 'process':
+                # fork многопоточного воркера uvicorn небезопасен, поэтому spawn
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'),
+                                                     initializer=_init_worker)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hashing')
+        return self._executor
+
+    def retry_after(self) -> int:
+        average: float = sum(self._latencies) / len(self._latencies) if self._latencies else 1.0
+        return max(1, math.ceil(self.pending * average / self.workers))
+
+    async def make_password(self, password: str) -> str:
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            logger.warning(f'Очередь хеширования паролей переполнена: {self.pending} задач')
+            raise HashingBusy(wait=self.retry_after())
+
+        self.pending += 1
+        start: float = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, make_password, password)
+        finally:
+            self.pending -= 1
+            self.hashed += 1
+            self._latencies.append(time.perf_counter() - start)
+
+    def stats(self) -> Dict[str, float]:
+        latencies = sorted(self._latencies)
+        return {'queue_depth': self.pending,
+                'hashed': self.hashed,
+                'rejected': self.rejected,
+                'latency_p50_ms': latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+                'latency_p99_ms': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0}
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+hashing_executor = HashingExecutor(kind=settings.PASSWORD_HASHING_EXECUTOR,
+                                   workers=settings.PASSWORD_HASHING_WORKERS,
+                                   max_pending=settings.PASSWORD_HASHING_MAX_PENDING)
@@ -0,0 +1,244 @@
+import hashlib
+import io
+import logging
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Iterator, Optional, Tuple
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .hashing import _init_worker
+from .models import Profile
+from .profile_cache import profile_cache
+
+logger = logging.getLogger(__name__)
+
+# размеры производных изображений профиля (по большей стороне) и их форматы
+AVATAR_SIZES: Tuple[int, ...] = (256, 128, 64, 32)
+AVATAR_FORMATS: Dict[str, Dict[str, Any]] = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 85, 'optimize': True, 'progressive': True},
+}
+AVATAR_DIR = 'avatars'
+# короткая сторона, до которой изображение уменьшается сразу при декодировании, с запасом для LANCZOS
+DECODE_SIZE: int = AVATAR_SIZES[0] * 2
+
+
+@dataclass(frozen=True, slots=True)
+class ImageJobResult:
+    # сколько задача ждала в очереди и сколько обрабатывалась, секунды
+    queue_lag: float
+    duration: float
+    image_hash: str
+    # производные уже были в хранилище от такого же изображения
+    deduplicated: bool
+
+
+def derivative_name(image_hash: str, size: int, extension: str) -> str:
+    """Путь производной по хешу содержимого: одинаковые загрузки делят одни файлы"""
+    return f'{AVATAR_DIR}/{image_hash[:2]}/{image_hash}/{size}.{extension}'
+
+
+def derivative_names(image_hash: str) -> Iterator[Tuple[str, int, str]]:
+    for extension in AVATAR_FORMATS:
+        for size in AVATAR_SIZES:
+            yield extension, size, derivative_name(image_hash, size, extension)
+
+
+def hash_file(file) -> str:
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def check_pixels(image: Image) -> None:
+    """Размеры известны из заголовка, поэтому decompression bomb отсекается до декодирования"""
+    if image.width * image.height > settings.PROFILE_IMAGE_MAX_PIXELS:
+        raise Image.DecompressionBombError(f'Изображение {image.width}x{image.height} больше '
+                                           f'{settings.PROFILE_IMAGE_MAX_PIXELS} пикселей')
+
+
+def decode(file) -> Image:
+    """
+    Декодирует изображение с ограничением памяти: JPEG сразу в масштабе 1/2..1/8 (draft),
+    остальные форматы уменьшаются reduce сразу после декодирования
+    """
+    image: Image = Image.open(file)
+    check_pixels(image)
+    image.draft(None, (DECODE_SIZE, DECODE_SIZE))
+    image.load()
+    return image
+
+
+def render_derivatives(image: Image) -> Iterator[Tuple[str, int, bytes]]:
+    """Все размеры и форматы из одного декодирования, каждый размер уменьшается из предыдущего"""
+    # прозрачность сохраняет только WebP, для JPEG фон белый
+    has_alpha: bool = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    mode: str = 'RGBA' if has_alpha else 'RGB'
+    # convert всегда копирует, на несжатом полноразмерном изображении это лишние сотни МБ
+    current: Image = image if image.mode == mode else image.convert(mode)
+    factor: int = min(current.size) // DECODE_SIZE
+    if factor >= 2:
+        current = current.reduce(factor)
+    # поворот по EXIF уже на уменьшенном изображении
+    current = ImageOps.exif_transpose(current)
+    for size in AVATAR_SIZES:
+        current = current.copy()
+        current.thumbnail((size, size), Image.Resampling.LANCZOS)
+        flat: Image = current
+        if has_alpha:
+            flat = Image.new('RGB', current.size, 'white')
+            flat.paste(current, mask=current.getchannel('A'))
+        for extension, options in AVATAR_FORMATS.items():
+            buffer = io.BytesIO()
+            (current if extension == 'webp' else flat).save(buffer, **options)
+            yield extension, size, buffer.getvalue()
+
+
+def save_derivative(name: str, content: bytes) -> None:
+    saved: str = default_storage.save(name, ContentFile(content))
+    if saved != name:
+        # такое же изображение параллельно обработал другой воркер
+        default_storage.delete(saved)
+
+
+def make_derivatives(image_name: str) -> Tuple[str, bool]:
+    """Производные изображения в хранилище, возвращает хеш содержимого и был ли он уже обработан"""
+    with default_storage.open(image_name, 'rb') as file:
+        image_hash: str = hash_file(file)
+        # последней записывается именно эта производная, значит набор полный
+        *_, (_, _, last_name) = derivative_names(image_hash)
+        if default_storage.exists(last_name):
+            return image_hash, True
+        image: Image = decode(file)
+    rendered: Dict[Tuple[str, int], bytes] = {(extension, size): content
+                                              for extension, size, content in render_derivatives(image)}
+    for extension, size, name in derivative_names(image_hash):
+        if not default_storage.exists(name):
+            save_derivative(name, rendered[extension, size])
+    return image_hash, False
+
+
+def process_profile_image(profile_uuid: str, image_name: str, enqueued_at: float) -> ImageJobResult:
+    """Задача воркера: производные изображения профиля"""
+    started_at: float = time.time()
+    try:
+        image_hash, deduplicated = make_derivatives(image_name)
+        # пока задача ждала, пользователь мог загрузить новое изображение, его хеш не трогаем.
+        # Производные не удаляются: по хешу их могут делить другие профили
+        if Profile.objects.filter(uuid=profile_uuid, image=image_name).update(image_hash=image_hash,
+                                                                           updated=timezone.now()):
+            # update() не вызывает сигналов и не трогает auto_now, а srcset входит в JSON и версию профиля
+            profile_cache.invalidate([profile_uuid])
+        return ImageJobResult(queue_lag=started_at - enqueued_at, duration=time.time() - started_at,
+                              image_hash=image_hash, deduplicated=deduplicated)
+    finally:
+        close_old_connections()
+
+
+class ImageProcessor:
+    """
+    Фоновая обработка изображений профилей: 'process' или 'thread' пул, 'sync' выполняет задачу сразу.
+    Пока производные не готовы, профиль отдает оригинал. Сверх max_pending задачи отбрасываются,
+    их догоняет manage.py process_profile_images
+    """
+
+    def __init__(self, kind: str, workers: int, max_pending: int):
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending: int = 0
+        self.processed: int = 0
+        self.deduplicated: int = 0
+        self.failed: int = 0
+        self.dropped: int = 0
+        self._lags: Deque[float] = deque(maxlen=1000)
+        self._durations: Deque[float] = deque(maxlen=1000)
+        self._executor: Optional[Executor] = None
+        # завершение задач приходит из потоков пула
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'),
+                                                     initializer=_init_worker)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='images')
+        return self._executor
+
+    def submit(self, profile_uuid, image_name: str) -> bool:
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.dropped += 1
+                logger.warning(f'Очередь обработки изображений переполнена, профиль {profile_uuid} пропущен')
+                return False
+            self.pending += 1
+
+        enqueued_at: float = time.time()
+        if self.kind == 'sync':
+            future: Future = Future()
+            try:
+                future.set_result(process_profile_image(str(profile_uuid), image_name, enqueued_at))
+            except Exception as e:
+                future.set_exception(e)
+            self._done(future)
+            return True
+
+        self.executor.submit(process_profile_image, str(profile_uuid), image_name, enqueued_at) \
+            .add_done_callback(self._done)
+        return True
+
+    def _done(self, future: Future) -> None:
+        error: Optional[BaseException] = None if future.cancelled() else future.exception()
+        with self._lock:
+            self.pending -= 1
+            if future.cancelled() or error is not None:
+                self.failed += 1
+            else:
+                result: ImageJobResult = future.result()
+                self.processed += 1
+                self.deduplicated += result.deduplicated
+                self._lags.append(result.queue_lag)
+                self._durations.append(result.duration)
+        if error is not None:
+            logger.error(f'Ошибка обработки изображения профиля: {error!r}')
+
+    @staticmethod
+    def percentile(values: Deque[float], fraction: float) -> float:
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000 if ordered else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {'queue_depth': self.pending,
+                'processed': self.processed,
+                'deduplicated': self.deduplicated,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'queue_lag_p50_ms': self.percentile(self._lags, 0.5),
+                'queue_lag_p99_ms': self.percentile(self._lags, 0.99),
+                'processing_p50_ms': self.percentile(self._durations, 0.5),
+                'processing_p99_ms': self.percentile(self._durations, 0.99)}
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+image_processor = ImageProcessor(kind=settings.PROFILE_IMAGE_EXECUTOR,
+                                 workers=settings.PROFILE_IMAGE_WORKERS,
+                                 max_pending=settings.PROFILE_IMAGE_MAX_PENDING)
@@ -0,0 +1,205 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import serializers
+
+from .cache import LRUCache, get_async_redis
+from .models import ProfileMail
+from .smtp_pool import smtp_pools
+
+logger = logging.getLogger(__name__)
+
+redis_obj = redis.StrictRedis(host=settings.REDIS_HOST,
+                              port=settings.REDIS_PORT,
+                              db=settings.REDIS_DB,
+                              decode_responses=True)
+
+ACTIVE = 'active'
+
+
+class ProfileMailConfigCache:
+    """
+    Конфигурации ProfileMail в памяти процесса и в Redis. Меняются они редко, поэтому на пути отправки
+    письма чтение не ходит в бд. Сохранение и удаление профиля (сигналы post_save/post_delete)
+    увеличивают поколение в Redis и рассылают сообщение в канал, по которому все процессы очищают
+    локальный кеш. Записи в Redis лежат под поколением, прочитанным до запроса в бд, а локальные
+    сохраняются, только если локальное поколение не сменилось: загрузка, которую обогнало изменение,
+    не вернет старый профиль в кеш, как и в ProfileCache.
+    Изменения через QuerySet.update() сигналов не вызывают, их догонит истечение local_ttl
+    """
+    prefix = 'mail:config'
+    channel = 'mail:config:invalidate'
+    generation_key = 'mail:config:generation'
+
+    def __init__(self, local_ttl: float, redis_ttl: int, listen: bool = True):
+        self.local: LRUCache[ProfileMail] = LRUCache(max_size=128)
+        self.local_ttl = local_ttl
+        self.redis_ttl = redis_ttl
+        self.listen = listen
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self._listener_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        # меняется при каждом сбросе локального кеша, под _local_lock
+        self.local_generation: int = 0
+        self._local_lock = threading.Lock()
+
+    def _key(self, profile_mail_id: Optional[uuid.UUID]) -> str:
+        return ACTIVE if profile_mail_id is None else str(profile_mail_id)
+
+    def _entry_key(self, generation: str, key: str) -> str:
+        return f'{self.prefix}:{generation}:{key}'
+
+    @staticmethod
+    def dumps(config: ProfileMail) -> str:
+        return serializers.serialize('json', [config])
+
+    @staticmethod
+    def loads(raw: str) -> ProfileMail:
+        return next(serializers.deserialize('json', raw)).object
+
+    @staticmethod
+    def query(profile_mail_id: Optional[uuid.UUID]) -> ProfileMail:
+        if profile_mail_id is None:
+            return ProfileMail.objects.get(email_act_profile=True)
+        return ProfileMail.objects.get(id__exact=profile_mail_id)
+
+    def _get_local(self, key: str) -> Optional[ProfileMail]:
+        self.ensure_listener()
+        config: Optional[ProfileMail] = self.local.get(key)
+        if config is not None:
+            self.hits += 1
+        return config
+
+    def _set_local(self, key: str, config: ProfileMail, generation: int) -> ProfileMail:
+        expires_at: float = time.time() + self.local_ttl
+        with self._local_lock:
+            # за время загрузки кеш сбросили: профиль мог измениться, сохранять его нельзя
+            if generation == self.local_generation:
+                self.local.set(key, config, expires_at)
+                # активный профиль доступен и по своему id
+                self.local.set(str(config.id), config, expires_at)
+        return config
+
+    def get(self, profile_mail_id: Optional[uuid.UUID] = None) -> ProfileMail:
+        """Профиль по id или активный профиль, если id не указан"""
+        key: str = self._key(profile_mail_id)
+        config: Optional[ProfileMail] = self._get_local(key)
+        if config is not None:
+            return config
+        local_generation: int = self.local_generation
+        generation: Optional[str] = None
+        try:
+            generation = redis_obj.get(self.generation_key) or '0'
+            raw: Optional[str] = redis_obj.get(self._entry_key(generation, key))
+            if raw is not None:
+                self.redis_hits += 1
+                return self._set_local(key, self.loads(raw), local_generation)
+        except redis.RedisError as e:
+            logger.warning(f'Кеш профилей почты в Redis недоступен: {e}')
+        self.misses += 1
+        config = self.query(profile_mail_id)
+        if generation is not None:
+            self._store(generation, key, config)
+        return self._set_local(key, config, local_generation)
+
+    async def aget(self, profile_mail_id: Optional[uuid.UUID] = None) -> ProfileMail:
+        key: str = self._key(profile_mail_id)
+        config: Optional[ProfileMail] = self._get_local(key)
+        if config is not None:
+            return config
+        local_generation: int = self.local_generation
+        generation: Optional[str] = None
+        try:
+            client = get_async_redis()
+            generation = await client.get(self.generation_key) or '0'
+            raw: Optional[str] = await client.get(self._entry_key(generation, key))
+            if raw is not None:
+                self.redis_hits += 1
+                return self._set_local(key, self.loads(raw), local_generation)
+        except redis.RedisError as e:
+            logger.warning(f'Кеш профилей почты в Redis недоступен: {e}')
+        self.misses += 1
+        config = await sync_to_async(self.query)(profile_mail_id)
+        if generation is not None:
+            await sync_to_async(self._store)(generation, key, config)
+        return self._set_local(key, config, local_generation)
+
+    def _store(self, generation: str, key: str, config: ProfileMail) -> None:
+        """Записи под поколением, прочитанным до запроса в бд: после сброса их уже никто не прочитает"""
+        raw: str = self.dumps(config)
+        try:
+            pipe = redis_obj.pipeline(transaction=False)
+            pipe.set(self._entry_key(generation, key), raw, ex=self.redis_ttl)
+            pipe.set(self._entry_key(generation, str(config.id)), raw, ex=self.redis_ttl)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f'Кеш профилей почты в Redis недоступен: {e}')
+
+    def invalidate(self, profile_mail_id: uuid.UUID) -> None:
+        """
+        Сбрасывает кеш во всех процессах: новое поколение делает недоступными все записи Redis,
+        включая ссылку на активный профиль, старые истекут по redis_ttl
+        """
+        self.drop_local(str(profile_mail_id))
+        try:
+            pipe = redis_obj.pipeline(transaction=False)
+            pipe.incr(self.generation_key)
+            pipe.publish(self.channel, str(profile_mail_id))
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f'Не удалось сбросить кеш профилей почты в Redis: {e}')
+
+    def drop_local(self, profile_mail_id: str) -> None:
+        # профилей единицы, поэтому локальный кеш очищается целиком вместе с активным
+        self._clear_local()
+        smtp_pools.discard(profile_mail_id)
+
+    def _clear_local(self) -> None:
+        with self._local_lock:
+            self.local_generation += 1
+            self.local.clear()
+
+    def ensure_listener(self) -> None:
+        """Поток подписки на канал сброса, один на процесс, перезапускается после fork"""
+        if not self.listen or self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            threading.Thread(target=self._listen, name='mail-config-listener', daemon=True).start()
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                pubsub = redis_obj.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # за время переподключения сброс мог потеряться
+                self._clear_local()
+                for message in pubsub.listen():
+                    self.drop_local(message['data'])
+            except redis.RedisError as e:
+                logger.warning(f'Подписка на сброс профилей почты прервана: {e}')
+                time.sleep(1)
+
+    def clear(self) -> None:
+        self._clear_local()
+        self.hits = self.redis_hits = self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'redis_hits': self.redis_hits,
+                'misses': self.misses, 'size': len(self.local)}
+
+
+mail_config_cache = ProfileMailConfigCache(local_ttl=settings.MAIL_CONFIG_LOCAL_TTL,
+                                           redis_ttl=settings.MAIL_CONFIG_REDIS_TTL,
+                                           listen=settings.MAIL_CONFIG_LISTEN)
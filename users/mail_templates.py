@@ -0,0 +1,121 @@
+import threading
+import uuid
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.template import loader
+from django.urls import reverse
+from django.utils.http import RFC3986_SUBDELIMS
+
+# письма, шаблоны которых компилируются при старте
+MAIL_TEMPLATES: Tuple[str, ...] = ('registration',)
+
+# подставляются в reverse один раз, затем заменяются на настоящие значения
+EMAIL_PLACEHOLDER = 'email-placeholder'
+TOKEN_PLACEHOLDER = uuid.UUID(int=0)
+
+
+@dataclass(frozen=True, slots=True)
+class RenderedMail:
+    subject: str
+    html: str
+    text: str
+
+
+def mail_locale(locale: Optional[str]) -> str:
+    """Локаль письма из языка запроса: en-gb -> en, неизвестная -> LANGUAGE_CODE"""
+    if locale in settings.MAIL_LOCALES:
+        return locale
+    base: str = (locale or '').split('-')[0]
+    return base if base in settings.MAIL_LOCALES else settings.LANGUAGE_CODE
+
+
+class MailTemplate:
+    """
+    Скомпилированные шаблоны одного письма в одной локали: тема, HTML и текстовая версия.
+    Ищется mail/<имя>.<локаль>.<расширение>, иначе вариант без локали
+    """
+    __slots__ = ("subject", "html", "text")
+
+    def __init__(self, name: str, locale: str):
+        self.subject = self.load(name, locale, 'subject.txt')
+        self.html = self.load(name, locale, 'html')
+        self.text = self.load(name, locale, 'txt')
+
+    @staticmethod
+    def load(name: str, locale: str, extension: str):
+        return loader.select_template([f'mail/{name}.{locale}.{extension}', f'mail/{name}.{extension}'])
+
+    def render_subject(self, context: Dict[str, Any]) -> str:
+        # тема письма - одна строка, перевод строки в заголовке недопустим
+        return ' '.join(self.subject.render(context).split())
+
+    def render(self, context: Dict[str, Any]) -> RenderedMail:
+        return RenderedMail(subject=self.render_subject(context), html=self.html.render(context),
+                            text=self.text.render(context).strip())
+
+
+class MailTemplates:
+    """Кеш скомпилированных шаблонов писем по имени и локали"""
+
+    def __init__(self):
+        self._compiled: Dict[Tuple[str, str], MailTemplate] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str, locale: Optional[str] = None) -> MailTemplate:
+        key: Tuple[str, str] = (name, mail_locale(locale))
+        template: Optional[MailTemplate] = self._compiled.get(key)
+        if template is None:
+            with self._lock:
+                template = self._compiled.get(key)
+                if template is None:
+                    template = self._compiled[key] = MailTemplate(*key)
+        return template
+
+    def render(self, name: str, context: Dict[str, Any], locale: Optional[str] = None) -> RenderedMail:
+        return self.get(name, locale).render(context)
+
+    def warm_up(self) -> None:
+        """Компилирует шаблоны всех писем для всех локалей писем"""
+        for name in MAIL_TEMPLATES:
+            for locale in settings.MAIL_LOCALES:
+                self.get(name, locale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._compiled.clear()
+
+
+mail_templates = MailTemplates()
+
+
+@lru_cache(maxsize=1)
+def signin_link_parts() -> Tuple[str, str, str]:
+    """Ссылка входа, разрезанная по местам email и токена: reverse вызывается один раз на процесс"""
+    path: str = reverse('signin', kwargs={'email': EMAIL_PLACEHOLDER, 'token': TOKEN_PLACEHOLDER})
+    link: str = f'{settings.DOMAIN_NAME}{path}'
+    prefix, rest = link.split(EMAIL_PLACEHOLDER)
+    middle, suffix = rest.split(str(TOKEN_PLACEHOLDER))
+    return prefix, middle, suffix
+
+
+def signin_link(email: str, token: uuid) -> str:
+    if '/' in email:
+        # конвертер str не пропускает "/", пусть reverse сообщит об ошибке как раньше
+        return f'{settings.DOMAIN_NAME}{reverse("signin", kwargs={"email": email, "token": token})}'
+    prefix, middle, suffix = signin_link_parts()
+    # так же экранирует значения reverse
+    return f'{prefix}{quote(email, safe=RFC3986_SUBDELIMS + "/~:@")}{middle}{token}{suffix}'
+
+
+@receiver(setting_changed)
+def reset_mail_templates(setting: str, **kwargs) -> None:
+    if setting in ('TEMPLATES', 'LANGUAGE_CODE', 'MAIL_LOCALES'):
+        mail_templates.clear()
+    if setting in ('DOMAIN_NAME', 'ROOT_URLCONF'):
+        signin_link_parts.cache_clear()
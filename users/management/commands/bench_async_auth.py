@@ -0,0 +1,93 @@
+import asyncio
+import secrets
+import statistics
+import threading
+import time
+from typing import Callable, Dict, List
+
+from adrf.decorators import api_view as adrf_api_view
+from asgiref.sync import SyncToAsync
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from rest_framework.decorators import permission_classes
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+
+from users.async_views import async_api_view
+from users.models import Account
+from users.permissions import IsAdminAccount, IsTokenValid
+from users.utils import generate_access_token, generate_refresh_token
+
+
+async def ping(request) -> Response:
+    return Response(data={'ok': True})
+
+
+def build_view(decorator: Callable) -> Callable:
+    return decorator(['POST'])(permission_classes([IsTokenValid, IsAdminAccount])(ping))
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает async представления adrf и AsyncAPIView под конкурентной нагрузкой в одном event loop, ' \
+           'как в воркере uvicorn: пропускная способность, p99 и число переходов в sync поток'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--concurrency', type=int, default=500)
+
+    def handle(self, *args, **options):
+        user: User = User.objects.create_user(username=f'bench_{secrets.token_hex(4)}')
+        Account.objects.create(user=user, is_admin=True)
+        try:
+            headers: Dict[str, str] = {'HTTP_AUTHORIZATION': f'Bearer {generate_access_token(user)}'}
+            refresh_token: str = generate_refresh_token(user)
+            views: Dict[str, Callable] = {'adrf api_view': build_view(adrf_api_view),
+                                          'async_api_view': build_view(async_api_view)}
+            for name, view in views.items():
+                result = asyncio.run(self.load(view, headers, refresh_token,
+                                               options['requests'], options['concurrency']))
+                self.stdout.write(f'{name:>15}: {result["rps"]:.0f} req/s, p99 {result["p99"]:.1f} мс, '
+                                  f'sync_to_async на запрос {result["hops"]:.2f}, потоков {result["threads"]}')
+        finally:
+            user.delete()
+
+    @staticmethod
+    async def load(view: Callable, headers: Dict[str, str], refresh_token: str,
+                   total: int, concurrency: int) -> Dict[str, float]:
+        factory = APIRequestFactory()
+        semaphore = asyncio.Semaphore(concurrency)
+        timings: List[float] = []
+        hops: List[int] = [0]
+        peak_threads: List[int] = [threading.active_count()]
+        original_call = SyncToAsync.__call__
+
+        async def counted_call(self, *args, **kwargs):
+            hops[0] += 1
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+            return await original_call(self, *args, **kwargs)
+
+        async def one() -> None:
+            async with semaphore:
+                request = factory.post('/', **headers)
+                request.COOKIES['refreshtoken'] = refresh_token
+                start: float = time.perf_counter()
+                await view(request)
+                timings.append((time.perf_counter() - start) * 1000)
+
+        # прогрев кешей токенов и соединений
+        await one()
+        timings.clear()
+        SyncToAsync.__call__ = counted_call
+        try:
+            start: float = time.perf_counter()
+            await asyncio.gather(*(one() for _ in range(total)))
+            elapsed: float = time.perf_counter() - start
+        finally:
+            SyncToAsync.__call__ = original_call
+
+        timings.sort()
+        return {'rps': total / elapsed,
+                'p99': timings[int(len(timings) * 0.99)],
+                'mean': statistics.fmean(timings),
+                'hops': hops[0] / total,
+                'threads': peak_threads[0]}
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from typing import Dict, List
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from users.mail_config import mail_config_cache
+from users.models import ProfileMail
+from users.smtp_pool import SMTPPoolRegistry
+from users.tasks import MailCenter, MessageMail
+from users.testing import LocalSMTPServer
+
+
+class Command(BaseCommand):
+    help = 'Массовая отправка писем через локальный SMTP сервер: по одному письму и через send_bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=10_000)
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--chunk-size', type=int, default=100)
+        parser.add_argument('--connect-delay', type=float, default=0.02,
+                            help='Задержка установки соединения на сервере, имитирует TLS и AUTH удаленного хоста')
+
+    def handle(self, *args, **options):
+        count: int = options['messages']
+        concurrency: int = options['concurrency']
+
+        def messages() -> List[MessageMail]:
+            return [MessageMail(subject='bench', body=f'<b>{i}</b>', to=[f'user{i}@example.com'],
+                                headers={'Message-ID': f'<{i}@bench>'}) for i in range(count)]
+
+        async def one_by_one(pools: SMTPPoolRegistry) -> int:
+            # прежний путь: отдельный вызов, поиск профиля и соединение на каждое письмо
+            slots = asyncio.Semaphore(concurrency)
+
+            async def send(message: MessageMail) -> int:
+                async with slots:
+                    center = MailCenter(None, message)
+                    config: ProfileMail = await center.get_config()
+                    center.mail_message.from_email = config.email_from_email
+                    return await asyncio.to_thread(center.send, config, pools)
+
+            return sum(await asyncio.gather(*(send(message) for message in messages())))
+
+        async def bulk(pools: SMTPPoolRegistry) -> int:
+            results = await MailCenter.send_bulk(messages(), chunk_size=options['chunk_size'],
+                                                 concurrency=concurrency, pools=pools)
+            return sum(result.sent for result in results)
+
+        with LocalSMTPServer(connect_delay=options['connect_delay']) as smtp, transaction.atomic():
+            # активный профиль может быть только один (mail_profile_single_active)
+            ProfileMail.objects.filter(email_act_profile=True).update(email_act_profile=False)
+            config: ProfileMail = ProfileMail.objects.create(email_name_profile='bench', email_act_profile=True,
+                                                             email_host=smtp.host, email_port=smtp.port,
+                                                             email_use_tls=False, email_timeout=10,
+                                                             email_from_email='bench@example.com')
+            mail_config_cache.invalidate(config.id)
+
+            paths = {'по одному': (one_by_one, False), 'по одному + пул': (one_by_one, True),
+                     'send_bulk': (bulk, True)}
+            for name, (send, pooled) in paths.items():
+                pools = SMTPPoolRegistry(max_size=concurrency, idle_timeout=60, enabled=pooled)
+                connections_before: int = smtp.connections
+                start: float = time.perf_counter()
+                sent: int = async_to_sync(send)(pools)
+                elapsed: float = time.perf_counter() - start
+                pools.close_all()
+
+                result: Dict[str, float] = {'rate': sent / elapsed,
+                                            'connections': smtp.connections - connections_before}
+                self.stdout.write(f'{name:>16}: {sent} писем за {elapsed:.1f} с, {result["rate"]:.0f} писем/с, '
+                                  f'соединений {result["connections"]:.0f}')
+
+            transaction.set_rollback(True)
+        mail_config_cache.invalidate(config.id)
@@ -0,0 +1,63 @@
+import secrets
+import time
+from typing import Callable, Dict, List
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from users.fast_serializers import FastAccountSerializer, FastProfileSerializer
+from users.models import Account, Company, Profile
+from users.renderers import ORJSONRenderer
+from users.serializers import AccountSerializer, ProfileSerializer
+
+
+class Command(BaseCommand):
+    help = 'ProfileSerializer и AccountSerializer против FastSerializer (экземпляры и строки values()) ' \
+           'для 1 и 1000 объектов, вместе с рендером в байты'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--objects', type=int, action='append')
+        parser.add_argument('--seconds', type=float, default=2.0)
+
+    def handle(self, *args, **options):
+        counts: List[int] = options['objects'] or [1, 1000]
+        username: str = f'bench_{secrets.token_hex(4)}'
+        user: User = User.objects.create_user(username=username)
+        account: Account = Account.objects.create(user=user)
+        company: Company = Company.objects.create(account=account, title='Bench', industry='it', role='менеджер',
+                                                  people=10, links={f'link{i}': f'https://example.com/{i}'
+                                                                    for i in range(5)})
+        # save() профиля открывает изображение, поэтому записи создаются через bulk_create
+        Profile.objects.bulk_create([Profile(account=account, company=company, name=f'{username}_{number}',
+                                             email='bench@example.com', image_hash=f'{number:064x}')
+                                     for number in range(max(counts))])
+        try:
+            profiles: List[Profile] = list(Profile.objects.filter(account=account).select_related('company'))
+            rows: List[Dict] = list(Profile.objects.filter(account=account)
+                                    .values(*FastProfileSerializer.values_fields()))
+            renderer = ORJSONRenderer()
+            for count in counts:
+                instances, values = profiles[:count], rows[:count]
+                accounts: List[Account] = [account] * count
+                self.stdout.write(f'{count} объектов:')
+                self.compare({
+                    'ProfileSerializer': lambda: renderer.render(ProfileSerializer(instances, many=True).data),
+                    'Fast profile': lambda: renderer.render(FastProfileSerializer.many(instances)),
+                    'Fast profile rows': lambda: renderer.render(FastProfileSerializer.many_rows(values)),
+                    'AccountSerializer': lambda: renderer.render(AccountSerializer(accounts, many=True).data),
+                    'Fast account': lambda: renderer.render(FastAccountSerializer.many(accounts)),
+                }, count, options['seconds'])
+        finally:
+            user.delete()
+
+    def compare(self, paths: Dict[str, Callable[[], bytes]], count: int, seconds: float) -> None:
+        for name, run in paths.items():
+            run()
+            iterations: int = 0
+            start: float = time.perf_counter()
+            while time.perf_counter() - start < seconds:
+                run()
+                iterations += 1
+            elapsed: float = (time.perf_counter() - start) / iterations
+            self.stdout.write(f'{name:>20}: {elapsed * 1_000_000:,.1f} мкс на вызов, '
+                              f'{elapsed / count * 1_000_000:.2f} мкс на объект')
@@ -0,0 +1,76 @@
+import io
+import multiprocessing
+import resource
+import time
+from typing import Callable, Dict, List
+
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageOps
+
+from users.images import AVATAR_FORMATS, AVATAR_SIZES, decode, render_derivatives
+
+
+def legacy_derivatives(file) -> List[bytes]:
+    """Производные до draft-декодирования: изображение декодируется целиком в исходном размере"""
+    image: Image = Image.open(file)
+    image.load()
+    current: Image = ImageOps.exif_transpose(image).convert('RGB')
+    rendered: List[bytes] = []
+    for size in AVATAR_SIZES:
+        current = current.copy()
+        current.thumbnail((size, size), Image.Resampling.LANCZOS)
+        for options in AVATAR_FORMATS.values():
+            buffer = io.BytesIO()
+            current.save(buffer, **options)
+            rendered.append(buffer.getvalue())
+    return rendered
+
+
+def draft_derivatives(file) -> List[bytes]:
+    return [content for _, _, content in render_derivatives(decode(file))]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss в Linux в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(render: Callable, content: bytes, repeat: int, pipe) -> None:
+    """Выполняется в отдельном процессе, чтобы пик памяти одного пути не влиял на другой"""
+    baseline: float = peak_rss_mb()
+    start: float = time.perf_counter()
+    for _ in range(repeat):
+        render(io.BytesIO(content))
+    pipe.send(((time.perf_counter() - start) / repeat, peak_rss_mb() - baseline))
+
+
+class Command(BaseCommand):
+    help = 'Время на изображение и пик RSS: полное декодирование против draft/reduce'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--megapixels', type=int, nargs='+', default=[12, 24, 48])
+        parser.add_argument('--repeat', type=int, default=3)
+
+    @staticmethod
+    def sample(megapixels: int, image_format: str) -> bytes:
+        width: int = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+        image: Image = Image.linear_gradient('L').resize((width, width * 3 // 4)).convert('RGB')
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format)
+        return buffer.getvalue()
+
+    def handle(self, *args, **options):
+        paths: Dict[str, Callable] = {'полное': legacy_derivatives, 'draft': draft_derivatives}
+        # fork: дочерний процесс наследует загруженный Django и Pillow, пик считается от его старта
+        context = multiprocessing.get_context('fork')
+        for megapixels in options['megapixels']:
+            for image_format in ('JPEG', 'PNG'):
+                content: bytes = self.sample(megapixels, image_format)
+                for name, render in paths.items():
+                    receiver, sender = context.Pipe(duplex=False)
+                    process = context.Process(target=measure, args=(render, content, options['repeat'], sender))
+                    process.start()
+                    elapsed, peak = receiver.recv()
+                    process.join()
+                    self.stdout.write(f'{megapixels:>3} Мп {image_format:<4} {name:>6}: '
+                                      f'{elapsed * 1000:7.0f} мс на изображение, пик RSS +{peak:6.0f} МБ')
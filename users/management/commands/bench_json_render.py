@@ -0,0 +1,62 @@
+import io
+import secrets
+import time
+from typing import Callable, Dict
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from users.models import Account, Company, Profile
+from users.renderers import ORJSONParser, ORJSONRenderer
+from users.serializers import AccountSerializer, ProfileSerializer
+
+
+class Command(BaseCommand):
+    help = 'Сериализатор -> байты для ProfileSerializer и AccountSerializer: JSONRenderer DRF против orjson, ' \
+           'и разбор того же JSON JSONParser против ORJSONParser'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20_000)
+
+    def handle(self, *args, **options):
+        username: str = f'bench_{secrets.token_hex(4)}'
+        user: User = User.objects.create_user(username=username)
+        account: Account = Account.objects.create(user=user)
+        company: Company = Company.objects.create(account=account, title='Bench', industry='it', role='менеджер',
+                                                  people=10, links={f'link{i}': f'https://example.com/{i}'
+                                                                    for i in range(10)})
+        # save() профиля открывает изображение, поэтому запись создается через bulk_create
+        Profile.objects.bulk_create([Profile(account=account, company=company, name=username,
+                                             email='bench@example.com')])
+        try:
+            profile: Profile = Profile.objects.select_related('company', 'account').get(account=account)
+            for name, serializer in (('profile', lambda: ProfileSerializer(profile).data),
+                                     ('account', lambda: AccountSerializer(account).data)):
+                self.compare(name, serializer, options['iterations'])
+        finally:
+            user.delete()
+
+    def compare(self, name: str, serializer: Callable[[], Dict], iterations: int) -> None:
+        data: Dict = serializer()
+        content: bytes = JSONRenderer().render(data)
+        parser_context: Dict = {'encoding': 'utf-8'}
+        paths: Dict[str, Callable[[], object]] = {
+            'serializer': serializer,
+            'json': lambda: JSONRenderer().render(data),
+            'orjson': lambda: ORJSONRenderer().render(data),
+            'serializer + json': lambda: JSONRenderer().render(serializer()),
+            'serializer + orjson': lambda: ORJSONRenderer().render(serializer()),
+            'parse json': lambda: JSONParser().parse(io.BytesIO(content), parser_context=parser_context),
+            'parse orjson': lambda: ORJSONParser().parse(io.BytesIO(content), parser_context=parser_context),
+        }
+        self.stdout.write(f'{name}: {len(content)} байт')
+        for path, run in paths.items():
+            run()
+            start: float = time.perf_counter()
+            for _ in range(iterations):
+                run()
+            elapsed: float = time.perf_counter() - start
+            self.stdout.write(f'{path:>20}: {iterations / elapsed:,.0f} оп/с, '
+                              f'{elapsed / iterations * 1_000_000:.1f} мкс')
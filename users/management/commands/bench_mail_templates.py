@@ -0,0 +1,45 @@
+import time
+import uuid
+from typing import Callable, Dict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+
+from users.services import create_message
+
+
+def legacy_create_message(email: str, token: uuid, username: str, password: str) -> str:
+    """create_message до перехода на шаблоны: f-строка и reverse на каждое письмо"""
+    link = reverse('signin', kwargs={'email': email, 'token': token})
+    verification_link: str = f'{settings.DOMAIN_NAME}{link}'
+    message: str = f'Благодарим вас за регистрацию в KravzovCRM. Ваши данные для входа в систему: ' \
+                   f'{username} - логин, ' \
+                   f'{token} - уникальный id вашего аккаунта, ' \
+                   f'{password} - пароль. ' \
+                   f'Для входа перейдите по ссылке: <a href="{verification_link}">{verification_link}</a>'
+    return message
+
+
+class Command(BaseCommand):
+    help = 'Писем в секунду: прежняя f-строка против скомпилированных шаблонов (HTML + текст)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=20_000)
+
+    def handle(self, *args, **options):
+        count: int = options['messages']
+        token: uuid.UUID = uuid.uuid4()
+        paths: Dict[str, Callable[[int], object]] = {
+            'f-строка': lambda i: legacy_create_message(f'user{i}@example.com', token, f'user{i}', 'Nastya_1337'),
+            'шаблоны': lambda i: create_message(f'user{i}@example.com', token, f'user{i}', 'Nastya_1337'),
+            'шаблоны en': lambda i: create_message(f'user{i}@example.com', token, f'user{i}', 'Nastya_1337', 'en'),
+        }
+        for name, render in paths.items():
+            render(0)
+            start: float = time.perf_counter()
+            for i in range(count):
+                render(i)
+            elapsed: float = time.perf_counter() - start
+            self.stdout.write(f'{name:>11}: {count / elapsed:,.0f} писем/с, '
+                              f'{elapsed / count * 1_000_000:.1f} мкс на письмо')
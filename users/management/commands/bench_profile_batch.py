@@ -0,0 +1,75 @@
+import asyncio
+import json
+import secrets
+import time
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+
+from users.management.commands.bench_views import call
+from users.models import Account, Company, Profile
+from users.profile_cache import profile_cache
+from users.utils import generate_access_token
+
+
+class Command(BaseCommand):
+    help = 'Сравнение загрузки N профилей: N запросов api/user/profile/<uuid>/ (по очереди и конкурентно) ' \
+           'против одного api/user/profile/batch/, с холодным и прогретым кешем профилей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', type=int, default=200)
+        parser.add_argument('--rounds', type=int, default=10)
+
+    def handle(self, *args, **options):
+        username: str = f'bench_{secrets.token_hex(4)}'
+        user: User = User.objects.create_user(username=username)
+        account: Account = Account.objects.create(user=user)
+        company: Company = Company.objects.create(account=account, title='Bench', industry='it',
+                                                  role='менеджер', people=10)
+        # save() профиля открывает изображение, поэтому записи создаются через bulk_create
+        profiles: List[Profile] = Profile.objects.bulk_create([
+            Profile(account=account, company=company, name=f'{username}_{number}', email='bench@example.com')
+            for number in range(options['profiles'])])
+        try:
+            headers: List[Tuple[bytes, bytes]] = [
+                (b'host', b'localhost'), (b'content-type', b'application/json'),
+                (b'authorization', f'Bearer {generate_access_token(user)}'.encode())]
+            uuids: List[str] = [str(profile.uuid) for profile in profiles]
+            asyncio.run(self.compare(headers, uuids, options['rounds']))
+        finally:
+            user.delete()
+
+    async def compare(self, headers: List[Tuple[bytes, bytes]], uuids: List[str], rounds: int) -> None:
+        application = get_asgi_application()
+        paths: List[str] = [reverse('profile', kwargs={'uuid': profile_uuid}) for profile_uuid in uuids]
+        batch_body: bytes = json.dumps({'uuids': uuids}).encode()
+
+        async def loop() -> List[int]:
+            return [await call(application, 'GET', path, headers) for path in paths]
+
+        async def concurrent() -> List[int]:
+            return await asyncio.gather(*(call(application, 'GET', path, headers) for path in paths))
+
+        async def batch() -> List[int]:
+            return [await call(application, 'POST', reverse('profile_batch'), headers, batch_body)]
+
+        variants: Dict[str, Callable[[], Awaitable[List[int]]]] = {'loop': loop, 'gather': concurrent,
+                                                                   'batch': batch}
+        for cold in (True, False):
+            for name, variant in variants.items():
+                await variant()
+                timings: List[float] = []
+                for _ in range(rounds):
+                    if cold:
+                        await asyncio.to_thread(profile_cache.invalidate, uuids)
+                    start: float = time.perf_counter()
+                    statuses: List[int] = await variant()
+                    timings.append((time.perf_counter() - start) * 1000)
+                    if any(code != 200 for code in statuses):
+                        self.stderr.write(f'{name}: ошибки {sorted(set(statuses))}')
+                timings.sort()
+                self.stdout.write(f'{"холодный" if cold else "прогретый":>9} {name:>6}: {len(uuids)} профилей, '
+                                  f'p50 {timings[len(timings) // 2]:.1f} мс, max {timings[-1]:.1f} мс')
@@ -0,0 +1,91 @@
+import random
+import time
+from typing import Callable, Dict, List
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import QuerySet
+
+from users.models import INDUSTRY, USER_ROLE, Account, Company, Profile
+from users.search import icontains_search, trigram_search
+
+FIRST_NAMES = ('Alexander', 'Maria', 'Ivan', 'Olga', 'Dmitry', 'Anna', 'Sergey', 'Elena', 'Pavel', 'Natalia',
+               'Andrey', 'Tatiana', 'Mikhail', 'Irina', 'Nikolay', 'Svetlana', 'Artem', 'Ekaterina')
+LAST_NAMES = ('Ivanov', 'Petrov', 'Sidorov', 'Smirnov', 'Kuznetsov', 'Popov', 'Vasiliev', 'Sokolov', 'Mikhailov',
+              'Novikov', 'Fedorov', 'Morozov', 'Volkov', 'Alekseev', 'Lebedev', 'Semenov', 'Egorov', 'Pavlov')
+TITLE_WORDS = ('Logistics', 'Systems', 'Consulting', 'Trade', 'Group', 'Digital', 'Industries', 'Media', 'Travel',
+               'Capital', 'Solutions', 'Retail', 'Energy', 'Foods', 'Labs', 'Partners')
+# префикс, вхождение, опечатка, почта, телефон, компания
+QUERIES = ('Alex', 'petrov', 'Smirnvo', 'ivanov.ma', '+7 999 12', 'Logistcs Group')
+
+
+class Command(BaseCommand):
+    help = 'Admin поиск профилей: icontains против pg_trgm на наборе из N профилей (по умолчанию 1M). ' \
+           'Набор создается один раз под пользователем bench_search, --cleanup удаляет его'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', type=int, default=1_000_000)
+        parser.add_argument('--companies', type=int, default=50_000)
+        parser.add_argument('--batch', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--limit', type=int, default=50)
+        parser.add_argument('--query', action='append')
+        parser.add_argument('--cleanup', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            User.objects.filter(username='bench_search').delete()
+            return
+        self.seed(options['profiles'], options['companies'], options['batch'])
+
+        searches: Dict[str, Callable[[str], QuerySet]] = {'icontains': icontains_search}
+        if connection.vendor == 'postgresql':
+            searches['trigram'] = trigram_search
+        else:
+            self.stderr.write('Триграммный поиск есть только в Postgres, сравнивать не с чем')
+        for query in options['query'] or QUERIES:
+            for name, search in searches.items():
+                timings: List[float] = []
+                for _ in range(options['repeat']):
+                    start: float = time.perf_counter()
+                    page: List[Profile] = list(search(query)[:options['limit']])
+                    timings.append((time.perf_counter() - start) * 1000)
+                timings.sort()
+                best: str = page[0].name if page else '-'
+                self.stdout.write(f'{query!r:>18} {name:>9}: p50 {timings[len(timings) // 2]:8.1f} мс, '
+                                  f'{len(page)} на странице, первый {best}')
+
+    def seed(self, profiles: int, companies: int, batch: int) -> None:
+        user, _ = User.objects.get_or_create(username='bench_search')
+        account, _ = Account.objects.get_or_create(user=user)
+        existing: int = Profile.objects.filter(account=account).count()
+        if existing >= profiles:
+            return
+        rng = random.Random(existing)
+        company_ids: List[int] = list(Company.objects.filter(account=account).values_list('id', flat=True))
+        if len(company_ids) < companies:
+            for start in range(len(company_ids), companies, batch):
+                Company.objects.bulk_create([
+                    Company(account=account, title=f'{rng.choice(TITLE_WORDS)} {rng.choice(TITLE_WORDS)} {number}',
+                            industry=rng.choice(INDUSTRY)[0], role=rng.choice(USER_ROLE)[0], people=rng.randint(1, 500))
+                    for number in range(start, min(start + batch, companies))])
+            company_ids = list(Company.objects.filter(account=account).values_list('id', flat=True))
+        # часть профилей без компании
+        company_choices: List = company_ids + [None] * (len(company_ids) // 10)
+
+        for start in range(existing, profiles, batch):
+            rows: List[Profile] = []
+            for number in range(start, min(start + batch, profiles)):
+                first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+                email: str = f'{last.lower()}.{first[:2].lower()}{number}@example.com'
+                rows.append(Profile(account=account, company_id=rng.choice(company_choices),
+                                    name=f'{first} {last}', email=email,
+                                    phone=f'+79{rng.randrange(10 ** 9):09d}' if rng.random() < 0.7 else None))
+            # save() профиля открывает изображение, поэтому записи создаются через bulk_create
+            Profile.objects.bulk_create(rows)
+            self.stdout.write(f'Создано {min(start + batch, profiles)} из {profiles} профилей')
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE users_profile')
+                cursor.execute('ANALYZE users_company')
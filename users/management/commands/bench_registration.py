@@ -0,0 +1,60 @@
+import secrets
+import time
+from typing import Dict, List
+from unittest.mock import patch
+
+import redis
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+
+from users.models import OutboxMail
+from users.services import redis_obj
+from users.views import registration
+
+
+class Command(BaseCommand):
+    help = 'Регистрации в секунду и число обращений к бд и Redis на одну регистрацию'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--signups', type=int, default=200)
+
+    def handle(self, *args, **options):
+        prefix: str = f'bench_{secrets.token_hex(4)}'
+        factory = APIRequestFactory()
+        redis_calls: List[int] = [0]
+        execute_command = redis.StrictRedis.execute_command
+        pipeline_execute = redis.client.Pipeline.execute
+
+        def counted_command(client, *args, **kwargs):
+            redis_calls[0] += 1
+            return execute_command(client, *args, **kwargs)
+
+        def counted_pipeline(pipe, *args, **kwargs):
+            redis_calls[0] += 1
+            return pipeline_execute(pipe, *args, **kwargs)
+
+        with patch.object(redis.StrictRedis, 'execute_command', counted_command), \
+                patch.object(redis.client.Pipeline, 'execute', counted_pipeline), \
+                CaptureQueriesContext(connection) as queries:
+            start: float = time.perf_counter()
+            for i in range(options['signups']):
+                request = factory.post('/', {'username': f'{prefix}_{i}', 'email': f'{prefix}_{i}@example.com'},
+                                       format='json')
+                response = async_to_sync(registration)(request)
+                assert response.status_code == 201, response.data
+            elapsed: float = time.perf_counter() - start
+
+        signups: int = options['signups']
+        result: Dict[str, float] = {'rate': signups / elapsed,
+                                    'queries': len(queries) / signups,
+                                    'redis': redis_calls[0] / signups}
+        self.stdout.write(f'{result["rate"]:.1f} регистраций/с, запросов к бд на регистрацию {result["queries"]:.1f}, '
+                          f'обращений к Redis {result["redis"]:.1f}')
+
+        User.objects.filter(username__startswith=prefix).delete()
+        OutboxMail.objects.filter(to__0__startswith=prefix).delete()
+        redis_obj.delete(*(f'{prefix}_{i}' for i in range(signups)))
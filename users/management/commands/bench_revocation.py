@@ -0,0 +1,73 @@
+import secrets
+import statistics
+import time
+from typing import Callable, Dict, List
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from users.models import BlackListedToken
+from users.revocation import RevocationStore
+
+
+def measure(check: Callable[[str], bool], tokens: List[str]) -> Dict[str, float]:
+    timings: List[float] = []
+    for token in tokens:
+        start: float = time.perf_counter()
+        check(token)
+        timings.append((time.perf_counter() - start) * 1_000_000)
+    timings.sort()
+    return {'mean': statistics.fmean(timings),
+            'p50': timings[len(timings) // 2],
+            'p99': timings[int(len(timings) * 0.99)]}
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает задержку проверки IsTokenValid через ORM и через список отзыва в Redis'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--revoked', type=int, default=1_000_000, help='Сколько токенов отозвать')
+        parser.add_argument('--checks', type=int, default=10_000, help='Сколько проверок замерить')
+        parser.add_argument('--batch-size', type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        revoked: int = options['revoked']
+        batch_size: int = options['batch_size']
+        expires_at: float = time.time() + 3600
+
+        with transaction.atomic():
+            user: User = User.objects.create_user(username=f'bench_{secrets.token_hex(4)}')
+            stores: Dict[str, RevocationStore] = {
+                'redis': RevocationStore(prefix='bench:revoked'),
+                'redis + bloom': RevocationStore(prefix='bench:revoked', use_bloom=True,
+                                                 bloom_capacity=max(revoked, 1)),
+            }
+            store: RevocationStore = stores['redis + bloom']
+            store.clear()
+
+            self.stdout.write(f'Отзываем {revoked} токенов...')
+            sample: List[str] = []
+            for offset in range(0, revoked, batch_size):
+                # размер токенов близок к настоящим refresh JWT
+                tokens: List[str] = [secrets.token_urlsafe(112) for _ in range(min(batch_size, revoked - offset))]
+                BlackListedToken.objects.bulk_create([BlackListedToken(token=token, user=user) for token in tokens])
+                store.revoke_many((token, expires_at) for token in tokens)
+                sample.extend(tokens[:options['checks'] // 2 - len(sample)])
+
+            # половина проверок по отозванным токенам, половина по действующим
+            checks: List[str] = sample
+            checks += [secrets.token_urlsafe(112) for _ in range(options['checks'] - len(checks))]
+
+            paths: Dict[str, Callable[[str], bool]] = {
+                'orm': lambda token: BlackListedToken.objects.filter(user=user.id, token=token).exists(),
+            }
+            paths.update({name: s.is_revoked for name, s in stores.items()})
+            for name, check in paths.items():
+                check(checks[0])
+                result: Dict[str, float] = measure(check, checks)
+                self.stdout.write(f'{name:>14}: mean {result["mean"]:.1f} мкс, '
+                                  f'p50 {result["p50"]:.1f} мкс, p99 {result["p99"]:.1f} мкс')
+
+            store.clear()
+            transaction.set_rollback(True)
@@ -0,0 +1,51 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from django.core.management.base import BaseCommand
+
+from users.models import ProfileMail
+from users.smtp_pool import SMTPPoolRegistry
+from users.tasks import MailCenter, MessageMail
+from users.testing import LocalSMTPServer
+
+
+class Command(BaseCommand):
+    help = 'Писем в секунду через локальный SMTP сервер с пулом соединений и без него'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--connect-delay', type=float, default=0.02,
+                            help='Задержка установки соединения на сервере, имитирует TLS и AUTH удаленного хоста')
+
+    def handle(self, *args, **options):
+        messages: int = options['messages']
+        with LocalSMTPServer(connect_delay=options['connect_delay']) as smtp:
+            # профиль только в памяти: замеряется отправка, а не чтение конфигурации
+            config = ProfileMail(id=uuid.uuid4(), email_name_profile='bench', email_host=smtp.host,
+                                 email_port=smtp.port, email_host_user='bench', email_host_password='bench',
+                                 email_use_tls=False, email_timeout=10, email_from_email='bench@example.com')
+
+            for enabled in (False, True):
+                pools = SMTPPoolRegistry(max_size=options['concurrency'], idle_timeout=60, enabled=enabled)
+                connections_before: int = smtp.connections
+
+                def send(i: int) -> int:
+                    center = MailCenter(config.id, MessageMail(subject='bench', body=f'<b>{i}</b>',
+                                                               to=['bench@example.com'],
+                                                               from_email=config.email_from_email,
+                                                               headers={'Message-ID': f'<{i}@bench>'}))
+                    return center.send(config, pools)
+
+                start: float = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                    sent: int = sum(executor.map(send, range(messages)))
+                elapsed: float = time.perf_counter() - start
+                pools.close_all()
+
+                result: Dict[str, float] = {'rate': sent / elapsed,
+                                            'connections': smtp.connections - connections_before}
+                self.stdout.write(f'{"с пулом" if enabled else "без пула":>9}: {result["rate"]:.0f} писем/с, '
+                                  f'соединений {result["connections"]:.0f}')
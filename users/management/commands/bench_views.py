@@ -0,0 +1,103 @@
+import asyncio
+import json
+import secrets
+import time
+from typing import Dict, List, Optional, Tuple
+
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+
+from users.models import Account, Company, Profile
+from users.utils import generate_access_token, generate_refresh_token
+
+
+async def call(application, method: str, path: str, headers: List[Tuple[bytes, bytes]],
+               body: bytes = b'') -> int:
+    """Один HTTP запрос напрямую в ASGI приложение, как его передал бы uvicorn"""
+    scope: Dict = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+                   'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+                   'query_string': b'', 'server': ('localhost', 8001),
+                   'headers': headers + [(b'content-length', str(len(body)).encode())],
+                   'client': ('127.0.0.1', 50000)}
+    messages: List[Dict] = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    status: List[int] = [0]
+
+    async def receive() -> Dict:
+        return messages.pop() if messages else {'type': 'http.disconnect'}
+
+    async def send(message: Dict) -> None:
+        if message['type'] == 'http.response.start':
+            status[0] = message['status']
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест эндпоинтов через ASGI приложение: запросы в секунду и p99 при N конкурентных клиентах. ' \
+           'Для сравнения запустите его до и после изменения представлений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--concurrency', type=int, default=500)
+        parser.add_argument('--endpoint', action='append', choices=['login', 'refresh', 'profile'])
+
+    def handle(self, *args, **options):
+        username: str = f'bench_{secrets.token_hex(4)}'
+        user: User = User.objects.create_user(username=username)
+        account: Account = Account.objects.create(user=user)
+        company: Company = Company.objects.create(account=account, title='Bench', industry='it',
+                                                  role='менеджер', people=10)
+        # save() профиля открывает изображение, поэтому запись создается через bulk_create
+        profile: Profile = Profile.objects.bulk_create([Profile(account=account, company=company,
+                                                                name=username, email='bench@example.com')])[0]
+        try:
+            base_headers: List[Tuple[bytes, bytes]] = [(b'host', b'localhost'),
+                                                       (b'content-type', b'application/json')]
+            csrf_token: str = secrets.token_hex(16)
+            cookie: Tuple[bytes, bytes] = (
+                b'cookie', f'refreshtoken={generate_refresh_token(user)}; csrftoken={csrf_token}'.encode())
+            auth: Tuple[bytes, bytes] = (b'authorization', f'Bearer {generate_access_token(user)}'.encode())
+            endpoints: Dict[str, Tuple[str, str, List[Tuple[bytes, bytes]], bytes]] = {
+                'login': ('POST', reverse('jwt_login'), base_headers, json.dumps({'username': username}).encode()),
+                'refresh': ('POST', reverse('token_refresh'),
+                            base_headers + [cookie, (b'x-csrftoken', csrf_token.encode())], b''),
+                'profile': ('GET', reverse('profile', kwargs={'uuid': profile.uuid}),
+                            base_headers + [cookie, auth], b''),
+            }
+            for name in options['endpoint'] or endpoints:
+                result: Dict[str, float] = asyncio.run(self.load(endpoints[name], options['requests'],
+                                                                 options['concurrency']))
+                self.stdout.write(f'{name:>8}: {result["rps"]:.0f} req/s, p50 {result["p50"]:.1f} мс, '
+                                  f'p99 {result["p99"]:.1f} мс, ошибок {result["errors"]}')
+        finally:
+            user.delete()
+
+    @staticmethod
+    async def load(endpoint: Tuple[str, str, List[Tuple[bytes, bytes]], bytes],
+                   total: int, concurrency: int) -> Dict[str, float]:
+        application = get_asgi_application()
+        semaphore = asyncio.Semaphore(concurrency)
+        timings: List[float] = []
+        errors: List[Optional[int]] = []
+
+        async def one() -> None:
+            async with semaphore:
+                start: float = time.perf_counter()
+                status: int = await call(application, *endpoint)
+                timings.append((time.perf_counter() - start) * 1000)
+                if status >= 400:
+                    errors.append(status)
+
+        await one()
+        timings.clear()
+        errors.clear()
+        start: float = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed: float = time.perf_counter() - start
+
+        timings.sort()
+        return {'rps': total / elapsed, 'p50': timings[len(timings) // 2],
+                'p99': timings[int(len(timings) * 0.99)], 'errors': len(errors)}
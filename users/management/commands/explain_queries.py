@@ -0,0 +1,111 @@
+import re
+from datetime import timedelta
+from typing import Dict, List
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from users.authentication import SafeJWTAuthentication
+from users.models import (INDUSTRY, USER_ROLE, Account, BlackListedToken,
+                          Company, Profile, ProfileMail)
+from users.search import search_profiles
+from users.views import AccountList, CompanyList, ProfileList, ProfileMailList
+
+PREFIX = 'explain_'
+SEQ_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN ANALYZE запросов представлений на наборе из N аккаунтов и профилей (Postgres). ' \
+           'Завершается ошибкой, если в плане есть Seq Scan. Набор создается один раз, --cleanup удаляет его'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100_000)
+        parser.add_argument('--mail-profiles', type=int, default=1000)
+        parser.add_argument('--batch', type=int, default=10_000)
+        parser.add_argument('--cleanup', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            ProfileMail.objects.filter(email_name_profile__startswith=PREFIX).delete()
+            User.objects.filter(username__startswith=PREFIX).delete()
+            return
+        if connection.vendor != 'postgresql':
+            raise CommandError('EXPLAIN ANALYZE и проверка на Seq Scan есть только для Postgres')
+        self.seed(options['rows'], options['mail_profiles'], options['batch'])
+
+        failed: Dict[str, List[str]] = {}
+        for name, queryset in self.queries().items():
+            plan: str = queryset.explain(analyze=True)
+            tables: List[str] = SEQ_SCAN.findall(plan)
+            if tables:
+                failed[name] = tables
+            self.stdout.write(f'{name:>32}: {"Seq Scan по " + ", ".join(tables) if tables else "ok"}')
+            if options['verbosity'] > 1 or tables:
+                self.stdout.write(plan)
+        if failed:
+            raise CommandError(f'Последовательный просмотр в запросах: {", ".join(failed)}')
+
+    @staticmethod
+    def queries() -> Dict[str, QuerySet]:
+        """Запросы представлений и проверок доступа с параметрами из набора, как их строит ORM"""
+        account: Account = Account.objects.filter(user__username__startswith=PREFIX).select_related('user').last()
+        revoked: BlackListedToken = BlackListedToken.objects.filter(user=account.user).first()
+        profile: Profile = Profile.objects.filter(account=account).first()
+        profile_uuids: List = list(Profile.objects.order_by('-created').values_list('uuid', flat=True)[:100])
+        page: int = settings.ADMIN_PAGE_SIZE + 1
+        return {
+            'signin': Account.objects.select_related('user').filter(token=account.token),
+            'jwt_login_view: пользователь': User.objects.filter(username=account.user.username),
+            'jwt_login_view: аккаунт': Account.objects.filter(user_id=account.user_id),
+            # промах кеша токенов: пользователь с аккаунтом, по нему же проверяются права
+            'SafeJWTAuthentication': SafeJWTAuthentication.user_query({'user_id': account.user_id}),
+            # IsAdminAccount читает аккаунт из кеша токенов, в бд идет только без него (Basic)
+            'IsAdminAccount без JWT': Account.objects.filter(user_id=account.user_id, is_admin=True),
+            # IsTokenValid проверяет отзыв в Redis, журнал в бд читается только при его недоступности
+            'IsTokenValid без Redis': BlackListedToken.objects.filter(user=account.user_id, token=revoked.token),
+            # get() сбрасывает ordering модели
+            'mail_config': ProfileMail.objects.filter(email_act_profile=True).order_by(),
+            'ProfileAccount': Profile.objects.select_related('company', 'account').filter(uuid=profile.uuid),
+            'ProfileBatch': Profile.objects.filter(uuid__in=profile_uuids).select_related('company', 'account'),
+            'ProfileMailList': ProfileMailList.queryset.order_by(*ProfileMailList.ordering)[:page],
+            'AccountList': AccountList.queryset.order_by(*AccountList.ordering)[:page],
+            'CompanyList': CompanyList.queryset.order_by(*CompanyList.ordering)[:page],
+            'CompanyList ?industry': CompanyList.queryset.filter(industry=INDUSTRY[1][0])
+                                                 .order_by(*CompanyList.ordering)[:page],
+            'ProfileList': ProfileList.queryset.order_by(*ProfileList.ordering)[:page],
+            'ProfileList ?created_after': ProfileList.queryset.filter(created__gte=timezone.now() - timedelta(days=1))
+                                                     .order_by(*ProfileList.ordering)[:page],
+            'ProfileSearch': search_profiles(profile.name)[:page],
+        }
+
+    def seed(self, rows: int, mail_profiles: int, batch: int) -> None:
+        existing: int = User.objects.filter(username__startswith=PREFIX).count()
+        for start in range(existing, rows, batch):
+            numbers: range = range(start, min(start + batch, rows))
+            # аккаунты без явного токена, default у каждой строки свой
+            users: List[User] = User.objects.bulk_create([User(username=f'{PREFIX}{number}', password='!')
+                                                          for number in numbers])
+            accounts: List[Account] = Account.objects.bulk_create([Account(user=user, is_admin=number % 100 == 0)
+                                                                   for number, user in zip(numbers, users)])
+            companies: List[Company] = Company.objects.bulk_create([
+                Company(account=account, title=f'Company {number}', industry=INDUSTRY[number % len(INDUSTRY)][0],
+                        role=USER_ROLE[number % len(USER_ROLE)][0], people=number % 500 + 1)
+                for number, account in zip(numbers, accounts)])
+            # save() профиля открывает изображение, поэтому записи создаются через bulk_create
+            Profile.objects.bulk_create([Profile(account=account, company=company, name=f'Profile {number}',
+                                                 email=f'profile{number}@example.com')
+                                         for number, account, company in zip(numbers, accounts, companies)])
+            BlackListedToken.objects.bulk_create([BlackListedToken(token=f'revoked.{number}', user=user)
+                                                  for number, user in zip(numbers, users)])
+            self.stdout.write(f'Создано {numbers[-1] + 1} из {rows} аккаунтов')
+        existing = ProfileMail.objects.filter(email_name_profile__startswith=PREFIX).count()
+        ProfileMail.objects.bulk_create([ProfileMail(email_name_profile=f'{PREFIX}{number}', email_host='localhost')
+                                         for number in range(existing, mail_profiles)])
+        with connection.cursor() as cursor:
+            for model in (User, Account, Company, Profile, BlackListedToken, ProfileMail):
+                cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
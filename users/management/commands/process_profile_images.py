@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.images import process_profile_image
+from users.models import Profile
+
+
+class Command(BaseCommand):
+    help = 'Готовит производные изображений профилей, задачи которых потерялись ' \
+           '(переполнение очереди, перезапуск воркера)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.filter(image_hash='').values_list('uuid', 'image') \
+            .iterator(chunk_size=options['batch_size'])
+        processed: int = 0
+        failed: int = 0
+        for profile_uuid, image_name in profiles:
+            try:
+                process_profile_image(str(profile_uuid), image_name, time.time())
+                processed += 1
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f'Профиль {profile_uuid}: {e!r}')
+        self.stdout.write(self.style.SUCCESS(f'Обработано изображений: {processed}, ошибок: {failed}'))
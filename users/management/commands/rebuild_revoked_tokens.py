@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from users.models import BlackListedToken
+from users.revocation import revocation_store
+
+
+class Command(BaseCommand):
+    help = 'Восстанавливает список отозванных refresh токенов в Redis по журналу BlackListedToken'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        tokens = BlackListedToken.objects.values_list('token', flat=True).iterator(chunk_size=options['batch_size'])
+        restored: int = revocation_store.rebuild(tokens, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Восстановлено отозванных токенов: {restored}'))
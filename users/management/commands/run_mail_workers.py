@@ -0,0 +1,76 @@
+import asyncio
+import multiprocessing
+import signal
+from typing import List
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from users.models import OutboxMail
+from users.tasks import OutboxWorker
+
+
+def build_worker(options) -> OutboxWorker:
+    return OutboxWorker(concurrency=options['concurrency'],
+                        max_attempts=settings.MAIL_MAX_ATTEMPTS,
+                        backoff_base=settings.MAIL_BACKOFF_BASE,
+                        backoff_max=settings.MAIL_BACKOFF_MAX,
+                        lease=settings.MAIL_LEASE,
+                        poll_interval=settings.MAIL_POLL_INTERVAL)
+
+
+async def serve(worker: OutboxWorker) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await worker.run(stop)
+
+
+def run_process(options) -> None:
+    asyncio.run(serve(build_worker(options)))
+
+
+class Command(BaseCommand):
+    help = 'Запускает воркеры, отправляющие письма из outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--concurrency', type=int, default=settings.MAIL_WORKER_CONCURRENCY,
+                            help='Одновременных отправок в одном процессе')
+        parser.add_argument('--once', action='store_true', help='Отправить готовые письма и выйти')
+        parser.add_argument('--requeue-dead', action='store_true',
+                            help='Вернуть недоставленные письма в очередь')
+
+    def handle(self, *args, **options):
+        if options['requeue_dead']:
+            requeued: int = OutboxMail.objects.filter(status='dead').update(status='pending', attempts=0)
+            self.stdout.write(f'Возвращено в очередь писем: {requeued}')
+
+        if options['once']:
+            worker: OutboxWorker = build_worker(options)
+            sent: int = 0
+            while processed := asyncio.run(worker.run_once()):
+                sent += processed
+            self.stdout.write(self.style.SUCCESS(f'Обработано писем: {sent}'))
+            return
+
+        if options['processes'] == 1:
+            run_process(options)
+            return
+
+        # соединения с бд не должны наследоваться дочерними процессами
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processes: List[multiprocessing.Process] = [context.Process(target=run_process, args=(options,))
+                                                    for _ in range(options['processes'])]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+                process.join()
@@ -0,0 +1,200 @@
+import mimetypes
+import os
+import posixpath
+import re
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional, Tuple
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.core.signing import Signer
+from django.http import Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.http.response import HttpResponseBase
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+from .cache import LRUCache
+from .images import AVATAR_DIR, hash_file
+
+# отдаются только изображения профилей: в MEDIA_ROOT лежат и файлы ProfileMail (сертификаты, ключи)
+SERVED_PREFIXES: Tuple[str, ...] = (f'{AVATAR_DIR}/', 'user_images/', 'default/')
+# оригиналы загрузок отдаются только по подписанной ссылке, которую возвращает API: <img> и srcset
+# не передают Authorization. Производные (путь - sha256 содержимого) и изображения по умолчанию публичны
+SIGNED_PREFIXES: Tuple[str, ...] = ('user_images/',)
+SIGNATURE_PARAM = 's'
+# производная по пути с хешем содержимого никогда не меняется
+DERIVATIVE_RE = re.compile(rf'^{AVATAR_DIR}/[0-9a-f]{{2}}/(?P<hash>[0-9a-f]{{64}})/(?P<size>\d+)\.(?P<ext>\w+)$')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, no-cache'
+PRIVATE_REVALIDATE = 'private, no-cache'
+CHUNK_SIZE = 64 * 1024
+
+# ETag оригиналов: sha256 содержимого, считается один раз на версию файла (mtime и размер)
+etag_cache: LRUCache[str] = LRUCache(max_size=4096)
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class StoredFile:
+    name: str
+    path: str
+    size: int
+    mtime: float
+    etag: str
+    cache_control: str
+
+    @property
+    def content_type(self) -> str:
+        return mimetypes.guess_type(self.name)[0] or 'application/octet-stream'
+
+
+def content_etag(name: str, stat: os.stat_result) -> Tuple[str, bool]:
+    match = DERIVATIVE_RE.match(name)
+    if match is not None:
+        return f'"{match["hash"]}-{match["size"]}.{match["ext"]}"', True
+    key: Tuple = (name, stat.st_mtime_ns, stat.st_size)
+    etag: Optional[str] = etag_cache.get(key)
+    if etag is None:
+        with default_storage.open(name, 'rb') as file:
+            etag = f'"{hash_file(file)}"'
+        etag_cache.set(key, etag, time.time() + 24 * 60 * 60)
+    return etag, False
+
+
+def signature(name: str) -> str:
+    # без срока действия: ссылка из ответа API кешируется клиентом вместе с ответом
+    return Signer(salt='users.media').signature(name)
+
+
+def signed_query(name: str) -> str:
+    """Query string ссылки на файл: подпись для оригиналов загрузок, пустая для публичных файлов"""
+    return f'?{SIGNATURE_PARAM}={signature(name)}' if name.startswith(SIGNED_PREFIXES) else ''
+
+
+def is_signed(name: str, value: Optional[str]) -> bool:
+    return value is not None and constant_time_compare(value, signature(name))
+
+
+def resolve(name: str, signed: Optional[str] = None) -> StoredFile:
+    """
+    Файл медиа по имени в хранилище и подписи из ссылки. 404 для всего, что не изображение профиля,
+    и для оригинала без верной подписи
+    """
+    # user_images/../certs/... не должен пройти проверку префикса
+    name = posixpath.normpath(name)
+    if not name.startswith(SERVED_PREFIXES):
+        raise Http404()
+    private: bool = name.startswith(SIGNED_PREFIXES)
+    if private and not is_signed(name, signed):
+        raise Http404()
+    try:
+        path: str = default_storage.path(name)
+        stat: os.stat_result = os.stat(path)
+    except (SuspiciousFileOperation, FileNotFoundError, NotADirectoryError):
+        raise Http404()
+    if not os.path.isfile(path):
+        raise Http404()
+    etag, immutable = content_etag(name, stat)
+    cache_control: str = IMMUTABLE if immutable else PRIVATE_REVALIDATE if private else REVALIDATE
+    return StoredFile(name=name, path=path, size=stat.st_size, mtime=stat.st_mtime, etag=etag,
+                      cache_control=cache_control)
+
+
+def is_not_modified(request, stored: StoredFile) -> bool:
+    if_none_match: Optional[str] = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        # для If-None-Match сравнение слабое
+        etags = [etag.removeprefix('W/') for etag in parse_etags(if_none_match)]
+        return '*' in etags or stored.etag in etags
+    if_modified_since: Optional[int] = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(stored.mtime) <= if_modified_since
+
+
+def if_range_matches(request, stored: StoredFile) -> bool:
+    if_range: Optional[str] = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        # для If-Range сравнение только сильное
+        return if_range == stored.etag
+    return parse_http_date_safe(if_range) == int(stored.mtime)
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Один диапазон байт из заголовка Range, включительно. None - отдать файл целиком:
+    заголовок некорректен или диапазонов несколько, что RFC 9110 разрешает игнорировать
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if match is None or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        suffix: int = int(last)
+        if suffix == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - suffix), size - 1
+    start: int = int(first)
+    end: int = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return (start, end) if end >= start else None
+
+
+async def read_file(path: str, start: int, length: int) -> AsyncIterator[bytes]:
+    """Файл кусками: чтение в пуле потоков, event loop не блокируется на диске"""
+    with open(path, 'rb') as file:
+        file.seek(start)
+        remaining: int = length
+        while remaining > 0:
+            chunk: bytes = await sync_to_async(file.read, thread_sensitive=False)(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_response(request, stored: StoredFile) -> HttpResponseBase:
+    """
+    Ответ с файлом. В режимах x-accel и x-sendfile тело отдает прокси (nginx сам обрабатывает Range),
+    иначе сервис стримит файл сам, с поддержкой одного диапазона байт
+    """
+    if is_not_modified(request, stored):
+        response: HttpResponseBase = HttpResponseNotModified()
+    elif settings.MEDIA_SENDFILE == 'x-accel':
+        response = HttpResponse(content_type=stored.content_type)
+        response['X-Accel-Redirect'] = f'{settings.MEDIA_ACCEL_PREFIX}{quote(stored.name)}'
+    elif settings.MEDIA_SENDFILE == 'x-sendfile':
+        response = HttpResponse(content_type=stored.content_type)
+        response['X-Sendfile'] = stored.path
+    else:
+        start, end = 0, stored.size - 1
+        status: int = 200
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE', ''), stored.size) \
+                if if_range_matches(request, stored) else None
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stored.size}'
+            return response
+        if byte_range is not None:
+            (start, end), status = byte_range, 206
+        content = read_file(stored.path, start, end - start + 1) if request.method != 'HEAD' else ()
+        response = StreamingHttpResponse(content, status=status, content_type=stored.content_type)
+        response['Content-Length'] = str(end - start + 1)
+        if status == 206:
+            response['Content-Range'] = f'bytes {start}-{end}/{stored.size}'
+        response['Accept-Ranges'] = 'bytes'
+
+    response['ETag'] = stored.etag
+    response['Last-Modified'] = http_date(stored.mtime)
+    response['Cache-Control'] = stored.cache_control
+    return response
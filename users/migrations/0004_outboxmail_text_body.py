@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users", "0003_outboxmail"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="outboxmail",
+            name="text_body",
+            field=models.TextField(blank=True, default=""),
+        ),
+    ]
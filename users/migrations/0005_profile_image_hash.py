@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users", "0004_outboxmail_text_body"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="profile",
+            name="image_hash",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
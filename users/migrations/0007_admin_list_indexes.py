@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users", "0006_company_updated"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="account",
+            index=models.Index(fields=["is_admin", "id"], name="account_admin_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="company",
+            index=models.Index(fields=["industry", "id"], name="company_industry_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="company",
+            index=models.Index(fields=["role", "id"], name="company_role_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="profile",
+            index=models.Index(fields=["created"], name="profile_created_idx"),
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations
+
+# GIN индексы pg_trgm для admin поиска (users.search). Только Postgres, поэтому индексы не описаны
+# в Meta моделей; CONCURRENTLY не блокирует запись в заполненные таблицы, но не работает в транзакции
+TRIGRAM_INDEXES = (
+    ('profile_name_trgm_idx', 'users_profile', 'name'),
+    ('profile_email_trgm_idx', 'users_profile', 'email'),
+    ('profile_phone_trgm_idx', 'users_profile', 'phone'),
+    ('company_title_trgm_idx', 'users_company', 'title'),
+)
+
+
+def create_indexes(apps, schema_editor) -> None:
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} '
+                              f'USING gin ({column} gin_trgm_ops)')
+
+
+def drop_indexes(apps, schema_editor) -> None:
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("users", "0007_admin_list_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
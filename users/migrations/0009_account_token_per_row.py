@@ -0,0 +1,46 @@
+import uuid
+
+from django.db import migrations, models
+from django.db.models import Count
+
+import users.models
+
+
+def deduplicate(apps, schema_editor) -> None:
+    """
+    До 0009 default токена вычислялся один раз при импорте и был заморожен в 0002, поэтому аккаунты,
+    созданные без явного токена, делят одно значение. Первый аккаунт каждого значения сохраняет токен,
+    остальные получают новые - иначе 0010 не создаст уникальный индекс. Из активных профилей почты
+    остается первый по ordering модели, как и раньше get() падал на нескольких
+    """
+    Account = apps.get_model('users', 'Account')
+    ProfileMail = apps.get_model('users', 'ProfileMail')
+    shared = Account.objects.values('token').annotate(rows=Count('id')).filter(rows__gt=1).values('token')
+    accounts = []
+    first = {}
+    for account in Account.objects.filter(token__in=shared).only('id', 'token').order_by('token', 'id').iterator():
+        if account.token in first:
+            account.token = str(uuid.uuid4())
+            accounts.append(account)
+        else:
+            first[account.token] = account.id
+    Account.objects.bulk_update(accounts, ['token'], batch_size=1000)
+
+    active = ProfileMail.objects.filter(email_act_profile=True).order_by('email_name_profile', 'id')
+    keep = active.values_list('id', flat=True).first()
+    active.exclude(id=keep).update(email_act_profile=False)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users", "0008_search_trigram_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="account",
+            name="token",
+            field=models.CharField(default=users.models.generate_token, max_length=255),
+        ),
+        migrations.RunPython(deduplicate, migrations.RunPython.noop),
+    ]
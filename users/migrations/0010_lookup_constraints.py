@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users", "0009_account_token_per_row"),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="account",
+            constraint=models.UniqueConstraint(fields=("token",), name="account_token_unique"),
+        ),
+        migrations.AddConstraint(
+            model_name="profilemail",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("email_act_profile", True)),
+                fields=("email_act_profile",),
+                name="mail_profile_single_active",
+            ),
+        ),
+    ]
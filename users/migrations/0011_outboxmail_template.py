@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users", "0010_lookup_constraints"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="outboxmail",
+            name="template",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.AddField(
+            model_name="outboxmail",
+            name="context",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name="outboxmail",
+            name="locale",
+            field=models.CharField(blank=True, default="", max_length=16),
+        ),
+    ]
@@ -1,3 +1,4 @@
+import functools
 import json
 import uuid as uuid
 from datetime import datetime
@@ -5,10 +6,10 @@ from typing import Dict, List
 
 from django.contrib.auth.models import User
 from django.core.validators import RegexValidator
-from django.db import models
-from django.db.models import JSONField
+from django.db import models, transaction
+from django.db.models import JSONField, Q
 from django.db.models.fields import Field
-from PIL import Image
+from django.utils import timezone
 
 USER_ROLE: List[tuple[str, str]] = [
     ("ген. директор", 'Генеральный директор'),
@@ -28,16 +29,27 @@ INDUSTRY: List[tuple[str, str]] = [
     ("другое", "Другое")
 ]
 
+DEFAULT_PROFILE_IMAGE = 'default/default.jpg'
+
+
+def generate_token() -> str:
+    return str(uuid.uuid4())
+
 
 class Account(models.Model):
     """Аккаунт пользователя для хранения базовой информации"""
     user: User = models.ForeignKey(User, on_delete=models.CASCADE)
     is_admin: bool = models.BooleanField(default=False)
-    token: str = models.CharField(max_length=255, default=str(uuid.uuid4()))
+    token: str = models.CharField(max_length=255, default=generate_token)
 
     class Meta:
         verbose_name = "Аккаунт"
         verbose_name_plural = "Аккаунты"
+        # ключи keyset пагинации admin списков (users.pagination) вместе с фильтрами
+        indexes = [models.Index(fields=['is_admin', 'id'], name='account_admin_id_idx')]
+        # signin ищет аккаунт по токену только на равенство, поэтому constraint, а не unique=True:
+        # для него Postgres не создает лишний индекс varchar_pattern_ops под LIKE
+        constraints = [models.UniqueConstraint(fields=['token'], name='account_token_unique')]
 
     def __str__(self):
         return f"Аккаунт пользователя {self.user.username}"
@@ -55,10 +67,14 @@ class Company(models.Model):
     role: str = models.CharField(choices=USER_ROLE, max_length=255)
     people: int = models.IntegerField()
     links: json = JSONField(default=default_links)
+    # входит в версию (ETag) профилей компании
+    updated: datetime = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = "Компания"
         verbose_name_plural = "Компании"
+        indexes = [models.Index(fields=['industry', 'id'], name='company_industry_id_idx'),
+                   models.Index(fields=['role', 'id'], name='company_role_id_idx')]
 
     def __str__(self):
         return f"Пользователь {self.account.user.username} связан с компанией {self.title}"
@@ -70,7 +86,9 @@ class Profile(models.Model):
     company = models.ForeignKey(Company, on_delete=models.SET_NULL, null=True)
     uuid: uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=True)
     name: str = models.CharField(max_length=255)
-    image = models.ImageField(default='default/default.jpg', upload_to='user_images')
+    image = models.ImageField(default=DEFAULT_PROFILE_IMAGE, upload_to='user_images')
+    # sha256 содержимого image, по нему лежат производные (users.images), пустой пока воркер их не подготовил
+    image_hash: str = models.CharField(max_length=64, default='', blank=True)
     email: str = models.EmailField()
 
     phone_regex = RegexValidator(regex=r'^\+?1?\d{9,15}$', message="Please enter a valid phone number")
@@ -81,22 +99,38 @@ class Profile(models.Model):
     def __str__(self):
         return f'Профиль пользователя {self.name} связан с аккаунтом {self.account.id}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # по нему save понимает, что изображение заменили
+        instance._loaded_image = instance.__dict__.get('image')
+        return instance
+
     def save(self, *args, **kwargs) -> None:
         """
-        Обрезает изображение пользователя
+        При замене изображения сбрасывает производные и после коммита ставит их в очередь воркера
         """
-        super().save()
-
-        image: Image = Image.open(self.image.path)
-
-        if image.height > 256 or image.width > 256:
-            resize: tuple[int] = (256, 256)
-            image.thumbnail(resize)
-            image.save(self.image.path)
+        update_fields = kwargs.get('update_fields')
+        image_changed: bool = self.image.name != getattr(self, '_loaded_image', None) and \
+            (update_fields is None or 'image' in update_fields)
+        if image_changed:
+            self.image_hash = ''
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'image_hash'}
+        super().save(*args, **kwargs)
+
+        self._loaded_image = self.image.name
+        # у изображения по умолчанию задача только считает хеш: производные уже лежат в хранилище
+        if image_changed:
+            from .images import image_processor
+
+            transaction.on_commit(functools.partial(image_processor.submit, self.pk, self.image.name),
+                                  using=kwargs.get('using'))
 
     class Meta:
         verbose_name = 'Профаил'
         verbose_name_plural = 'Профайлы'
+        indexes = [models.Index(fields=['created'], name='profile_created_idx')]
 
 
 class BlackListedToken(models.Model):
@@ -133,6 +167,49 @@ class ProfileMail(models.Model):
         verbose_name_plural = 'Профили почтового центра'
         db_table = 'rs_platform_mails_profile'
         ordering = ['email_name_profile', ]
+        # активный профиль один (users.mail_config читает его через get), частичный индекс
+        # содержит только его строку
+        constraints = [models.UniqueConstraint(fields=['email_act_profile'], condition=Q(email_act_profile=True),
+                                               name='mail_profile_single_active')]
 
     def __str__(self):
         return f'{self.email_name_profile} - {self.id}'
+
+
+OUTBOX_STATUS: List[tuple[str, str]] = [
+    ("pending", "Ожидает отправки"),
+    ("sent", "Отправлено"),
+    ("dead", "Не доставлено"),
+]
+
+
+class OutboxMail(models.Model):
+    """Исходящее письмо: пишется в транзакции вместе с данными, отправляется воркерами почты"""
+    profile_mail = models.ForeignKey(ProfileMail, on_delete=models.SET_NULL, blank=True, null=True)
+    subject: str = models.CharField(max_length=255)
+    body: str = models.TextField()
+    text_body: str = models.TextField(blank=True, default='')
+    # письмо из шаблона (users.mail_templates): тело собирается при отправке из контекста без секретов
+    template: str = models.CharField(max_length=64, blank=True, default='')
+    context: json = JSONField(default=dict, blank=True)
+    locale: str = models.CharField(max_length=16, blank=True, default='')
+    to: json = JSONField()
+    reply_to: json = JSONField(default=list, blank=True)
+    headers: json = JSONField(default=dict, blank=True)
+    content_subtype: str = models.CharField(max_length=32, default='html')
+    attach_file: str = models.CharField(max_length=255, blank=True, default='')
+    priority: int = models.IntegerField(default=1)
+    status: str = models.CharField(choices=OUTBOX_STATUS, max_length=16, default='pending')
+    attempts: int = models.IntegerField(default=0)
+    next_attempt_at: datetime = models.DateTimeField(default=timezone.now)
+    last_error: str = models.TextField(blank=True, default='')
+    created: datetime = models.DateTimeField(auto_now_add=True)
+    sent_at: datetime = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Исходящее письмо'
+        verbose_name_plural = 'Исходящие письма'
+        indexes = [models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_next_idx')]
+
+    def __str__(self):
+        return f'Письмо {self.id} для {", ".join(self.to)}: {self.status}'
@@ -0,0 +1,54 @@
+from typing import List, Optional
+
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class AdminCursorPagination(CursorPagination):
+    """
+    Keyset пагинация admin списков: страница - это WHERE по ключу сортировки и LIMIT, без OFFSET и COUNT,
+    поэтому стоит одинаково в начале и в конце таблицы. Ключ задает view.ordering, по нему должен быть индекс.
+    Курсор DRF хранит значение только первого поля ordering, строки с одинаковым значением листаются
+    через OFFSET, поэтому первым должно идти уникальное и неизменяемое поле (id)
+    """
+    page_size = settings.ADMIN_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.ADMIN_MAX_PAGE_SIZE
+
+    def get_ordering(self, request, queryset, view):
+        self.ordering = view.ordering
+        return super().get_ordering(request, queryset, view)
+
+
+class SearchPagination(LimitOffsetPagination):
+    """
+    Ранжированная выдача поиска: по рангу keyset не построить, поэтому LIMIT/OFFSET, но без COUNT
+    и с ограниченной глубиной - дальше первых страниц поиск не листают, offset больше max_offset - ошибка 400
+    """
+    default_limit = settings.ADMIN_PAGE_SIZE
+    max_limit = settings.ADMIN_MAX_PAGE_SIZE
+    max_offset = settings.ADMIN_SEARCH_MAX_OFFSET
+
+    def paginate_queryset(self, queryset, request, view=None) -> List:
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.offset = self.get_offset(request)
+        if self.offset > self.max_offset:
+            # молча подставить max_offset значило бы вернуть не ту страницу, что просили
+            raise ValidationError({self.offset_query_param: f'Не больше {self.max_offset}, уточните запрос'})
+        # лишняя строка показывает, есть ли следующая страница
+        rows: List = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(rows) > self.limit and self.offset + self.limit <= self.max_offset
+        return rows[:self.limit]
+
+    def get_next_link(self) -> Optional[str]:
+        if not self.has_next:
+            return None
+        url: str = replace_query_param(self.request.build_absolute_uri(), self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'previous': self.get_previous_link(), 'results': data})
@@ -1,12 +1,15 @@
-from typing import Dict, Optional
+import logging
+from typing import Optional
 
-import jwt
 import redis
 from django.conf import settings
-from rest_framework import exceptions
 from rest_framework.permissions import BasePermission
 
+from .authentication import Principal
 from .models import Account, BlackListedToken
+from .revocation import revocation_store
+
+logger = logging.getLogger(__name__)
 
 redis_obj = redis.StrictRedis(host=settings.REDIS_HOST,
                               port=settings.REDIS_PORT,
@@ -16,30 +19,41 @@ redis_obj = redis.StrictRedis(host=settings.REDIS_HOST,
 
 class IsAdminAccount(BasePermission):
     def has_permission(self, request, view):
-        try:
-            authorization_header: Optional[str] = request.headers.get('Authorization')
-            access_token: Optional[str] = authorization_header.split()[1]
-            payload: Dict[str] = jwt.decode(access_token, settings.SECRET_KEY, algorithms=['HS256'])
-        except jwt.ExpiredSignatureError:
-            raise exceptions.AuthenticationFailed('access_token expired')
-        except IndexError:
-            raise exceptions.AuthenticationFailed('Token prefix missing')
-
-        account = Account.objects.get(id=payload['account_id'])
-        if account.is_admin:
-            return True
-        return False
+        principal = request.auth
+        if isinstance(principal, Principal):
+            # аккаунт уже загружен при аутентификации, повторно токен не декодируется
+            return principal.account is not None and principal.account.is_admin
+        if not request.user or not request.user.is_authenticated:
+            return False
+        return Account.objects.filter(user_id=request.user.id, is_admin=True).exists()
+
+    async def ahas_permission(self, request, view):
+        principal = request.auth
+        if isinstance(principal, Principal):
+            return principal.account is not None and principal.account.is_admin
+        if not request.user or not request.user.is_authenticated:
+            return False
+        return await Account.objects.filter(user_id=request.user.id, is_admin=True).aexists()
 
 
 class IsTokenValid(BasePermission):
     def has_permission(self, request, view):
-        user_id = request.user.id
-        is_allowed_user = True
-        token = request.COOKIES.get('refreshtoken')
+        token: Optional[str] = request.COOKIES.get('refreshtoken')
+        if token is None:
+            return True
+        try:
+            return not revocation_store.is_revoked(token)
+        except redis.RedisError as e:
+            # журнал в бд остается запасным источником, если Redis недоступен
+            logger.warning(f'Список отозванных токенов недоступен, проверка по бд: {e}')
+            return not BlackListedToken.objects.filter(user=request.user.id, token=token).exists()
+
+    async def ahas_permission(self, request, view):
+        token: Optional[str] = request.COOKIES.get('refreshtoken')
+        if token is None:
+            return True
         try:
-            is_blackListed = BlackListedToken.objects.get(user=user_id, token=token)
-            if is_blackListed:
-                is_allowed_user = False
-        except BlackListedToken.DoesNotExist:
-            is_allowed_user = True
-        return is_allowed_user
+            return not await revocation_store.ais_revoked(token)
+        except redis.RedisError as e:
+            logger.warning(f'Список отозванных токенов недоступен, проверка по бд: {e}')
+            return not await BlackListedToken.objects.filter(user=request.user.id, token=token).aexists()
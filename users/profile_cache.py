@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import redis
+from django.conf import settings
+
+from .cache import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+redis_obj = redis.StrictRedis(host=settings.REDIS_HOST,
+                              port=settings.REDIS_PORT,
+                              db=settings.REDIS_DB,
+                              decode_responses=True)
+
+
+def profile_version(updated: datetime, company_updated: Optional[datetime]) -> Tuple[str, int]:
+    """ETag и Last-Modified профиля: меняются при изменении профиля или его компании"""
+    company_version: int = int(company_updated.timestamp() * 1_000_000) if company_updated else 0
+    etag: str = f'"{int(updated.timestamp() * 1_000_000):x}-{company_version:x}"'
+    return etag, int(max(updated, company_updated or updated).timestamp())
+
+
+def pack(etag: str, last_modified: int, content: str) -> str:
+    """В кеше JSON хранится вместе с версией, из которой он построен. В компактном JSON нет переводов строк"""
+    return f'{etag} {last_modified}\n{content}'
+
+
+def unpack(raw: str) -> Tuple[str, int, str]:
+    header, content = raw.split('\n', 1)
+    etag, last_modified = header.split(' ')
+    return etag, int(last_modified), content
+
+
+class ProfileCache:
+    """
+    Read-through кеш JSON профилей в Redis. JSON лежит под ключом с версией профиля, изменение профиля
+    или его компании записывает новую версию, и старый JSON больше не читается. Загрузка, начавшаяся
+    до изменения, сохранит результат под старой версией, поэтому устаревшие данные в кеш не попадают.
+    Холодный ключ загружает один запрос, остальные ждут его результат (single-flight)
+    """
+    prefix = 'profile'
+
+    def __init__(self, ttl: int, lock_timeout: float, poll_interval: float = 0.02):
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self.hits: int = 0
+        self.misses: int = 0
+        self.waits: int = 0
+
+    def _version_key(self, profile_uuid) -> str:
+        return f'{self.prefix}:version:{profile_uuid}'
+
+    def _data_key(self, profile_uuid, version: str) -> str:
+        return f'{self.prefix}:entry:{profile_uuid}:{version}'
+
+    def _lock_key(self, profile_uuid, version: str) -> str:
+        return f'{self.prefix}:lock:{profile_uuid}:{version}'
+
+    async def aget(self, profile_uuid, load: Callable[[], Awaitable[str]]) -> str:
+        """JSON профиля из кеша, при промахе - из load(), исключения load() пробрасываются"""
+        try:
+            client = get_async_redis()
+            # версии нет, пока профиль не менялся с момента истечения ключа
+            version: str = await client.get(self._version_key(profile_uuid)) or '0'
+            data_key: str = self._data_key(profile_uuid, version)
+            raw: Optional[str] = await client.get(data_key)
+            if raw is not None:
+                self.hits += 1
+                return raw
+            lock_key: str = self._lock_key(profile_uuid, version)
+            locked: bool = await client.set(lock_key, '1', nx=True, px=int(self.lock_timeout * 1000))
+        except redis.RedisError as e:
+            logger.warning(f'Кеш профилей в Redis недоступен: {e}')
+            return await load()
+
+        if not locked:
+            self.waits += 1
+            raw = await self._wait(client, data_key, lock_key)
+            if raw is not None:
+                return raw
+
+        self.misses += 1
+        try:
+            raw = await load()
+        except BaseException:
+            if locked:
+                # ждущие не должны стоять до истечения блокировки, например, если профиля нет
+                await self._delete_quietly(client, lock_key)
+            raise
+        try:
+            await client.set(data_key, raw, ex=self.ttl)
+        except redis.RedisError as e:
+            logger.warning(f'Не удалось сохранить профиль в кеш: {e}')
+        # после записи блокировка не нужна: следующие запросы найдут JSON, сама она истечет
+        return raw
+
+    async def aget_many(self, profile_uuids: List[str],
+                        load_many: Callable[[List[str]], Awaitable[Dict[str, str]]]) -> Dict[str, str]:
+        """
+        JSON нескольких профилей: записи кеша читаются двумя MGET, промахи загружаются одним load_many().
+        Single-flight здесь нет, промахи пачки просто загружаются одним запросом к бд.
+        Профилей, которых нет ни в кеше, ни в результате load_many(), в ответе нет
+        """
+        try:
+            client = get_async_redis()
+            versions: List[Optional[str]] = await client.mget([self._version_key(u) for u in profile_uuids])
+            data_keys: Dict[str, str] = {u: self._data_key(u, version or '0')
+                                         for u, version in zip(profile_uuids, versions)}
+            raws: List[Optional[str]] = await client.mget(list(data_keys.values()))
+        except redis.RedisError as e:
+            logger.warning(f'Кеш профилей в Redis недоступен: {e}')
+            return await load_many(profile_uuids)
+
+        found: Dict[str, str] = {u: raw for u, raw in zip(profile_uuids, raws) if raw is not None}
+        missing: List[str] = [u for u in profile_uuids if u not in found]
+        self.hits += len(found)
+        self.misses += len(missing)
+        if missing:
+            loaded: Dict[str, str] = await load_many(missing)
+            try:
+                pipe = client.pipeline(transaction=False)
+                for profile_uuid, raw in loaded.items():
+                    pipe.set(data_keys[profile_uuid], raw, ex=self.ttl)
+                await pipe.execute()
+            except redis.RedisError as e:
+                logger.warning(f'Не удалось сохранить профили в кеш: {e}')
+            found.update(loaded)
+        return found
+
+    async def _wait(self, client, data_key: str, lock_key: str) -> Optional[str]:
+        """Ждет результат загрузки другого запроса, None - загружать самому"""
+        deadline: float = time.monotonic() + self.lock_timeout
+        try:
+            while time.monotonic() < deadline:
+                await asyncio.sleep(self.poll_interval)
+                raw: Optional[str] = await client.get(data_key)
+                if raw is not None:
+                    self.hits += 1
+                    return raw
+                if not await client.exists(lock_key):
+                    return None
+        except redis.RedisError as e:
+            logger.warning(f'Кеш профилей в Redis недоступен: {e}')
+        return None
+
+    @staticmethod
+    async def _delete_quietly(client, key: str) -> None:
+        try:
+            await client.delete(key)
+        except redis.RedisError as e:
+            logger.warning(f'Не удалось снять блокировку кеша профиля: {e}')
+
+    def invalidate(self, profile_uuids: Iterable) -> None:
+        """Новые версии профилей: версия случайная, чтобы после истечения ключа не повториться"""
+        try:
+            pipe = redis_obj.pipeline(transaction=False)
+            for profile_uuid in profile_uuids:
+                # версия живет дольше JSON, записанного под ней
+                pipe.set(self._version_key(profile_uuid), uuid.uuid4().hex, ex=self.ttl * 2)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f'Не удалось сбросить кеш профилей в Redis: {e}')
+
+    def clear(self) -> None:
+        self.hits = self.misses = self.waits = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'waits': self.waits}
+
+
+profile_cache = ProfileCache(ttl=settings.PROFILE_CACHE_TTL, lock_timeout=settings.PROFILE_CACHE_LOCK_TIMEOUT)
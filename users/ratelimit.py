@@ -0,0 +1,60 @@
+import asyncio
+import threading
+import time
+from typing import Dict
+
+from django.conf import settings
+
+
+class TokenBucket:
+    """
+    Token bucket: rate токенов в секунду, не больше capacity накопленных.
+    Запрос больше накопленного уходит в долг и ждет, пока долг не погасится,
+    поэтому пачку любого размера можно оплатить одним вызовом
+    """
+    __slots__ = ("rate", "capacity", "_tokens", "_updated_at", "_lock")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens: float = capacity
+        self._updated_at: float = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1) -> float:
+        """Списывает токены и возвращает, сколько секунд нужно подождать"""
+        with self._lock:
+            now: float = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= tokens
+            return max(0.0, -self._tokens / self.rate)
+
+    async def acquire(self, tokens: float = 1) -> None:
+        delay: float = self.reserve(tokens)
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class HostRateLimiter:
+    """Отдельный token bucket на каждый SMTP хост, rate=0 отключает ограничение"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, host: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self.rate, self.burst)
+            return bucket
+
+    async def acquire(self, host: str, tokens: float = 1) -> None:
+        if self.rate > 0:
+            await self.bucket(host).acquire(tokens)
+
+
+smtp_rate_limiter = HostRateLimiter(rate=settings.MAIL_RATE_LIMIT_PER_HOST, burst=settings.MAIL_RATE_BURST)
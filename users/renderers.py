@@ -0,0 +1,47 @@
+import codecs
+
+import orjson
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+# UUID, datetime, date и time orjson кодирует сам, остальное (Decimal, ленивые строки перевода,
+# timedelta, QuerySet) - тем же кодировщиком, что и JSONRenderer DRF
+ORJSON_OPTIONS: int = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+default = encoders.JSONEncoder().default
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSONRenderer на orjson: тот же компактный UTF-8 JSON, отступ только в 2 пробела"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None) -> bytes:
+        if data is None:
+            return b''
+        if self.ensure_ascii:
+            # orjson не экранирует не-ASCII символы (UNICODE_JSON = False)
+            return super().render(data, accepted_media_type, renderer_context)
+
+        options: int = ORJSON_OPTIONS
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            options |= orjson.OPT_INDENT_2
+        ret: bytes = orjson.dumps(data, default=default, option=options)
+        # как в JSONRenderer: JSON должен оставаться подмножеством javascript
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class ORJSONParser(JSONParser):
+    """JSONParser на orjson, NaN и Infinity он не принимает, как JSONParser со STRICT_JSON"""
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding: str = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            if codecs.lookup(encoding).name == 'utf-8':
+                return orjson.loads(stream.read())
+            return orjson.loads(codecs.getreader(encoding)(stream).read())
+        except ValueError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
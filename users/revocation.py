@@ -0,0 +1,251 @@
+import logging
+import math
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+
+import jwt
+import redis
+from django.conf import settings
+
+from .cache import get_async_redis, token_digest
+from .utils import REFRESH_TOKEN_LIFETIME
+
+logger = logging.getLogger(__name__)
+
+redis_obj = redis.StrictRedis(host=settings.REDIS_HOST,
+                              port=settings.REDIS_PORT,
+                              db=settings.REDIS_DB,
+                              decode_responses=True)
+
+
+def refresh_token_expiry(token: str) -> float:
+    """Время истечения refresh токена, без проверки самого истечения"""
+    try:
+        payload = jwt.decode(token, settings.REFRESH_TOKEN_SECRET, algorithms=['HS256'],
+                             options={'verify_exp': False})
+        return float(payload['exp'])
+    except (jwt.InvalidTokenError, KeyError):
+        # неразборчивый токен держим в списке отзыва максимальный срок
+        return time.time() + REFRESH_TOKEN_LIFETIME.total_seconds()
+
+
+class BloomFilter:
+    """Фильтр Блума поверх sha256 дайджестов: отвечает "точно нет" или "возможно да" """
+    __slots__ = ("size", "hashes", "count", "_bits")
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size: int = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes: int = max(1, round(self.size / capacity * math.log(2)))
+        self.count: int = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, digest: str) -> Iterable[int]:
+        # двойное хеширование: две половины дайджеста дают все k позиций
+        h1, h2 = int(digest[:16], 16), int(digest[16:32], 16)
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, digest: str) -> None:
+        for position in self._positions(digest):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, digest: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+
+def _stream_id(entry_id: str) -> Tuple[int, int]:
+    ms, seq = entry_id.split('-')
+    return int(ms), int(seq)
+
+
+class RevocationStore:
+    """
+    Список отозванных refresh токенов в Redis: ключ на дайджест токена с TTL,
+    равным оставшемуся сроку жизни токена.
+    Опциональный фильтр Блума в процессе отсекает заведомо не отозванные токены без обращения к Redis,
+    отзывы из других воркеров подтягиваются из Redis Stream не реже раза в sync_interval секунд.
+    Полная сборка фильтра по ключам Redis идет в фоновом потоке, на пути запроса - только записи потока.
+    Пока фильтра нет или он отстал от потока, проверка идет через EXISTS в Redis
+    """
+
+    def __init__(self, prefix: str = 'revoked', use_bloom: bool = False, bloom_capacity: int = 1_000_000,
+                 bloom_error_rate: float = 0.001, sync_interval: float = 1.0):
+        self.prefix = prefix
+        self.stream = f'{prefix}:stream'
+        self.use_bloom = use_bloom
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        self.sync_interval = sync_interval
+        self._bloom: Optional[BloomFilter] = None
+        # фильтр содержит все отзывы до _last_id: им можно отвечать "точно нет"
+        self._valid: bool = False
+        self._last_id: str = '0-0'
+        self._synced_at: float = 0.0
+        self._lock = threading.Lock()
+        self._rebuild_thread: Optional[threading.Thread] = None
+
+    def _key(self, digest: str) -> str:
+        return f'{self.prefix}:{digest}'
+
+    def revoke(self, token: str, expires_at: Optional[float] = None) -> None:
+        """Отзывает токен до момента его истечения"""
+        self.revoke_many([(token, expires_at)])
+
+    async def arevoke(self, token: str, expires_at: Optional[float] = None) -> None:
+        pipe = get_async_redis().pipeline(transaction=False)
+        digests: List[str] = self._queue_revocations(pipe, [(token, expires_at)])
+        await pipe.execute()
+        self._add_to_bloom(digests)
+
+    def revoke_many(self, tokens: Iterable[Tuple[str, Optional[float]]]) -> int:
+        """Отзывает пачку токенов одним конвейером Redis, возвращает число записанных"""
+        pipe = redis_obj.pipeline(transaction=False)
+        digests: List[str] = self._queue_revocations(pipe, tokens)
+        pipe.execute()
+        self._add_to_bloom(digests)
+        return len(digests)
+
+    def _queue_revocations(self, pipe, tokens: Iterable[Tuple[str, Optional[float]]]) -> List[str]:
+        now: float = time.time()
+        digests: List[str] = []
+        for token, expires_at in tokens:
+            ttl: int = math.ceil((expires_at or refresh_token_expiry(token)) - now)
+            if ttl <= 0:
+                continue
+            digest: str = token_digest(token)
+            pipe.set(self._key(digest), 1, ex=ttl)
+            if self.use_bloom:
+                pipe.xadd(self.stream, {'digest': digest}, maxlen=self.bloom_capacity, approximate=True)
+            digests.append(digest)
+        return digests
+
+    def _add_to_bloom(self, digests: List[str]) -> None:
+        if self._bloom is not None:
+            with self._lock:
+                for digest in digests:
+                    self._bloom.add(digest)
+
+    def is_revoked(self, token: str) -> bool:
+        digest: str = token_digest(token)
+        if self.use_bloom:
+            bloom: Optional[BloomFilter] = self._sync()
+            if bloom is not None and digest not in bloom:
+                return False
+        return bool(redis_obj.exists(self._key(digest)))
+
+    async def ais_revoked(self, token: str) -> bool:
+        digest: str = token_digest(token)
+        if self.use_bloom:
+            bloom: Optional[BloomFilter] = await self._async_sync()
+            if bloom is not None and digest not in bloom:
+                return False
+        return bool(await get_async_redis().exists(self._key(digest)))
+
+    def _sync(self) -> Optional[BloomFilter]:
+        """
+        Подтягивает в фильтр Блума токены, отозванные другими воркерами.
+        None - фильтру верить нельзя, он собирается в фоне
+        """
+        if not self._valid:
+            self._start_rebuild()
+            return None
+        if time.monotonic() - self._synced_at < self.sync_interval:
+            return self._bloom
+        pipe = redis_obj.pipeline(transaction=False)
+        pipe.xrange(self.stream, min='-', max='+', count=1)
+        pipe.xrange(self.stream, min=f'({self._last_id}', max='+')
+        return self._applied(*pipe.execute())
+
+    async def _async_sync(self) -> Optional[BloomFilter]:
+        if not self._valid:
+            self._start_rebuild()
+            return None
+        if time.monotonic() - self._synced_at < self.sync_interval:
+            return self._bloom
+        pipe = get_async_redis().pipeline(transaction=False)
+        pipe.xrange(self.stream, min='-', max='+', count=1)
+        pipe.xrange(self.stream, min=f'({self._last_id}', max='+')
+        return self._applied(*await pipe.execute())
+
+    def _applied(self, first: list, entries: list) -> Optional[BloomFilter]:
+        if not self._apply(first, entries):
+            self._start_rebuild()
+            return None
+        if self._bloom.count > 2 * self.bloom_capacity:
+            # фильтр не умеет забывать истекшие токены, переполненный остается верным,
+            # но ложных срабатываний больше: до конца сборки отвечает он
+            self._start_rebuild()
+        return self._bloom
+
+    def _apply(self, first: list, entries: list) -> bool:
+        """Добавляет в фильтр новые записи потока, False если нужна полная пересборка"""
+        with self._lock:
+            if first and self._last_id != '0-0' and _stream_id(first[0][0]) > _stream_id(self._last_id):
+                # поток обрезан дальше нашей позиции, часть отзывов могла потеряться
+                self._valid = False
+                return False
+            for entry_id, fields in entries:
+                self._bloom.add(fields['digest'])
+                if _stream_id(entry_id) > _stream_id(self._last_id):
+                    self._last_id = entry_id
+            self._synced_at = time.monotonic()
+            return True
+
+    def _start_rebuild(self) -> None:
+        with self._lock:
+            if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+                return
+            self._rebuild_thread = threading.Thread(target=self._rebuild, name='revocation-bloom-rebuild',
+                                                    daemon=True)
+            self._rebuild_thread.start()
+
+    def _rebuild(self) -> None:
+        try:
+            # позицию в потоке запоминаем до обхода ключей, чтобы не пропустить параллельные отзывы
+            last: list = redis_obj.xrevrange(self.stream, max='+', min='-', count=1)
+            self._load(last, redis_obj.scan_iter(match=f'{self.prefix}:*', count=10_000))
+        except redis.RedisError as e:
+            # следующий запрос запустит сборку снова, до тех пор ответы идут из Redis
+            logger.warning(f'Не удалось собрать фильтр отозванных токенов: {e}')
+
+    def _load(self, last: list, keys: Iterable[str]) -> None:
+        """Полностью перестраивает фильтр Блума по ключам в Redis"""
+        bloom = BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+        for key in keys:
+            digest: str = key[len(self.prefix) + 1:]
+            if digest != 'stream':
+                bloom.add(digest)
+        with self._lock:
+            self._bloom = bloom
+            self._valid = True
+            self._last_id = last[0][0] if last else '0-0'
+            self._synced_at = time.monotonic()
+
+    def rebuild(self, tokens: Iterable[str], batch_size: int = 10_000) -> int:
+        """Восстанавливает список отзыва по журналу токенов, истекшие пропускаются"""
+        restored: int = 0
+        batch: List[Tuple[str, Optional[float]]] = []
+        for token in tokens:
+            batch.append((token, None))
+            if len(batch) >= batch_size:
+                restored += self.revoke_many(batch)
+                batch.clear()
+        if batch:
+            restored += self.revoke_many(batch)
+        return restored
+
+    def clear(self) -> None:
+        for key in redis_obj.scan_iter(match=f'{self.prefix}:*', count=10_000):
+            redis_obj.delete(key)
+        with self._lock:
+            self._bloom = None
+            self._valid = False
+            self._last_id = '0-0'
+            self._synced_at = 0.0
+
+
+revocation_store = RevocationStore(use_bloom=settings.REVOCATION_USE_BLOOM,
+                                   bloom_capacity=settings.REVOCATION_BLOOM_CAPACITY,
+                                   bloom_error_rate=settings.REVOCATION_BLOOM_ERROR_RATE,
+                                   sync_interval=settings.REVOCATION_SYNC_INTERVAL)
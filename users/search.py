@@ -0,0 +1,69 @@
+import re
+from typing import List
+
+from django.conf import settings
+from django.contrib.postgres.lookups import TrigramWordSimilar
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connections
+from django.db.models import Case, F, FloatField, Q, QuerySet, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Company, Profile
+
+
+def normalize(query: str) -> str:
+    return ' '.join(query.split())
+
+
+def phone_digits(query: str) -> str:
+    """Цифры запроса, если он похож на номер телефона, иначе пустая строка"""
+    digits: str = re.sub(r'\D', '', query)
+    return digits if len(digits) >= 3 and not re.search(r'[^\d\s()+-]', query) else ''
+
+
+def prefix_bonus(query: str) -> Case:
+    """Совпадение с начала имени или почты выше нечеткого совпадения"""
+    return Case(When(Q(name__istartswith=query) | Q(email__istartswith=query), then=Value(1.0)),
+                default=Value(0.0), output_field=FloatField())
+
+
+def icontains_search(query: str) -> QuerySet:
+    """Поиск через icontains: последовательный просмотр таблицы, в Postgres - только для сравнения и не-Postgres бд"""
+    query = normalize(query)
+    condition = Q(name__icontains=query) | Q(email__icontains=query) | Q(company__title__icontains=query)
+    digits: str = phone_digits(query)
+    if digits:
+        condition |= Q(phone__contains=digits)
+    return Profile.objects.filter(condition).annotate(rank=prefix_bonus(query)).order_by('-rank', 'name', 'uuid')
+
+
+def trigram_search(query: str) -> QuerySet:
+    """
+    Префиксный и нечеткий поиск по триграммам (pg_trgm): каждое условие идет по своему GIN индексу
+    из миграции 0008, компании ищутся отдельным запросом, чтобы условие по ним тоже шло по индексу
+    users_profile.company_id.
+    Ранг - лучшее word_similarity по колонкам плюс бонус за совпадение с начала
+    """
+    query = normalize(query)
+    company_ids: List[int] = list(Company.objects.filter(TrigramWordSimilar(F('title'), query))
+                                  .values_list('id', flat=True)[:settings.ADMIN_SEARCH_MAX_COMPANIES])
+    condition = Q(TrigramWordSimilar(F('name'), query)) | Q(TrigramWordSimilar(F('email'), query))
+    if company_ids:
+        condition |= Q(company_id__in=company_ids)
+    similarity = [TrigramWordSimilarity(query, 'name'), TrigramWordSimilarity(query, 'email'),
+                  Coalesce(TrigramWordSimilarity(query, 'company__title'), Value(0.0))]
+    digits: str = phone_digits(query)
+    if digits:
+        condition |= Q(phone__contains=digits)
+        similarity.append(Case(When(phone__contains=digits, then=Value(1.0)), default=Value(0.0),
+                               output_field=FloatField()))
+    return Profile.objects.filter(condition) \
+        .annotate(rank=Greatest(*similarity, output_field=FloatField()) + prefix_bonus(query)) \
+        .order_by('-rank', 'uuid')
+
+
+def search_profiles(query: str) -> QuerySet:
+    """Профили по имени, почте, телефону и названию компании, от лучшего совпадения"""
+    if connections[Profile.objects.db].vendor == 'postgresql':
+        return trigram_search(query)
+    return icontains_search(query)
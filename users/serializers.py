@@ -1,9 +1,78 @@
+from functools import lru_cache
+from typing import Dict, Optional
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core.files.storage import default_storage
+from django.core.signals import setting_changed
+from django.db import models
+from django.dispatch import receiver
+from PIL import Image
 from rest_framework import serializers
 
+from .images import AVATAR_FORMATS, AVATAR_SIZES, check_pixels, derivative_name
+from .media import signed_query
 from .models import Account, Company, Profile, ProfileMail
 
 
+# URL кешируются на весь процесс по классу хранилища и имени файла: это верно для хранилищ с постоянными
+# URL (FileSystemStorage, публичный бакет). Подписанные или истекающие URL хранилища (S3 с querystring_auth)
+# кешировать нельзя, для такого хранилища кеш нужно убрать
+@lru_cache(maxsize=8192)
+def _storage_url(storage: type, name: str) -> str:
+    return f'{default_storage.url(name)}{signed_query(name)}'
+
+
+def storage_url(name: str) -> str:
+    """
+    URL файла зависит только от хранилища и имени, а urljoin в FileSystemStorage.url заметен на каждом профиле.
+    Оригиналы загрузок получают подпись, по которой их отдает users.media
+    """
+    return _storage_url(default_storage.__class__, name)
+
+
+def media_url(name: str, request=None) -> str:
+    url: str = storage_url(name)
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+@lru_cache(maxsize=4096)
+def _derivative_urls(storage: type, image_hash: str) -> Dict[str, Dict[int, str]]:
+    return {extension: {size: default_storage.url(derivative_name(image_hash, size, extension))
+                        for size in reversed(AVATAR_SIZES)}
+            for extension in AVATAR_FORMATS}
+
+
+def derivative_urls(image_hash: str) -> Dict[str, Dict[int, str]]:
+    """URL производных по форматам и размерам, от меньшего: путь по хешу не меняется, URL считается один раз"""
+    return _derivative_urls(default_storage.__class__, image_hash)
+
+
+def thumbnail_url(image_name: str, image_hash: str, request=None) -> Optional[str]:
+    """Пока воркер готовит производные, thumbnail - оригинал"""
+    if not image_hash:
+        return media_url(image_name, request) if image_name else None
+    url: str = derivative_urls(image_hash)['jpeg'][AVATAR_SIZES[0]]
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def srcset_urls(image_hash: str, request=None) -> Dict[str, str]:
+    """Значения srcset по форматам: {'webp': '<url> 32w, <url> 64w, ...', 'jpeg': ...}, пустой без производных"""
+    if not image_hash:
+        return {}
+    absolute = request.build_absolute_uri if request is not None else str
+    return {extension: ', '.join(f'{absolute(url)} {size}w' for size, url in urls.items())
+            for extension, urls in derivative_urls(image_hash).items()}
+
+
+@receiver(setting_changed)
+def reset_media_urls(setting: str, **kwargs) -> None:
+    if setting in ('MEDIA_URL', 'STORAGES'):
+        _storage_url.cache_clear()
+        _derivative_urls.cache_clear()
+
+
 class UserSerializer(serializers.ModelSerializer):
     """Сериализация модели User"""
 
@@ -12,6 +81,17 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ('username', 'email')
 
 
+class RegistrationSerializer(UserSerializer):
+    """
+    Данные регистрации: формат имени и почты. Уникальность имени проверяет ограничение в бд
+    при создании пользователя, без отдельного запроса
+    """
+    email = serializers.EmailField()
+
+    class Meta(UserSerializer.Meta):
+        extra_kwargs = {'username': {'validators': [UnicodeUsernameValidator()]}}
+
+
 class AccountSerializer(serializers.ModelSerializer):
     """Сериализация модели Account"""
     user: User = serializers.HiddenField(default=serializers.CurrentUserDefault())
@@ -30,14 +110,41 @@ class CompanySerializer(serializers.ModelSerializer):
         fields = ('title', 'industry', 'role', 'people', 'links')
 
 
+class MediaImageField(serializers.ImageField):
+    """ImageField, URL которого строит media_url: с подписью для оригиналов, как у FastProfileSerializer"""
+
+    def to_representation(self, value) -> Optional[str]:
+        return media_url(value.name, self.context.get('request')) if value else None
+
+
 class ProfileSerializer(serializers.ModelSerializer):
     """Сериализация модели Profile"""
+    serializer_field_mapping = {**serializers.ModelSerializer.serializer_field_mapping,
+                                models.ImageField: MediaImageField}
     user: User = serializers.HiddenField(default=serializers.CurrentUserDefault())
     company: Company = CompanySerializer(many=False)
+    # пока воркер готовит производные, thumbnail отдает оригинал, а srcset пустой
+    thumbnail: str = serializers.SerializerMethodField()
+    srcset: Dict[str, str] = serializers.SerializerMethodField()
 
     class Meta:
         model = Profile
-        fields = ('user', 'uuid', 'name', 'image', 'email', 'phone', 'created', 'updated', 'company')
+        fields = ('user', 'uuid', 'name', 'image', 'thumbnail', 'srcset', 'email', 'phone', 'created',
+                  'updated', 'company')
+
+    def validate_image(self, image):
+        # сам файл уже проверен по размеру при загрузке (users.uploads), здесь - число пикселей
+        try:
+            check_pixels(image.image)
+        except Image.DecompressionBombError as e:
+            raise serializers.ValidationError(str(e))
+        return image
+
+    def get_thumbnail(self, profile: Profile) -> Optional[str]:
+        return thumbnail_url(profile.image.name, profile.image_hash, self.context.get('request'))
+
+    def get_srcset(self, profile: Profile) -> Dict[str, str]:
+        return srcset_urls(profile.image_hash, self.context.get('request'))
 
     def update(self, instance, validated_data):
         company_data = validated_data.pop('company', {})
@@ -47,9 +154,49 @@ class ProfileSerializer(serializers.ModelSerializer):
         return instance
 
 
+class AdminAccountSerializer(serializers.ModelSerializer):
+    """Строка admin списка аккаунтов"""
+    username: str = serializers.CharField(source='user.username', read_only=True)
+
+    class Meta:
+        model = Account
+        fields = ('id', 'username', 'is_admin')
+
+
+class AdminCompanySerializer(serializers.ModelSerializer):
+    """Строка admin списка компаний, без links"""
+
+    class Meta:
+        model = Company
+        fields = ('id', 'account', 'title', 'industry', 'role', 'people', 'updated')
+
+
+class AdminProfileSerializer(serializers.ModelSerializer):
+    """Строка admin списка профилей, без изображений"""
+
+    class Meta:
+        model = Profile
+        fields = ('uuid', 'account', 'company', 'name', 'email', 'phone', 'created', 'updated')
+
+
+class ProfileSearchSerializer(AdminProfileSerializer):
+    """Результат admin поиска профилей"""
+    company_title: Optional[str] = serializers.CharField(source='company.title', read_only=True, allow_null=True)
+    rank: float = serializers.FloatField(read_only=True)
+
+    class Meta(AdminProfileSerializer.Meta):
+        fields = AdminProfileSerializer.Meta.fields + ('company_title', 'rank')
+
+
 class ProfileMailSerializer(serializers.ModelSerializer):
     """Сериализация модели ProfileMail"""
 
     class Meta:
         model = ProfileMail
         fields = '__all__'
+
+
+class ProfileBatchSerializer(serializers.Serializer):
+    """Запрос нескольких профилей одним ответом"""
+    uuids = serializers.ListField(child=serializers.UUIDField(), allow_empty=False,
+                                  max_length=settings.PROFILE_BATCH_MAX_SIZE)
@@ -1,17 +1,21 @@
 import secrets
 import string
 import uuid
-from typing import NoReturn, Optional, Union
+from typing import Dict, NoReturn, Optional, Tuple, Union
 
 import jwt
 import redis
 from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.urls import reverse
+from django.db import transaction
 from rest_framework import exceptions, status
 from rest_framework.exceptions import NotFound
 
+from .mail_templates import mail_locale, mail_templates, signin_link
+from .models import Account
+from .tasks import MessageMail, enqueue_mail, render_message
+
 redis_obj = redis.StrictRedis(host=settings.REDIS_HOST,
                               port=settings.REDIS_PORT,
                               db=settings.REDIS_DB,
@@ -35,21 +39,40 @@ def get_user(username: str) -> Union[User | NoReturn]:
                        code=status.HTTP_404_NOT_FOUND)
 
 
-def create_message(email: str, token: uuid, username: str) -> str:
-    """Функция создает каркас сообщения для отправки пользователю"""
-    try:
-        link = reverse('signin', kwargs={'email': email, 'token': token})
-        password: str = generate_password(12)
+def registration_message(email: str, token: uuid, username: str, locale: Optional[str] = None) -> MessageMail:
+    """
+    Письмо регистрации для outbox: ссылка на шаблоны mail/registration.* и контекст без пароля.
+    Пароль воркер почты берет из Redis при отправке (tasks.MAIL_SECRETS)
+    """
+    context: Dict[str, str] = {'username': username, 'token': str(token), 'link': signin_link(email, token)}
+    locale = mail_locale(locale)
+    return MessageMail(subject=mail_templates.get('registration', locale).render_subject(context), body='',
+                       template='registration', context=context, locale=locale, priority=1, to=[email])
+
+
+def create_message(email: str, token: uuid, username: str, password: str,
+                   locale: Optional[str] = None) -> MessageMail:
+    """Письмо со ссылкой и данными для входа из скомпилированных шаблонов mail/registration.*"""
+    return render_message(registration_message(email, token, username, locale), {'password': password})
+
+
+def register_account(username: str, email: str, password: str, hashed_password: str,
+                     token: uuid, mail: MessageMail) -> Tuple[User, Account]:
+    """
+    Регистрация одной единицей работы: пользователь сразу с хешем пароля (один INSERT),
+    его аккаунт, письмо со ссылкой в outbox и пароль для входа в Redis, откуда его возьмет и письмо.
+    Если Redis недоступен, транзакция откатывается.
+    Хеш считается заранее в hashing_executor, чтобы не держать транзакцию открытой
+    """
+    with transaction.atomic():
+        user: User = User(username=User.normalize_username(username),
+                          email=User.objects.normalize_email(email),
+                          password=hashed_password)
+        user.save(force_insert=True)
+        account: Account = Account.objects.create(user=user, token=token)
+        enqueue_mail(mail)
         redis_obj.set(f'{username}', password)
-        verification_link: str = f'{settings.DOMAIN_NAME}{link}'
-        message: str = f'Благодарим вас за регистрацию в KravzovCRM. Ваши данные для входа в систему: ' \
-                       f'{username} - логин, ' \
-                       f'{token} - уникальный id вашего аккаунта, ' \
-                       f'{password} - пароль. ' \
-                       f'Для входа перейдите по ссылке: <a href="{verification_link}">{verification_link}</a>'
-        return message
-    except Exception as e:
-        return f"В ходе выполнения функции create_message произошла ошибка {e}"
+    return user, account
 
 
 def get_payload(request) -> dict:
@@ -0,0 +1,49 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cache import token_cache
+from .mail_config import mail_config_cache
+from .models import Account, Company, Profile, ProfileMail
+from .profile_cache import profile_cache
+
+
+@receiver([post_save, post_delete], sender=ProfileMail)
+def invalidate_profile_mail(sender, instance: ProfileMail, **kwargs) -> None:
+    """Сбрасывает кеш профиля почты после фиксации транзакции, чтобы его не заполнили старыми данными"""
+    # после удаления Django обнуляет pk экземпляра, а внешняя транзакция может зафиксироваться позже
+    profile_mail_id = instance.id
+    transaction.on_commit(lambda: mail_config_cache.invalidate(profile_mail_id))
+
+
+@receiver([post_save, post_delete], sender=Profile)
+def invalidate_profile(sender, instance: Profile, **kwargs) -> None:
+    profile_uuid = instance.pk
+    transaction.on_commit(lambda: profile_cache.invalidate([profile_uuid]))
+
+
+@receiver(post_save, sender=Company)
+def invalidate_company_profiles(sender, instance: Company, **kwargs) -> None:
+    """Компания входит в JSON профиля"""
+    company_id = instance.pk
+    transaction.on_commit(lambda: profile_cache.invalidate(
+        Profile.objects.filter(company_id=company_id).values_list('uuid', flat=True)))
+
+
+@receiver(pre_delete, sender=Company)
+def invalidate_deleted_company_profiles(sender, instance: Company, **kwargs) -> None:
+    # после удаления у профилей уже company=NULL (SET_NULL), поэтому список собирается заранее
+    profile_uuids = list(Profile.objects.filter(company_id=instance.pk).values_list('uuid', flat=True))
+    transaction.on_commit(lambda: profile_cache.invalidate(profile_uuids))
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=Account)
+def invalidate_user_tokens(sender, instance, **kwargs) -> None:
+    """
+    Снимки пользователя и аккаунта в кеше токенов заменяют проверку прав по бд, поэтому изменения
+    из админки, ORM и команд сбрасывают их так же, как ProfileAccount
+    """
+    user_id: int = instance.pk if sender is User else instance.user_id
+    transaction.on_commit(lambda: token_cache.invalidate_user(user_id))
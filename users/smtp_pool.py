@@ -0,0 +1,200 @@
+import logging
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+
+from .models import ProfileMail
+
+logger = logging.getLogger(__name__)
+
+# поля ProfileMail, от которых зависит соединение: при их изменении пул пересоздается
+CONNECTION_FIELDS: Tuple[str, ...] = ('email_backend', 'email_host', 'email_port', 'email_host_user',
+                                      'email_host_password', 'email_use_tls', 'email_use_ssl',
+                                      'email_use_localtime', 'email_timeout', 'email_ssl_certfile',
+                                      'email_ssl_keyfile')
+
+
+def connection_fingerprint(config: ProfileMail) -> Tuple:
+    # пустой FileField из бд и None у несохраненного профиля должны совпадать
+    return tuple(str(getattr(config, field) or '') for field in CONNECTION_FIELDS)
+
+
+def open_connection(config: ProfileMail) -> BaseEmailBackend:
+    """Новое открытое соединение по настройкам профиля почты"""
+    connection: BaseEmailBackend = mail.get_connection(backend=config.email_backend,
+                                                       host=config.email_host, port=config.email_port,
+                                                       username=config.email_host_user,
+                                                       password=config.email_host_password,
+                                                       use_tls=config.email_use_tls,
+                                                       use_ssl=config.email_use_ssl,
+                                                       use_localtime=config.email_use_localtime,
+                                                       # timeout=0 перевел бы сокет в неблокирующий режим
+                                                       timeout=config.email_timeout or None,
+                                                       ssl_certfile=config.email_ssl_certfile,
+                                                       ssl_keyfile=config.email_ssl_keyfile,
+                                                       fail_silently=False)
+    connection.open()
+    return connection
+
+
+def is_alive(connection: BaseEmailBackend) -> bool:
+    smtp: Optional[smtplib.SMTP] = getattr(connection, 'connection', None)
+    if smtp is None:
+        # у не SMTP бэкендов (locmem, console) проверять нечего
+        return True
+    try:
+        return smtp.noop()[0] == 250
+    except (smtplib.SMTPException, OSError):
+        return False
+
+
+def is_transport_error(error: Exception) -> bool:
+    """Ошибка соединения, а не ответ сервера на конкретное письмо"""
+    # SMTPException наследует OSError, но большинство из них соединение не рвут
+    return isinstance(error, smtplib.SMTPServerDisconnected) or \
+        (isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException))
+
+
+def close_quietly(connection: BaseEmailBackend) -> None:
+    try:
+        connection.close()
+    except Exception as e:
+        logger.debug(f'Ошибка при закрытии SMTP соединения: {e}')
+
+
+class SMTPConnectionPool:
+    """
+    Открытые соединения одного профиля почты. Не больше max_size соединений одновременно,
+    простоявшие дольше idle_timeout закрываются, простоявшие дольше health_check_interval
+    перед выдачей проверяются командой NOOP
+    """
+
+    def __init__(self, config: ProfileMail, max_size: int, idle_timeout: float,
+                 health_check_interval: float = 5.0, acquire_timeout: Optional[float] = None):
+        self.config = config
+        self.fingerprint: Tuple = connection_fingerprint(config)
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self.opened: int = 0
+        self.reused: int = 0
+        self._idle: List[Tuple[float, BaseEmailBackend]] = []
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._closed: bool = False
+
+    def acquire(self) -> BaseEmailBackend:
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError(f'Нет свободного SMTP соединения для профиля {self.config.id}')
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    # последним возвращенное соединение самое свежее
+                    released_at, connection = self._idle.pop()
+                idle: float = time.monotonic() - released_at
+                if idle > self.idle_timeout or (idle > self.health_check_interval and not is_alive(connection)):
+                    close_quietly(connection)
+                    continue
+                self.reused += 1
+                return connection
+            connection = open_connection(self.config)
+            self.opened += 1
+            return connection
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, connection: BaseEmailBackend, broken: bool = False) -> None:
+        try:
+            with self._lock:
+                if not broken and not self._closed:
+                    self._idle.append((time.monotonic(), connection))
+                    return
+            close_quietly(connection)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self) -> Iterator[BaseEmailBackend]:
+        connection: BaseEmailBackend = self.acquire()
+        broken: bool = True
+        try:
+            yield connection
+            broken = False
+        except Exception as e:
+            # сервер отклонил письмо, но само соединение исправно
+            broken = is_transport_error(e)
+            raise
+        finally:
+            self.release(connection, broken)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for _, connection in idle:
+            close_quietly(connection)
+
+    def stats(self) -> Dict[str, int]:
+        return {'idle': len(self._idle), 'opened': self.opened, 'reused': self.reused}
+
+
+class SMTPPoolRegistry:
+    """Пулы соединений по ProfileMail.id, пул пересоздается при изменении настроек профиля"""
+
+    def __init__(self, max_size: int, idle_timeout: float, enabled: bool = True):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.enabled = enabled
+        self._pools: Dict[str, SMTPConnectionPool] = {}
+        self._lock = threading.Lock()
+
+    def get(self, config: ProfileMail) -> SMTPConnectionPool:
+        key: str = str(config.id)
+        with self._lock:
+            pool: Optional[SMTPConnectionPool] = self._pools.get(key)
+            if pool is not None and pool.fingerprint == connection_fingerprint(config):
+                return pool
+            stale, pool = pool, SMTPConnectionPool(config, self.max_size, self.idle_timeout)
+            self._pools[key] = pool
+        if stale is not None:
+            stale.close()
+        return pool
+
+    @contextmanager
+    def connection(self, config: ProfileMail) -> Iterator[BaseEmailBackend]:
+        if not self.enabled:
+            with open_connection(config) as connection:
+                yield connection
+            return
+        with self.get(config).connection() as connection:
+            yield connection
+
+    def discard(self, profile_mail_id) -> None:
+        with self._lock:
+            pool: Optional[SMTPConnectionPool] = self._pools.pop(str(profile_mail_id), None)
+        if pool is not None:
+            pool.close()
+
+    def close_all(self) -> None:
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.close()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {key: pool.stats() for key, pool in list(self._pools.items())}
+
+
+smtp_pools = SMTPPoolRegistry(max_size=settings.SMTP_POOL_MAX_SIZE,
+                              idle_timeout=settings.SMTP_POOL_IDLE_TIMEOUT,
+                              enabled=settings.SMTP_POOL_ENABLED)
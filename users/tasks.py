@@ -1,13 +1,46 @@
 import asyncio
+import logging
+import random
+import smtplib
 import uuid
 from dataclasses import dataclass
-from typing import Dict, Optional
+from datetime import timedelta
+from typing import (AsyncIterable, AsyncIterator, Dict, Iterable, List,
+                    Optional, Set, Tuple, TypeVar, Union)
 
 from asgiref.sync import sync_to_async
-from django.core import mail
-from django.core.mail import EmailMessage
+from django.conf import settings
+from django.core.mail import (BadHeaderError, EmailMessage, EmailMultiAlternatives,
+                              make_msgid)
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
 
-from users.models import ProfileMail
+from users.async_smtp import async_smtp_pools, supports_async
+from users.cache import get_async_redis
+from users.mail_config import mail_config_cache
+from users.mail_templates import mail_templates
+from users.models import OutboxMail, ProfileMail
+from users.ratelimit import smtp_rate_limiter
+from users.smtp_pool import (SMTPPoolRegistry, close_quietly, is_transport_error,
+                             smtp_pools)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# секреты писем из шаблонов: шаблон -> (имя в контексте шаблона, поле контекста с ключом Redis).
+# Пароль регистрации лежит в Redis до входа пользователя, в outbox он не пишется
+MAIL_SECRETS: Dict[str, Tuple[str, str]] = {'registration': ('password', 'username')}
+
+
+class MailSecretMissing(Exception):
+    """Секрета письма уже нет в Redis (пользователь вошел или ключ удален), письмо не собрать"""
+
+
+# ошибки, после которых повтор не поможет: письмо сразу уходит в dead
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, BadHeaderError, ProfileMail.DoesNotExist, MailSecretMissing)
 
 
 @dataclass(frozen=False, slots=True)
@@ -22,6 +55,159 @@ class MessageMail:
     headers: Optional[Dict] = None
     content_subtype: Optional[str] = 'html'
     attach_file: Optional[str] = ''
+    # профиль почты для массовой отправки, None - активный профиль
+    profile_mail: Optional[uuid.UUID] = None
+    # текстовая версия HTML письма, уходит как multipart/alternative
+    text_body: Optional[str] = ''
+    # письмо из шаблона mail_templates: outbox хранит имя, контекст без секретов и локаль,
+    # тело собирается при отправке (render_message)
+    template: Optional[str] = ''
+    context: Optional[Dict] = None
+    locale: Optional[str] = ''
+
+    @classmethod
+    def from_outbox(cls, record: OutboxMail) -> 'MessageMail':
+        return cls(subject=record.subject, body=record.body, to=record.to,
+                   reply_to=record.reply_to[0] if record.reply_to else '',
+                   priority=record.priority, headers=dict(record.headers),
+                   content_subtype=record.content_subtype, attach_file=record.attach_file,
+                   profile_mail=record.profile_mail_id, text_body=record.text_body,
+                   template=record.template, context=dict(record.context), locale=record.locale)
+
+
+def render_message(message: MessageMail, secrets: Dict[str, str]) -> MessageMail:
+    """Тема и тело письма из шаблона: сохраненный контекст вместе с секретами"""
+    rendered = mail_templates.render(message.template, {**message.context, **secrets}, message.locale or None)
+    message.subject, message.body, message.text_body = rendered.subject, rendered.html, rendered.text
+    return message
+
+
+async def mail_secrets(message: MessageMail) -> Dict[str, str]:
+    """Секреты письма из шаблона, читаются из Redis при каждой попытке отправки"""
+    if message.template not in MAIL_SECRETS:
+        return {}
+    name, key = MAIL_SECRETS[message.template]
+    value: Optional[str] = await get_async_redis().get(message.context[key])
+    if value is None:
+        raise MailSecretMissing(f'{name} для письма {message.template} уже нет в Redis')
+    return {name: value}
+
+
+def enqueue_mail(message: MessageMail, profile_mail: Optional[uuid.UUID] = None) -> OutboxMail:
+    """
+    Кладет письмо в outbox. Вызывается в той же транзакции, что и изменения данных,
+    поэтому письмо не теряется при рестарте и не уходит при откате.
+    У письма из шаблона тело не сохраняется, только ссылка на шаблон и контекст
+    """
+    headers: Dict[str, str] = dict(message.headers or {})
+    # Message-ID фиксируется при постановке в очередь и не меняется между повторами
+    headers.setdefault('Message-ID', make_msgid())
+    return OutboxMail.objects.create(profile_mail_id=profile_mail,
+                                     subject=message.subject,
+                                     body='' if message.template else message.body,
+                                     text_body='' if message.template else message.text_body or '',
+                                     template=message.template or '',
+                                     context=message.context or {},
+                                     locale=message.locale or '',
+                                     to=list(message.to),
+                                     reply_to=[message.reply_to] if message.reply_to else [],
+                                     headers=headers,
+                                     content_subtype=message.content_subtype,
+                                     attach_file=message.attach_file or '',
+                                     priority=message.priority)
+
+
+@dataclass(frozen=True, slots=True)
+class MailResult:
+    message: MessageMail
+    sent: bool
+    error: Optional[str] = None
+
+
+def build_email(mail_message: MessageMail, connection: Optional[BaseEmailBackend]) -> EmailMessage:
+    email_message = EmailMultiAlternatives(
+        subject=mail_message.subject,
+        body=mail_message.text_body or mail_message.body,
+        from_email=mail_message.from_email,
+        to=mail_message.to,
+        connection=connection,
+        reply_to=[mail_message.reply_to] if mail_message.reply_to else None,
+        headers=mail_message.headers,
+    )
+    if mail_message.attach_file:
+        email_message.attach_file(mail_message.attach_file)
+
+    if mail_message.text_body:
+        # основное тело - текст, HTML идет альтернативой для почтовых клиентов, которые его показывают
+        email_message.attach_alternative(mail_message.body, f'text/{mail_message.content_subtype}')
+    else:
+        email_message.content_subtype = mail_message.content_subtype
+    return email_message
+
+
+def prepare(mail_message: MessageMail, mail_config: ProfileMail) -> MessageMail:
+    mail_message.from_email = mail_config.email_from_email
+    if not mail_message.headers:
+        mail_message.headers = {"Message-ID": make_msgid()}
+    return mail_message
+
+
+def send_chunk(mail_config: ProfileMail, chunk: List[Tuple[int, MessageMail]],
+               pools: SMTPPoolRegistry = smtp_pools) -> List[Tuple[int, MailResult]]:
+    """Отправляет пачку писем одного профиля через одно соединение, результат по каждому письму"""
+    results: List[Tuple[int, MailResult]] = []
+    with pools.connection(mail_config) as mail_connection:
+        for position, (index, mail_message) in enumerate(chunk):
+            try:
+                mail_connection.send_messages([build_email(prepare(mail_message, mail_config), mail_connection)])
+            except Exception as e:
+                results.append((index, MailResult(mail_message, False, f'{type(e).__name__}: {e}')))
+                if not is_transport_error(e):
+                    continue
+                # соединение оборвалось: остаток пачки идет через новое
+                close_quietly(mail_connection)
+                try:
+                    mail_connection.open()
+                except Exception as reconnect_error:
+                    error: str = f'{type(reconnect_error).__name__}: {reconnect_error}'
+                    results.extend((index, MailResult(rest, False, error)) for index, rest in chunk[position + 1:])
+                    break
+            else:
+                results.append((index, MailResult(mail_message, True)))
+    return results
+
+
+async def asend_chunk(mail_config: ProfileMail,
+                      chunk: List[Tuple[int, MessageMail]]) -> List[Tuple[int, MailResult]]:
+    """send_chunk через асинхронный SMTP транспорт"""
+    results: List[Tuple[int, MailResult]] = []
+    async with async_smtp_pools.connection(mail_config) as mail_connection:
+        for position, (index, mail_message) in enumerate(chunk):
+            try:
+                await mail_connection.send_email(build_email(prepare(mail_message, mail_config), None))
+            except Exception as e:
+                results.append((index, MailResult(mail_message, False, f'{type(e).__name__}: {e}')))
+                if not is_transport_error(e):
+                    continue
+                await mail_connection.close()
+                try:
+                    await mail_connection.connect()
+                except Exception as reconnect_error:
+                    error: str = f'{type(reconnect_error).__name__}: {reconnect_error}'
+                    results.extend((index, MailResult(rest, False, error)) for index, rest in chunk[position + 1:])
+                    break
+            else:
+                results.append((index, MailResult(mail_message, True)))
+    return results
+
+
+async def aiterate(messages: Union[Iterable[T], AsyncIterable[T]]) -> AsyncIterator[T]:
+    if hasattr(messages, '__aiter__'):
+        async for message in messages:
+            yield message
+    else:
+        for message in messages:
+            yield message
 
 
 class MailCenter:
@@ -31,43 +217,169 @@ class MailCenter:
         self.profile_mail = profile_mail
         self.mail_message = mail_message
 
-    async def send_mail_simple(self) -> None:
-        """Отправка почтового сообщения"""
-        await asyncio.sleep(3)
-
-        mail_config = await sync_to_async(lambda: ProfileMail.objects.get(email_act_profile=True))() \
-            if self.profile_mail is None else \
-            await sync_to_async(lambda: ProfileMail.objects.get(id__exact=self.profile_mail))()
-
-        self.mail_message.from_email = mail_config.email_from_email
-        self.mail_message.headers = {"Message-ID": uuid.uuid4()}
-
-        with mail.get_connection(host=mail_config.email_host, port=mail_config.email_port,
-                                 username=mail_config.email_host_user,
-                                 password=mail_config.email_host_password,
-                                 use_tls=mail_config.email_use_tls,
-                                 use_ssl=mail_config.email_use_ssl,
-                                 use_localtime=mail_config.email_use_localtime,
-                                 timeout=mail_config.email_timeout,
-                                 ssl_certfile=mail_config.email_ssl_certfile,
-                                 ssl_keyfile=mail_config.email_ssl_keyfile,
-                                 fail_silently=False,
-                                 ) as mail_connection:
-            email_message = EmailMessage(
-                subject=self.mail_message.subject,
-                body=self.mail_message.body,
-                from_email=self.mail_message.from_email,
-                to=self.mail_message.to,
-                connection=mail_connection,
-                reply_to=self.mail_message.reply_to,
-                headers=self.mail_message.headers,
-            )
-            if self.mail_message.attach_file:
-                email_message.attach_file(self.mail_message.attach_file)
-
-            email_message.content_subtype = self.mail_message.content_subtype
+    async def get_config(self) -> ProfileMail:
+        # профили почты кешируются в процессе, бд читается только после их изменения
+        return await mail_config_cache.aget(self.profile_mail)
+
+    async def send_mail_simple(self) -> int:
+        """Отправка почтового сообщения, ошибки SMTP пробрасываются вызывающему"""
+        mail_config: ProfileMail = await self.get_config()
+        prepare(self.mail_message, mail_config)
+        await smtp_rate_limiter.acquire(mail_config.email_host)
+
+        if supports_async(mail_config):
+            # SMTP диалог идет в event loop, ожидающее письмо стоит корутину, а не поток
+            async with async_smtp_pools.connection(mail_config) as mail_connection:
+                return int(await mail_connection.send_email(build_email(self.mail_message, None)))
+
+        # соединение и отправка блокируют, поэтому уходят в отдельный поток, а не в общий sync_to_async
+        return await sync_to_async(self.send, thread_sensitive=False)(mail_config)
+
+    def send(self, mail_config: ProfileMail, pools: SMTPPoolRegistry = smtp_pools) -> int:
+        # соединение берется из пула профиля: без TCP, STARTTLS и AUTH на каждое письмо
+        with pools.connection(mail_config) as mail_connection:
+            return build_email(self.mail_message, mail_connection).send(fail_silently=False)
+
+    @classmethod
+    async def send_bulk(cls, messages: Union[Iterable[MessageMail], AsyncIterable[MessageMail]],
+                        chunk_size: int = 100, concurrency: int = settings.SMTP_POOL_MAX_SIZE,
+                        pools: SMTPPoolRegistry = smtp_pools) -> List[MailResult]:
+        """
+        Массовая отправка. Письма группируются по MessageMail.profile_mail (None - активный профиль),
+        пачка из chunk_size писем уходит через одно соединение пула, одновременно не больше concurrency пачек.
+        Скорость ограничивается token bucket на SMTP хост. Ошибка одного письма не прерывает остальные,
+        результаты возвращаются по каждому письму в порядке входа
+        """
+        results: List[Optional[MailResult]] = []
+        buffers: Dict[Optional[uuid.UUID], List[Tuple[int, MessageMail]]] = {}
+        slots = asyncio.Semaphore(concurrency)
+        tasks: List[asyncio.Task] = []
+
+        async def dispatch(profile_mail: Optional[uuid.UUID], chunk: List[Tuple[int, MessageMail]]) -> None:
             try:
-                result = await sync_to_async(email_message.send)(fail_silently=False)
-                print('{s}send....'.format(s=result))
-            except RuntimeError as err:
-                print(err)
+                chunk_results: List[Tuple[int, MailResult]] = await cls.send_chunk(profile_mail, chunk, pools)
+            except Exception as e:
+                # соединение пачки не открылось или не дождались слота пула: не отправлено ни одно письмо пачки
+                logger.warning(f'Пачка из {len(chunk)} писем профиля {profile_mail} не отправлена: {e}')
+                error: str = f'{type(e).__name__}: {e}'
+                chunk_results = [(index, MailResult(message, False, error)) for index, message in chunk]
+            finally:
+                slots.release()
+            for index, result in chunk_results:
+                results[index] = result
+
+        async def flush(profile_mail: Optional[uuid.UUID]) -> None:
+            # генератор писем ждет свободную пачку, а не копит их в памяти
+            await slots.acquire()
+            tasks.append(asyncio.create_task(dispatch(profile_mail, buffers.pop(profile_mail))))
+
+        async for message in aiterate(messages):
+            results.append(None)
+            buffer: List[Tuple[int, MessageMail]] = buffers.setdefault(message.profile_mail, [])
+            buffer.append((len(results) - 1, message))
+            if len(buffer) >= chunk_size:
+                await flush(message.profile_mail)
+        for profile_mail in list(buffers):
+            await flush(profile_mail)
+        await asyncio.gather(*tasks)
+        return results
+
+    @staticmethod
+    async def send_chunk(profile_mail: Optional[uuid.UUID], chunk: List[Tuple[int, MessageMail]],
+                         pools: SMTPPoolRegistry = smtp_pools) -> List[Tuple[int, MailResult]]:
+        try:
+            mail_config: ProfileMail = await mail_config_cache.aget(profile_mail)
+        except ProfileMail.DoesNotExist as e:
+            return [(index, MailResult(message, False, f'{type(e).__name__}: {e}')) for index, message in chunk]
+        await smtp_rate_limiter.acquire(mail_config.email_host, len(chunk))
+        if supports_async(mail_config):
+            return await asend_chunk(mail_config, chunk)
+        return await sync_to_async(send_chunk, thread_sensitive=False)(mail_config, chunk, pools)
+
+
+class OutboxWorker:
+    """
+    Воркер outbox: забирает готовые к отправке письма, отправляет до concurrency писем одновременно,
+    при ошибке откладывает письмо с экспоненциальной задержкой, после max_attempts попыток помечает dead.
+    Забранное письмо скрыто от других воркеров на lease секунд, после падения воркера его заберут снова
+    """
+
+    def __init__(self, concurrency: int = 10, max_attempts: int = 8, backoff_base: float = 5.0,
+                 backoff_max: float = 3600.0, lease: float = 300.0, poll_interval: float = 1.0):
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease = lease
+        self.poll_interval = poll_interval
+
+    def claim(self, limit: int) -> List[OutboxMail]:
+        now = timezone.now()
+        with transaction.atomic():
+            batch: List[OutboxMail] = list(OutboxMail.objects
+                                           .select_for_update(skip_locked=True)
+                                           .filter(status='pending', next_attempt_at__lte=now)
+                                           .order_by('next_attempt_at')[:limit])
+            OutboxMail.objects.filter(id__in=[record.id for record in batch]) \
+                .update(attempts=F('attempts') + 1, next_attempt_at=now + timedelta(seconds=self.lease))
+        for record in batch:
+            record.attempts += 1
+        return batch
+
+    def backoff(self, attempts: int) -> float:
+        delay: float = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        # разброс, чтобы письма после сбоя SMTP не возвращались одной волной
+        return delay * random.uniform(0.8, 1.2)
+
+    def mark_sent(self, record: OutboxMail) -> None:
+        OutboxMail.objects.filter(id=record.id).update(status='sent', sent_at=timezone.now(), last_error='')
+
+    def mark_failed(self, record: OutboxMail, error: Exception) -> None:
+        fields = {'last_error': f'{type(error).__name__}: {error}'}
+        if isinstance(error, PERMANENT_ERRORS) or record.attempts >= self.max_attempts:
+            logger.error(f'Письмо {record.id} не доставлено после {record.attempts} попыток: {error}')
+            fields['status'] = 'dead'
+        else:
+            fields['next_attempt_at'] = timezone.now() + timedelta(seconds=self.backoff(record.attempts))
+        OutboxMail.objects.filter(id=record.id).update(**fields)
+
+    async def process(self, record: OutboxMail) -> bool:
+        message: MessageMail = MessageMail.from_outbox(record)
+        try:
+            if message.template:
+                render_message(message, await mail_secrets(message))
+            await MailCenter(record.profile_mail_id, message).send_mail_simple()
+        except Exception as e:
+            logger.warning(f'Ошибка отправки письма {record.id}, попытка {record.attempts}: {e}')
+            await sync_to_async(self.mark_failed)(record, e)
+            return False
+        await sync_to_async(self.mark_sent)(record)
+        return True
+
+    async def run_once(self) -> int:
+        """Одна пачка писем, возвращает число обработанных"""
+        batch: List[OutboxMail] = await sync_to_async(self.claim)(self.concurrency)
+        await asyncio.gather(*(self.process(record) for record in batch))
+        return len(batch)
+
+    async def run(self, stop: asyncio.Event) -> None:
+        """Непрерывно разбирает outbox, пока не выставлен stop, затем дожидается начатых отправок"""
+        tasks: Set[asyncio.Task] = set()
+        while not stop.is_set():
+            free: int = self.concurrency - len(tasks)
+            batch: List[OutboxMail] = await sync_to_async(self.claim)(free) if free else []
+            for record in batch:
+                task: asyncio.Task = asyncio.create_task(self.process(record))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if batch and len(tasks) < self.concurrency:
+                continue
+            # ждем освобождения слота, новых писем или остановки
+            waiters = [*tasks, asyncio.create_task(stop.wait())]
+            done, pending = await asyncio.wait(waiters, timeout=self.poll_interval,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            waiters[-1].cancel()
+        if tasks:
+            await asyncio.gather(*tasks)
+        smtp_pools.close_all()
+        await async_smtp_pools.close_all()
@@ -0,0 +1,120 @@
+import socketserver
+import threading
+import time
+from email import message_from_bytes
+from email.message import Message
+from typing import List, Optional
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Минимальный диалог SMTP: EHLO/HELO, AUTH, MAIL, RCPT, DATA, RSET, NOOP, QUIT"""
+    # ответы на конвейер команд уходят несколькими записями, Nagle задержал бы каждую следующую
+    disable_nagle_algorithm = True
+
+    def reply(self, code: int, text: str) -> None:
+        self.wfile.write(f'{code} {text}\r\n'.encode())
+
+    def handle(self) -> None:
+        smtp: 'LocalSMTPServer' = self.server.smtp
+        smtp.count_connection()
+        if smtp.connect_delay:
+            time.sleep(smtp.connect_delay)
+        self.reply(220, 'localhost SMTP ready')
+        recipients: List[str] = []
+        while True:
+            line: bytes = self.rfile.readline()
+            if not line:
+                return
+            command, _, argument = line.decode().strip().partition(' ')
+            command = command.upper()
+            if command == 'EHLO':
+                self.wfile.write(b'250-localhost\r\n250-PIPELINING\r\n250 AUTH PLAIN LOGIN\r\n')
+            elif command == 'HELO':
+                self.reply(250, 'localhost')
+            elif command == 'AUTH':
+                self.reply(235, 'Authentication successful')
+            elif command == 'MAIL':
+                recipients = []
+                self.reply(250, 'OK')
+            elif command == 'RCPT':
+                recipients.append(argument)
+                self.reply(250, 'OK')
+            elif command == 'DATA':
+                self.reply(354, 'End data with <CR><LF>.<CR><LF>')
+                data: List[bytes] = []
+                while True:
+                    chunk: bytes = self.rfile.readline()
+                    if not chunk or chunk in (b'.\r\n', b'.\n'):
+                        break
+                    data.append(chunk[1:] if chunk.startswith(b'..') else chunk)
+                if smtp.accept(b''.join(data)):
+                    self.reply(250, 'OK: queued')
+                else:
+                    self.reply(451, 'Temporary failure, try again later')
+            elif command in ('RSET', 'NOOP'):
+                self.reply(250, 'OK')
+            elif command == 'QUIT':
+                self.reply(221, 'Bye')
+                return
+            else:
+                self.reply(502, 'Command not implemented')
+
+
+class LocalSMTPServer:
+    """
+    Локальный SMTP сервер для тестов и бенчмарков: принимает письма в память без отправки.
+    fail_next отклоняет столько ближайших писем с кодом 451, delay имитирует медленный сервер,
+    connect_delay - стоимость установки соединения (TLS, удаленный хост)
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, delay: float = 0.0, connect_delay: float = 0.0):
+        self.delay = delay
+        self.connect_delay = connect_delay
+        self.fail_next: int = 0
+        self.connections: int = 0
+        self.messages: List[Message] = []
+        self._lock = threading.Lock()
+        self._server = socketserver.ThreadingTCPServer((host, port), _SMTPHandler, bind_and_activate=False)
+        self._server.allow_reuse_address = True
+        self._server.daemon_threads = True
+        self._server.server_bind()
+        self._server.server_activate()
+        self._server.smtp = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def host(self) -> str:
+        return self._server.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def count_connection(self) -> None:
+        with self._lock:
+            self.connections += 1
+
+    def accept(self, data: bytes) -> bool:
+        if self.delay:
+            time.sleep(self.delay)
+        with self._lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                return False
+            self.messages.append(message_from_bytes(data))
+            return True
+
+    def start(self) -> 'LocalSMTPServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'LocalSMTPServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
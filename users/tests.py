@@ -1,17 +1,76 @@
+import asyncio
+import hashlib
+import io
+import json
 import logging
-from typing import Dict
+import os
+import smtplib
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from decimal import Decimal
+from typing import Dict, List, Optional
+from unittest import skipUnless
 from unittest.mock import patch
 
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection, transaction
+from django.test import override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from PIL import Image
 from rest_framework import status
-from rest_framework.test import APIClient, APITestCase
+from rest_framework.decorators import permission_classes
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase
 
-from .models import Account, Company, Profile, ProfileMail
+from . import services
+from .async_smtp import AsyncSMTPConnection, async_smtp_pools
+from .async_views import async_api_view
+from .authentication import Principal, SafeJWTAuthentication
+from .cache import VerifiedTokenCache, redis_obj, token_cache, token_digest
+from .fast_serializers import FastAccountSerializer, FastProfileSerializer
+from .hashing import HashingBusy, HashingExecutor
+from .images import (AVATAR_FORMATS, AVATAR_SIZES, ImageProcessor, decode,
+                     derivative_name, derivative_names)
+from .mail_config import mail_config_cache
+from .mail_templates import mail_templates, signin_link
+from .media import signed_query
+from .models import (Account, BlackListedToken, Company, OutboxMail, Profile,
+                     ProfileMail)
+from .pagination import SearchPagination
+from .permissions import IsAdminAccount, IsTokenValid
+from .profile_cache import ProfileCache, profile_cache
+from .ratelimit import HostRateLimiter, TokenBucket
+from .renderers import ORJSONParser, ORJSONRenderer
+from .revocation import RevocationStore, revocation_store
+from .serializers import AccountSerializer, ProfileSerializer
+from .smtp_pool import smtp_pools
+from .tasks import (MailCenter, MessageMail, OutboxWorker, build_email,
+                    enqueue_mail, render_message)
+from .testing import LocalSMTPServer
+from .utils import generate_access_token, generate_refresh_token
 
 logger = logging.getLogger(__name__)
 BASE_URL = "http://localhost:8001"
 
+# временный MEDIA_ROOT с изображением профиля по умолчанию
+TEST_MEDIA_ROOT: str = tempfile.mkdtemp()
+os.makedirs(os.path.join(TEST_MEDIA_ROOT, 'default'))
+Image.new('RGB', (512, 512)).save(os.path.join(TEST_MEDIA_ROOT, 'default', 'default.jpg'))
+
 
 class ProfileMailTests(APITestCase):
     @staticmethod
@@ -49,10 +108,7 @@ class ProfileMailTests(APITestCase):
 
 
 class RegistrationTests(APITestCase):
-    @patch('users.views.MessageMail')
-    @patch('users.views.MailCenter')
-    @patch('asyncio.ensure_future')
-    def test_create_user(self, mock_ensure_future, mock_mail_center, mock_message_mail) -> None:
+    def test_create_user(self) -> None:
         """Тестирование регистрации пользователей в системе"""
         logger.debug("Starting test create user")
 
@@ -75,6 +131,51 @@ class RegistrationTests(APITestCase):
         self.assertEqual(User.objects.count(), 1)
         self.assertEqual(Account.objects.count(), 1)
 
+    def test_create_user_single_transaction(self) -> None:
+        """Регистрация: пользователь сразу с паролем, аккаунт и письмо в outbox в одной транзакции"""
+        url: str = reverse('registration')
+        # savepoint + INSERT пользователя + INSERT аккаунта + INSERT письма + release
+        with self.assertNumQueries(5):
+            response = self.client.post(url, {"username": "Yuri08", "email": "ukravzov@mail.ru"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        logger.debug("Testing password from Redis matches the stored hash")
+        user: User = User.objects.get(username="Yuri08")
+        self.assertTrue(user.check_password(services.redis_obj.get("Yuri08")))
+        self.assertEqual(Account.objects.get().user_id, user.id)
+
+        logger.debug("Testing login mail waits in the outbox")
+        outbox_mail: OutboxMail = OutboxMail.objects.get()
+        self.assertEqual(outbox_mail.to, ["ukravzov@mail.ru"])
+        self.assertEqual(outbox_mail.status, 'pending')
+        self.assertEqual(outbox_mail.template, 'registration')
+        self.assertEqual(outbox_mail.context['token'], str(Account.objects.get().token))
+
+        logger.debug("Testing the generated password is not stored in the outbox")
+        stored: str = f'{outbox_mail.subject}{outbox_mail.body}{outbox_mail.text_body}{outbox_mail.context}'
+        self.assertNotIn(services.redis_obj.get("Yuri08"), stored)
+
+    def test_create_user_duplicate(self) -> None:
+        User.objects.create_user(username="Yuri08")
+        response = self.client.post(reverse('registration'),
+                                    {"username": "Yuri08", "email": "ukravzov@mail.ru"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Account.objects.count(), 0)
+        self.assertFalse(OutboxMail.objects.exists())
+
+    def test_create_user_invalid(self) -> None:
+        logger.debug("Testing invalid registration data is rejected before the password is hashed")
+        url: str = reverse('registration')
+        for data in ({"username": "Yuri08", "email": "not an email"},
+                     {"username": "Yuri 08!", "email": "ukravzov@mail.ru"},
+                     {"username": "Yuri08"},
+                     {"email": "ukravzov@mail.ru"}):
+            with patch('users.views.hashing_executor.make_password') as make_password:
+                response = self.client.post(url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, data)
+            make_password.assert_not_called()
+        self.assertFalse(User.objects.exists())
+
     # def test_signin(self) -> None:
     #     """Тестирование создания записи в таблице Profile и Company"""
     #     logger.debug("Starting test signin user")
@@ -174,3 +275,1466 @@ class LoginJWTTests(APITestCase):
     #         response = client.post(f'{BASE_URL}/api/user/login/token/refresh/', HTTP_X_CSRFTOKEN=csrf_token)
     #
     #     self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class SafeJWTAuthenticationCacheTests(APITestCase):
+    def setUp(self) -> None:
+        token_cache.clear()
+        self.user = User.objects.create_user(username='Test user', password='Nastya_1337')
+        self.access_token: str = generate_access_token(self.user)
+        self.request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+
+    def test_repeated_token_skips_decode_and_query(self) -> None:
+        logger.debug("Starting test verified token cache")
+        with self.assertNumQueries(1):
+            user, _ = SafeJWTAuthentication().authenticate(self.request)
+        with self.assertNumQueries(0):
+            cached_user, _ = SafeJWTAuthentication().authenticate(self.request)
+
+        self.assertEqual(cached_user.id, self.user.id)
+        self.assertEqual(cached_user.username, 'Test user')
+        self.assertEqual(token_cache.stats()['hits'], 1)
+        self.assertEqual(token_cache.stats()['misses'], 1)
+
+    def test_invalidate_user(self) -> None:
+        SafeJWTAuthentication().authenticate(self.request)
+        token_cache.invalidate_user(self.user.id)
+        with self.assertNumQueries(1):
+            SafeJWTAuthentication().authenticate(self.request)
+
+    def test_invalidate_user_reaches_other_workers(self) -> None:
+        logger.debug("Testing invalidation is published to the local caches of other workers")
+        worker = VerifiedTokenCache(max_size=100, local_ttl=30, use_redis=False)
+        self.addCleanup(worker.clear)
+        worker.ensure_listener()
+        # при подписке поток очищает локальный кеш, поэтому запись кладется после нее
+        for _ in range(100):
+            if redis_obj.pubsub_numsub(VerifiedTokenCache.channel)[0][1]:
+                break
+            time.sleep(0.01)
+        SafeJWTAuthentication().authenticate(self.request)
+        worker.set(self.access_token, token_cache.get(self.access_token))
+        self.assertIsNotNone(worker.get(self.access_token))
+
+        token_cache.invalidate_user(self.user.id)
+        for _ in range(100):
+            if len(worker.local) == 0:
+                break
+            time.sleep(0.01)
+        self.assertIsNone(worker.local.get(token_digest(self.access_token)))
+
+    def test_account_among_several(self) -> None:
+        logger.debug("Testing a user with several accounts is always resolved to the same account")
+        first: Account = Account.objects.create(user=self.user)
+        Account.objects.create(user=self.user)
+        _, principal = SafeJWTAuthentication().authenticate(self.request)
+        self.assertEqual(principal.account.id, first.id)
+
+        logger.debug("Testing the admin account wins, as in IsAdminAccount without the cache")
+        admin: Account = Account.objects.create(user=self.user, is_admin=True)
+        for authenticate in (SafeJWTAuthentication().authenticate,
+                             async_to_sync(SafeJWTAuthentication().aauthenticate)):
+            token_cache.clear()
+            _, principal = authenticate(self.request)
+            self.assertEqual(principal.account.id, admin.id)
+            self.assertTrue(principal.account.is_admin)
+
+    def test_snapshot_save_keeps_password(self) -> None:
+        SafeJWTAuthentication().authenticate(self.request)
+        cached_user, _ = SafeJWTAuthentication().authenticate(self.request)
+        cached_user.username = 'New test name'
+        cached_user.save()
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.username, 'New test name')
+        self.assertTrue(self.user.check_password('Nastya_1337'))
+
+
+class RevocationStoreTests(APITestCase):
+    def setUp(self) -> None:
+        revocation_store.clear()
+        self.user = User.objects.create_user(username='Test user')
+        self.refresh_token: str = generate_refresh_token(self.user)
+        self.client.force_authenticate(self.user)
+        self.client.cookies['refreshtoken'] = self.refresh_token
+        self.url = reverse('jwt_logout')
+
+    def test_logout_revokes_refresh_token(self) -> None:
+        logger.debug("Starting test logout revocation")
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(revocation_store.is_revoked(self.refresh_token))
+        self.assertEqual(BlackListedToken.objects.count(), 1)
+
+        logger.debug("Testing revoked token is rejected without querying the audit table")
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_rebuild_from_audit_log(self) -> None:
+        BlackListedToken.objects.create(token=self.refresh_token, user=self.user)
+        revocation_store.clear()
+        restored: int = revocation_store.rebuild(BlackListedToken.objects.values_list('token', flat=True))
+        self.assertEqual(restored, 1)
+        self.assertTrue(revocation_store.is_revoked(self.refresh_token))
+
+    def test_bloom_filter(self) -> None:
+        store = RevocationStore(prefix='test:revoked', use_bloom=True, bloom_capacity=1000)
+        store.clear()
+        store.revoke(self.refresh_token)
+        self.assertTrue(store.is_revoked(self.refresh_token))
+        store._rebuild_thread.join(5)
+        self.assertFalse(store.is_revoked(generate_refresh_token(User(id=self.user.id + 1))))
+
+        logger.debug("Testing revocations from another worker reach the bloom filter")
+        other_token: str = generate_refresh_token(User(id=self.user.id + 2))
+        RevocationStore(prefix='test:revoked', use_bloom=True, bloom_capacity=1000).revoke(other_token)
+        store.sync_interval = 0
+        self.assertTrue(store.is_revoked(other_token))
+        store.clear()
+
+    def test_bloom_filter_rebuilt_off_request_path(self) -> None:
+        store = RevocationStore(prefix='test:revoked', use_bloom=True, bloom_capacity=1000)
+        store.clear()
+        store.revoke(self.refresh_token)
+        other_token: str = generate_refresh_token(User(id=self.user.id + 1))
+        released = threading.Event()
+        load = store._load
+
+        def slow_load(*args) -> None:
+            released.wait(5)
+            load(*args)
+
+        logger.debug("Testing requests are answered from Redis while the filter is being built")
+        with patch.object(store, '_load', slow_load):
+            self.assertTrue(store.is_revoked(self.refresh_token))
+            self.assertTrue(async_to_sync(store.ais_revoked)(self.refresh_token))
+            self.assertFalse(store.is_revoked(other_token))
+            released.set()
+            store._rebuild_thread.join(5)
+
+        logger.debug("Testing the built filter answers without Redis")
+        with patch('users.revocation.redis_obj.exists') as exists:
+            self.assertFalse(store.is_revoked(other_token))
+        exists.assert_not_called()
+        self.assertTrue(store.is_revoked(self.refresh_token))
+
+        logger.debug("Testing a trimmed stream falls back to Redis until the filter is rebuilt")
+        store.sync_interval = 0
+        with patch.object(store, '_apply', return_value=False), patch.object(store, '_start_rebuild') as rebuild:
+            self.assertTrue(store.is_revoked(self.refresh_token))
+        rebuild.assert_called_once()
+        store.clear()
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class AuthPipelineQueryCountTests(APITestCase):
+    """Аутентификация один раз загружает пользователя с аккаунтом, права читают request.auth"""
+
+    def setUp(self) -> None:
+        token_cache.clear()
+        revocation_store.clear()
+        self.user = User.objects.create_user(username='Test user')
+        self.account = Account.objects.create(user=self.user, is_admin=True)
+        self.company = Company.objects.create(account=self.account, title='Google',
+                                              industry='it', role='менеджер', people=10)
+        self.profile = Profile.objects.create(account=self.account, company=self.company,
+                                              name='Test User', email='test@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {generate_access_token(self.user)}')
+        self.client.cookies['refreshtoken'] = generate_refresh_token(self.user)
+
+    def test_profile_mail_list(self) -> None:
+        # аутентификация с аккаунтом + список
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('profile_mail_list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        logger.debug("Testing cached principal skips the auth query")
+        with self.assertNumQueries(1):
+            self.client.get(reverse('profile_mail_list'))
+
+    def test_profile_mail_list_not_admin(self) -> None:
+        Account.objects.filter(id=self.account.id).update(is_admin=False)
+        response = self.client.get(reverse('profile_mail_list'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_profile(self) -> None:
+        # аутентификация + профиль вместе с компанией
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('profile', kwargs={'uuid': self.profile.uuid}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_refresh_token(self) -> None:
+        # аутентификация + пользователь из refresh токена
+        with self.assertNumQueries(2):
+            response = self.client.post(reverse('token_refresh'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_logout(self) -> None:
+        # аутентификация + запись в журнал отозванных токенов
+        with self.assertNumQueries(2):
+            response = self.client.post(reverse('jwt_logout'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@async_api_view(['POST'])
+@permission_classes([IsTokenValid, IsAdminAccount])
+async def async_protected_view(request) -> Response:
+    return Response(data={'is_principal': isinstance(request.auth, Principal)})
+
+
+class AsyncAuthenticationTests(APITestCase):
+    """Асинхронные представления проходят аутентификацию и проверку прав без sync_to_async"""
+
+    def setUp(self) -> None:
+        token_cache.clear()
+        revocation_store.clear()
+        self.user = User.objects.create_user(username='Test user')
+        self.account = Account.objects.create(user=self.user, is_admin=True)
+        self.refresh_token: str = generate_refresh_token(self.user)
+        self.access_token: str = generate_access_token(self.user)
+
+    def post(self):
+        request = APIRequestFactory().post('/', HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+        request.COOKIES['refreshtoken'] = self.refresh_token
+        return async_to_sync(async_protected_view)(request)
+
+    def test_async_view_allows_admin(self) -> None:
+        logger.debug("Starting test async auth pipeline")
+        response = self.post()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['is_principal'])
+
+        logger.debug("Testing cached token is checked without queries")
+        with self.assertNumQueries(0):
+            response = self.post()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_async_view_rejects_revoked_token(self) -> None:
+        revocation_store.revoke(self.refresh_token)
+        response = self.post()
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_async_view_rejects_not_admin(self) -> None:
+        Account.objects.filter(id=self.account.id).update(is_admin=False)
+        response = self.post()
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_async_view_rejects_anonymous(self) -> None:
+        request = APIRequestFactory().post('/')
+        response = async_to_sync(async_protected_view)(request)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class AsyncViewsTests(APITestCase):
+    """Эндпоинты входа, выхода и профиля работают как async представления с прежними ответами"""
+
+    def setUp(self) -> None:
+        token_cache.clear()
+        revocation_store.clear()
+        self.user = User.objects.create_user(username='Test user')
+        self.account = Account.objects.create(user=self.user, token='fe507723-e45d-403f-92dc-a203ad110c1b')
+
+    def login(self) -> None:
+        response = self.client.post(reverse('jwt_login'), {'username': 'Test user'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['account']['id'], self.account.id)
+        self.assertIn('csrftoken', response.cookies)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {response.data["access_token"]}')
+
+    def test_signin(self) -> None:
+        logger.debug("Starting test signin user")
+        services.redis_obj.set('Test user', 'Nastya_1337')
+        url: str = reverse('signin', kwargs={'email': 'test@example.com', 'token': self.account.token})
+        data: Dict = {"title": "Google", "industry": "it", "role": "менеджер", "people": 100,
+                      "links": {"vk": "https://vk.com"}, "password": "Nastya_1337"}
+
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('access_token', response.data)
+        self.assertIn('refreshtoken', response.cookies)
+        self.assertEqual(Company.objects.count(), 1)
+        self.assertEqual(Profile.objects.get().uuid.hex, self.account.token.replace('-', ''))
+
+    def test_signin_wrong_password(self) -> None:
+        services.redis_obj.set('Test user', 'Nastya_1337')
+        url: str = reverse('signin', kwargs={'email': 'test@example.com', 'token': self.account.token})
+        data: Dict = {"title": "Google", "industry": "it", "role": "менеджер", "people": 100,
+                      "links": {}, "password": "wrong"}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_login_unknown_user(self) -> None:
+        response = self.client.post(reverse('jwt_login'), {'username': 'Nobody'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_refresh_and_logout(self) -> None:
+        self.login()
+        response = self.client.post(reverse('token_refresh'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('access_token', response.data)
+
+        response = self.client.post(reverse('jwt_logout'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        logger.debug("Testing refresh with revoked token")
+        response = self.client.post(reverse('token_refresh'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_profile_patch_and_delete(self) -> None:
+        company = Company.objects.create(account=self.account, title='Google', industry='it',
+                                         role='менеджер', people=10)
+        profile = Profile.objects.create(account=self.account, company=company,
+                                         name='Test User', email='test@example.com')
+        url: str = reverse('profile', kwargs={'uuid': profile.uuid})
+        self.login()
+
+        response = self.client.patch(url, {'phone': '+79990000000'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['phone'], '+79990000000')
+        self.assertEqual(response.data['company']['title'], 'Google')
+
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(User.objects.exists())
+
+
+class HashingExecutorTests(APITestCase):
+    def test_backpressure(self) -> None:
+        logger.debug("Starting test hashing queue limit")
+        executor = HashingExecutor(kind='thread', workers=1, max_pending=1)
+
+        async def hash_twice():
+            return await asyncio.gather(executor.make_password('Nastya_1337'),
+                                        executor.make_password('Nastya_1337'), return_exceptions=True)
+
+        hashed, rejected = async_to_sync(hash_twice)()
+        executor.shutdown()
+        self.assertTrue(hashed.startswith('pbkdf2_sha256$'))
+        self.assertIsInstance(rejected, HashingBusy)
+        self.assertGreaterEqual(rejected.wait, 1)
+        self.assertEqual(executor.stats()['rejected'], 1)
+        self.assertEqual(executor.stats()['queue_depth'], 0)
+
+    @patch('users.views.hashing_executor', HashingExecutor(kind='thread', workers=1, max_pending=0))
+    def test_registration_busy(self) -> None:
+        response = self.client.post(reverse('registration'),
+                                    {"username": "Yuri08", "email": "ukravzov@mail.ru"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(User.objects.exists())
+
+    def test_metrics(self) -> None:
+        user = User.objects.create_user(username='Test user')
+        Account.objects.create(user=user, is_admin=True)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {generate_access_token(user)}')
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('queue_depth', response.data['password_hashing'])
+
+
+class OutboxWorkerTests(APITestCase):
+    def setUp(self) -> None:
+        self.smtp: LocalSMTPServer = LocalSMTPServer().start()
+        self.addCleanup(self.smtp.stop)
+        self.addCleanup(smtp_pools.close_all)
+        self.addCleanup(mail_config_cache.clear)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile_mail: ProfileMail = ProfileMail.objects.create(
+                email_name_profile="local", email_act_profile=True,
+                email_host=self.smtp.host, email_port=self.smtp.port,
+                email_host_user="Yuri", email_host_password="Nastya_1337",
+                email_use_tls=False, email_timeout=5, email_from_email="crm@example.com")
+        self.worker = OutboxWorker(concurrency=4, max_attempts=2, backoff_base=60)
+
+    def enqueue(self) -> OutboxMail:
+        return enqueue_mail(MessageMail(subject="Сообщение для входа на сайт", body="<b>Привет</b>",
+                                        to=["ukravzov@mail.ru"]))
+
+    def test_deliver(self) -> None:
+        logger.debug("Starting test outbox delivery")
+        for _ in range(3):
+            self.enqueue()
+        self.assertEqual(async_to_sync(self.worker.run_once)(), 3)
+
+        self.assertEqual(len(self.smtp.messages), 3)
+        self.assertEqual(self.smtp.messages[0]['To'], "ukravzov@mail.ru")
+        self.assertEqual(self.smtp.messages[0]['From'], "crm@example.com")
+        self.assertEqual(OutboxMail.objects.filter(status='sent', sent_at__isnull=False).count(), 3)
+        self.assertEqual(async_to_sync(self.worker.run_once)(), 0)
+
+    def test_retry_then_dead_letter(self) -> None:
+        logger.debug("Starting test outbox retries")
+        record: OutboxMail = self.enqueue()
+        self.smtp.fail_next = 2
+
+        async_to_sync(self.worker.run_once)()
+        record.refresh_from_db()
+        self.assertEqual((record.status, record.attempts), ('pending', 1))
+        self.assertGreater(record.next_attempt_at, timezone.now())
+        self.assertIn('451', record.last_error)
+
+        logger.debug("Testing backoff hides the mail until next_attempt_at")
+        self.assertEqual(async_to_sync(self.worker.run_once)(), 0)
+
+        OutboxMail.objects.update(next_attempt_at=timezone.now())
+        async_to_sync(self.worker.run_once)()
+        record.refresh_from_db()
+        self.assertEqual((record.status, record.attempts), ('dead', 2))
+        self.assertEqual(self.smtp.messages, [])
+
+    def test_registration_rendered_at_send(self) -> None:
+        logger.debug("Testing the registration mail gets its password from Redis at send time")
+        response = self.client.post(reverse('registration'), {"username": "Yuri08", "email": "ukravzov@mail.ru"},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        async_to_sync(self.worker.run_once)()
+
+        self.assertEqual(len(self.smtp.messages), 1)
+        parts: List[str] = [part.get_payload(decode=True).decode() for part in self.smtp.messages[0].walk()
+                            if not part.is_multipart()]
+        self.assertTrue(all(services.redis_obj.get("Yuri08") in part for part in parts))
+        self.assertEqual(OutboxMail.objects.get().status, 'sent')
+
+    def test_registration_without_password_is_dead(self) -> None:
+        self.client.post(reverse('registration'), {"username": "Yuri08", "email": "ukravzov@mail.ru"}, format='json')
+        services.redis_obj.delete("Yuri08")
+        async_to_sync(self.worker.run_once)()
+
+        record: OutboxMail = OutboxMail.objects.get()
+        self.assertEqual(record.status, 'dead')
+        self.assertIn('MailSecretMissing', record.last_error)
+        self.assertEqual(self.smtp.messages, [])
+
+    def test_message_id_stable_across_retries(self) -> None:
+        record: OutboxMail = self.enqueue()
+        self.smtp.fail_next = 1
+        async_to_sync(self.worker.run_once)()
+        OutboxMail.objects.update(next_attempt_at=timezone.now())
+        async_to_sync(self.worker.run_once)()
+        self.assertEqual(self.smtp.messages[0]['Message-ID'], record.headers['Message-ID'])
+
+    @override_settings(MAIL_ASYNC_SMTP=False)
+    def test_connection_reused(self) -> None:
+        logger.debug("Starting test SMTP connection pool")
+        for _ in range(5):
+            self.enqueue()
+        async_to_sync(self.worker.run_once)()
+        self.enqueue()
+        async_to_sync(self.worker.run_once)()
+
+        self.assertEqual(len(self.smtp.messages), 6)
+        # не больше concurrency соединений на всю пачку, дальше они переиспользуются
+        self.assertLessEqual(self.smtp.connections, self.worker.concurrency)
+        self.assertGreater(smtp_pools.get(self.profile_mail).reused, 0)
+
+    @override_settings(MAIL_ASYNC_SMTP=False)
+    def test_pool_rebuilt_on_profile_change(self) -> None:
+        self.enqueue()
+        async_to_sync(self.worker.run_once)()
+        pool = smtp_pools.get(self.profile_mail)
+
+        self.profile_mail.email_host_user = "Nastya"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile_mail.save()
+        self.enqueue()
+        async_to_sync(self.worker.run_once)()
+
+        self.assertIsNot(smtp_pools.get(self.profile_mail), pool)
+        self.assertEqual(self.smtp.connections, 2)
+
+    @override_settings(MAIL_ASYNC_SMTP=False)
+    def test_dead_connection_replaced(self) -> None:
+        self.enqueue()
+        async_to_sync(self.worker.run_once)()
+        pool = smtp_pools.get(self.profile_mail)
+        pool.health_check_interval = 0
+
+        logger.debug("Testing idle connection dropped by the server is not handed out")
+        with pool.connection() as connection:
+            connection.connection.sock.shutdown(socket.SHUT_RDWR)
+        self.enqueue()
+        async_to_sync(self.worker.run_once)()
+
+        self.assertEqual(len(self.smtp.messages), 2)
+        self.assertEqual(OutboxMail.objects.filter(status='sent').count(), 2)
+        self.assertEqual(pool.opened, 2)
+
+
+class ProfileMailConfigCacheTests(APITestCase):
+    def setUp(self) -> None:
+        mail_config_cache.clear()
+        self.addCleanup(mail_config_cache.clear)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile_mail: ProfileMail = ProfileMail.objects.create(email_name_profile="test",
+                                                                        email_act_profile=True,
+                                                                        email_host="localhost",
+                                                                        email_host_password='Nastya_1337',
+                                                                        email_host_user="Yuri")
+
+    def test_lookup_without_queries(self) -> None:
+        logger.debug("Starting test profile mail cache")
+        self.assertEqual(mail_config_cache.get().id, self.profile_mail.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(mail_config_cache.get().email_host, "localhost")
+            self.assertEqual(mail_config_cache.get(self.profile_mail.id).email_host, "localhost")
+            self.assertEqual(async_to_sync(mail_config_cache.aget)().email_host, "localhost")
+
+        logger.debug("Testing another process is served from Redis")
+        mail_config_cache.local.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(mail_config_cache.get().email_host_user, "Yuri")
+        self.assertGreater(mail_config_cache.stats()['redis_hits'], 0)
+
+    def test_invalidated_on_save_and_delete(self) -> None:
+        mail_config_cache.get()
+        self.profile_mail.email_host = "smtp.example.com"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile_mail.save()
+        self.assertEqual(mail_config_cache.get().email_host, "smtp.example.com")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile_mail.delete()
+        with self.assertRaises(ProfileMail.DoesNotExist):
+            mail_config_cache.get()
+
+    def test_load_racing_a_save_is_not_cached(self) -> None:
+        logger.debug("Testing a config loaded before a concurrent save is not written back to the cache")
+        query = mail_config_cache.query
+
+        def query_then_save(profile_mail_id: Optional[uuid.UUID]) -> ProfileMail:
+            config: ProfileMail = query(profile_mail_id)
+            ProfileMail.objects.filter(id=self.profile_mail.id).update(email_host="smtp.example.com")
+            mail_config_cache.invalidate(self.profile_mail.id)
+            return config
+
+        with patch.object(mail_config_cache, 'query', query_then_save):
+            self.assertEqual(mail_config_cache.get().email_host, "localhost")
+        self.assertEqual(mail_config_cache.get().email_host, "smtp.example.com")
+        mail_config_cache.local.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(mail_config_cache.get().email_host, "smtp.example.com")
+
+    def test_broadcast_clears_local_cache(self) -> None:
+        logger.debug("Testing invalidation published by another process")
+        mail_config_cache.get()
+        services.redis_obj.publish(mail_config_cache.channel, str(self.profile_mail.id))
+        deadline: float = time.monotonic() + 2
+        while len(mail_config_cache.local) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(mail_config_cache.local), 0)
+
+
+class BulkMailTests(APITestCase):
+    def setUp(self) -> None:
+        self.smtp: LocalSMTPServer = LocalSMTPServer().start()
+        self.addCleanup(self.smtp.stop)
+        self.addCleanup(smtp_pools.close_all)
+        self.addCleanup(mail_config_cache.clear)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProfileMail.objects.create(email_name_profile="local", email_act_profile=True,
+                                       email_host=self.smtp.host, email_port=self.smtp.port,
+                                       email_use_tls=False, email_timeout=5, email_from_email="crm@example.com")
+
+    @staticmethod
+    def messages(count: int, **kwargs) -> List[MessageMail]:
+        return [MessageMail(subject="Уведомление", body=f"<b>{i}</b>", to=[f"user{i}@example.com"], **kwargs)
+                for i in range(count)]
+
+    def test_send_bulk(self) -> None:
+        logger.debug("Starting test bulk mail over shared connections")
+        results = async_to_sync(MailCenter.send_bulk)(self.messages(7), chunk_size=3, concurrency=1)
+
+        self.assertTrue(all(result.sent for result in results))
+        self.assertEqual([result.message.to for result in results], [[f"user{i}@example.com"] for i in range(7)])
+        self.assertEqual(len(self.smtp.messages), 7)
+        self.assertEqual(self.smtp.connections, 1)
+
+    def test_send_bulk_async_generator(self) -> None:
+        async def generate():
+            for message in self.messages(5):
+                yield message
+
+        results = async_to_sync(MailCenter.send_bulk)(generate(), chunk_size=2)
+        self.assertEqual(sum(result.sent for result in results), 5)
+
+    def test_per_message_results(self) -> None:
+        logger.debug("Testing failed messages do not stop the batch")
+        messages: List[MessageMail] = self.messages(4)
+        messages[2].profile_mail = uuid.uuid4()
+        self.smtp.fail_next = 1
+
+        results = async_to_sync(MailCenter.send_bulk)(messages)
+
+        self.assertEqual([result.sent for result in results], [False, True, False, True])
+        self.assertIn('451', results[0].error)
+        self.assertIn('DoesNotExist', results[2].error)
+        self.assertEqual(len(self.smtp.messages), 2)
+
+    def test_unreachable_host(self) -> None:
+        logger.debug("Testing a connection failure fails its chunk instead of the whole send")
+        with socket.socket() as closed:
+            closed.bind(('127.0.0.1', 0))
+            port: int = closed.getsockname()[1]
+        ProfileMail.objects.filter(email_act_profile=True).update(email_port=port, email_timeout=1)
+        for async_smtp in (True, False):
+            mail_config_cache.clear()
+            with self.subTest(async_smtp=async_smtp), override_settings(MAIL_ASYNC_SMTP=async_smtp):
+                results = async_to_sync(MailCenter.send_bulk)(self.messages(5), chunk_size=2)
+                self.assertEqual(len(results), 5)
+                self.assertFalse(any(result.sent for result in results))
+                self.assertTrue(all('ConnectionRefusedError' in result.error for result in results))
+
+    def test_rate_limit(self) -> None:
+        with patch('users.tasks.smtp_rate_limiter', HostRateLimiter(rate=100, burst=1)):
+            start: float = time.monotonic()
+            results = async_to_sync(MailCenter.send_bulk)(self.messages(21), chunk_size=5)
+            elapsed: float = time.monotonic() - start
+        self.assertTrue(all(result.sent for result in results))
+        self.assertGreaterEqual(elapsed, 0.18)
+
+    def test_token_bucket(self) -> None:
+        bucket = TokenBucket(rate=10, capacity=1)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1, delta=0.01)
+        self.assertAlmostEqual(bucket.reserve(5), 0.6, delta=0.01)
+
+
+class AsyncSMTPTransportTests(APITestCase):
+    def setUp(self) -> None:
+        self.smtp: LocalSMTPServer = LocalSMTPServer().start()
+        self.addCleanup(self.smtp.stop)
+        self.addCleanup(mail_config_cache.clear)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile_mail: ProfileMail = ProfileMail.objects.create(
+                email_name_profile="local", email_act_profile=True,
+                email_host=self.smtp.host, email_port=self.smtp.port,
+                email_host_user="Yuri", email_host_password="Nastya_1337",
+                email_use_tls=False, email_timeout=5, email_from_email="crm@example.com")
+
+    def test_send_on_event_loop(self) -> None:
+        logger.debug("Starting test async SMTP transport")
+
+        async def send_many():
+            messages = [MessageMail(subject="Уведомление", body=f"<b>{i}</b>", to=[f"user{i}@example.com"])
+                        for i in range(20)]
+            with patch('users.tasks.sync_to_async') as mock_sync_to_async:
+                await asyncio.gather(*(MailCenter(None, message).send_mail_simple() for message in messages))
+            stats = async_smtp_pools.stats()[str(self.profile_mail.id)]
+            await async_smtp_pools.close_all()
+            return mock_sync_to_async, stats
+
+        mock_sync_to_async, stats = async_to_sync(send_many)()
+
+        logger.debug("Testing no executor thread was used for sending")
+        mock_sync_to_async.assert_not_called()
+        self.assertEqual(len(self.smtp.messages), 20)
+        self.assertEqual(self.smtp.messages[3]['From'], "crm@example.com")
+        self.assertLessEqual(stats['opened'], async_smtp_pools.max_size)
+        self.assertEqual(stats['opened'] + stats['reused'], 20)
+
+    def test_pipelining_and_errors(self) -> None:
+        async def session():
+            connection = AsyncSMTPConnection(host=self.smtp.host, port=self.smtp.port,
+                                             username="Yuri", password="Nastya_1337", timeout=5)
+            await connection.connect()
+            extensions = dict(connection.extensions)
+            await connection.sendmail("crm@example.com", ["a@example.com", "b@example.com"],
+                                      b"Subject: test\r\n\r\n.leading dot\r\n")
+            self.smtp.fail_next = 1
+            with self.assertRaises(smtplib.SMTPDataError):
+                await connection.sendmail("crm@example.com", ["a@example.com"], b"Subject: fail\r\n\r\nbody")
+            # после отказа соединение остается рабочим
+            alive = await connection.noop()
+            await connection.close()
+            return extensions, alive
+
+        extensions, alive = async_to_sync(session)()
+        self.assertIn('pipelining', extensions)
+        self.assertTrue(alive)
+        self.assertEqual(len(self.smtp.messages), 1)
+        self.assertEqual(self.smtp.messages[0].get_payload().strip(), ".leading dot")
+
+    def test_outbox_worker_uses_async_transport(self) -> None:
+        enqueue_mail(MessageMail(subject="Сообщение для входа на сайт", body="<b>Привет</b>",
+                                 to=["ukravzov@mail.ru"]))
+        async_to_sync(OutboxWorker(concurrency=2).run_once)()
+        self.assertEqual(OutboxMail.objects.get().status, 'sent')
+        self.assertEqual(len(self.smtp.messages), 1)
+
+
+@override_settings(DOMAIN_NAME="https://crm.example.com")
+class MailTemplatesTests(APITestCase):
+    token: uuid.UUID = uuid.UUID('0f8fad5b-d9cb-469f-a165-70867728950e')
+
+    def test_registration_mail(self) -> None:
+        logger.debug("Starting test registration mail templates")
+        message: MessageMail = services.create_message("ukravzov@mail.ru", self.token, "Yuri08", "Nastya_1337")
+        path: str = reverse('signin', kwargs={'email': 'ukravzov@mail.ru', 'token': self.token})
+        link: str = f"https://crm.example.com{path}"
+
+        self.assertEqual(message.subject, "Сообщение для входа на сайт")
+        self.assertEqual(message.to, ["ukravzov@mail.ru"])
+        for body in (message.body, message.text_body):
+            self.assertIn(link, body)
+            self.assertIn("Nastya_1337", body)
+            self.assertIn(str(self.token), body)
+        self.assertIn(f'<a href="{link}">', message.body)
+        self.assertNotIn("<", message.text_body)
+
+    def test_html_escaped(self) -> None:
+        message: MessageMail = services.create_message("ukravzov@mail.ru", self.token, "<b>Yuri</b>", "a&b")
+        self.assertIn("&lt;b&gt;Yuri&lt;/b&gt;", message.body)
+        self.assertIn("a&amp;b", message.body)
+        self.assertIn("<b>Yuri</b>", message.text_body)
+
+    def test_email_alternatives(self) -> None:
+        message: MessageMail = services.create_message("ukravzov@mail.ru", self.token, "Yuri08", "Nastya_1337")
+        email = build_email(message, None)
+        self.assertEqual(email.body, message.text_body)
+        self.assertEqual(email.alternatives, [(message.body, 'text/html')])
+
+    def test_locale_variants(self) -> None:
+        english: MessageMail = services.create_message("ukravzov@mail.ru", self.token, "Yuri08", "pwd", locale="en-gb")
+        self.assertEqual(english.subject, "Your sign-in details")
+        unknown: MessageMail = services.create_message("ukravzov@mail.ru", self.token, "Yuri08", "pwd", locale="de")
+        self.assertEqual(unknown.subject, "Сообщение для входа на сайт")
+        self.assertIs(mail_templates.get('registration', 'de'), mail_templates.get('registration'))
+
+    def test_signin_link_matches_reverse(self) -> None:
+        for email in ("ukravzov@mail.ru", "yuri+crm@mail.ru", "юрий@почта.рф", "a b%c@mail.ru"):
+            path: str = reverse('signin', kwargs={'email': email, 'token': self.token})
+            self.assertEqual(signin_link(email, self.token), f"https://crm.example.com{path}")
+
+    def test_registration_sends_alternatives(self) -> None:
+        response = self.client.post(reverse('registration'), {"username": "Yuri08", "email": "ukravzov@mail.ru"},
+                                    format='json', HTTP_ACCEPT_LANGUAGE='en')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        outbox_mail: OutboxMail = OutboxMail.objects.get()
+        self.assertEqual(outbox_mail.subject, "Your sign-in details")
+        message: MessageMail = render_message(MessageMail.from_outbox(outbox_mail), {'password': 'pwd'})
+        self.assertIn("Thank you", message.text_body)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ProfileImageTests(APITestCase):
+    """Производные изображений профилей готовятся в фоне и только при замене изображения"""
+
+    def setUp(self) -> None:
+        self.processor = ImageProcessor(kind='sync', workers=1, max_pending=8)
+        patcher = patch('users.images.image_processor', self.processor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username='Test user')
+        self.account = Account.objects.create(user=self.user)
+        self.company = Company.objects.create(account=self.account, title='Google', industry='it',
+                                              role='менеджер', people=10)
+        # у каждого теста свое содержимое, иначе производные остались бы от предыдущего
+        self.color: tuple = tuple(uuid.uuid4().bytes[:3])
+        self.image_name: str = self.upload('avatar.png', (1024, 768))
+
+    def upload(self, name: str, size: tuple, mode: str = 'RGBA') -> str:
+        buffer = io.BytesIO()
+        # полупрозрачный цвет, чтобы WebP сохранил альфа-канал
+        Image.new(mode, size, self.color + (128,) if mode == 'RGBA' else self.color).save(buffer, format='PNG')
+        return default_storage.save(f'user_images/{name}', ContentFile(buffer.getvalue()))
+
+    def create_profile(self, **kwargs) -> Profile:
+        with self.captureOnCommitCallbacks(execute=True):
+            return Profile.objects.create(account=self.account, company=self.company, name='Test User',
+                                          email='test@example.com', **{'image': self.image_name, **kwargs})
+
+    def test_derivatives_after_commit(self) -> None:
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            profile: Profile = Profile.objects.create(account=self.account, company=self.company,
+                                                      name='Test User', email='test@example.com',
+                                                      image=self.image_name)
+        logger.debug("Before the job runs the original is served")
+        data: Dict = ProfileSerializer(profile).data
+        self.assertEqual(data['thumbnail'], data['image'])
+        self.assertEqual(data['srcset'], {})
+
+        for callback in callbacks:
+            callback()
+        profile.refresh_from_db()
+        self.assertEqual(len(profile.image_hash), 64)
+        for extension, size, name in derivative_names(profile.image_hash):
+            with Image.open(default_storage.path(name)) as derivative:
+                self.assertEqual(derivative.format, AVATAR_FORMATS[extension]['format'])
+                self.assertEqual(derivative.size, (size, size * 3 // 4))
+                self.assertEqual(derivative.mode, 'RGBA' if extension == 'webp' else 'RGB')
+        with Image.open(profile.image.path) as original:
+            self.assertEqual(original.size, (1024, 768))
+
+        data = ProfileSerializer(profile).data
+        self.assertEqual(data['thumbnail'], default_storage.url(derivative_name(profile.image_hash, 256, 'jpeg')))
+        self.assertEqual(data['srcset']['webp'].split(', ')[0],
+                         f"{default_storage.url(derivative_name(profile.image_hash, 32, 'webp'))} 32w")
+        self.assertEqual(len(data['srcset']['jpeg'].split(', ')), len(AVATAR_SIZES))
+
+        stats: Dict = self.processor.stats()
+        self.assertEqual((stats['processed'], stats['deduplicated'], stats['failed'], stats['queue_depth']),
+                         (1, 0, 0, 0))
+        self.assertGreater(stats['processing_p50_ms'], 0)
+
+    def test_identical_uploads_share_derivatives(self) -> None:
+        first: Profile = self.create_profile()
+        second: Profile = self.create_profile(image=self.upload('copy.png', (1024, 768)))
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertNotEqual(first.image.name, second.image.name)
+        self.assertEqual(first.image_hash, second.image_hash)
+        self.assertEqual(self.processor.deduplicated, 1)
+        directory: str = os.path.dirname(default_storage.path(derivative_name(first.image_hash, 32, 'jpeg')))
+        self.assertEqual(len(os.listdir(directory)), len(AVATAR_SIZES) * len(AVATAR_FORMATS))
+
+    def test_no_job_without_image_change(self) -> None:
+        profile: Profile = self.create_profile()
+        self.assertEqual(self.processor.processed, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = Profile.objects.get(uuid=profile.uuid)
+            profile.phone = '+79990000000'
+            profile.save()
+        self.assertEqual(self.processor.processed, 1)
+        self.assertTrue(Profile.objects.get(uuid=profile.uuid).image_hash)
+
+    def test_image_change_resets_derivatives(self) -> None:
+        profile: Profile = self.create_profile()
+        profile.image = self.upload('second.png', (600, 600), mode='RGB')
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            profile.save(update_fields=['image'])
+        self.assertEqual(Profile.objects.get(uuid=profile.uuid).image_hash, '')
+
+        logger.debug("A stale job for a replaced image does not touch the profile")
+        with self.captureOnCommitCallbacks(execute=True):
+            Profile.objects.filter(uuid=profile.uuid).update(image=self.upload('third.png', (300, 300)))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(Profile.objects.get(uuid=profile.uuid).image_hash, '')
+
+    def test_queue_overflow_is_dropped(self) -> None:
+        self.processor.max_pending = 0
+        profile: Profile = self.create_profile()
+        self.assertEqual(self.processor.stats()['dropped'], 1)
+        self.assertEqual(Profile.objects.get(uuid=profile.uuid).image_hash, '')
+
+    def test_draft_decoding(self) -> None:
+        buffer = io.BytesIO()
+        Image.new('RGB', (4000, 3000), self.color).save(buffer, format='JPEG')
+        logger.debug("A large JPEG is decoded at 1/4 scale, not at full size")
+        image = decode(io.BytesIO(buffer.getvalue()))
+        self.assertEqual(image.size, (1000, 750))
+
+        with override_settings(PROFILE_IMAGE_MAX_PIXELS=100_000):
+            with self.assertRaises(Image.DecompressionBombError):
+                decode(io.BytesIO(buffer.getvalue()))
+            profile: Profile = self.create_profile()
+        self.assertEqual(self.processor.failed, 1)
+        self.assertEqual(Profile.objects.get(uuid=profile.uuid).image_hash, '')
+
+    def image_upload(self, size: tuple) -> Dict:
+        buffer = io.BytesIO()
+        Image.new('RGB', size, self.color).save(buffer, format='PNG')
+        image = SimpleUploadedFile('upload.png', buffer.getvalue(), content_type='image/png')
+        # в тестах DRF настроен только JSON рендерер, multipart тело собирается вручную
+        return {'data': encode_multipart(BOUNDARY, {'image': image}), 'content_type': MULTIPART_CONTENT}
+
+    def test_upload_guards(self) -> None:
+        profile: Profile = self.create_profile()
+        url: str = reverse('profile', kwargs={'uuid': profile.uuid})
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {generate_access_token(self.user)}')
+        uploads: str = os.path.join(TEST_MEDIA_ROOT, 'user_images')
+        files_before: set = set(os.listdir(uploads))
+
+        with override_settings(PROFILE_IMAGE_MAX_UPLOAD_SIZE=1024):
+            response = self.client.patch(url, **self.image_upload((512, 512)))
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        with override_settings(PROFILE_IMAGE_MAX_PIXELS=100 * 100):
+            response = self.client.patch(url, **self.image_upload((200, 200)))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(os.listdir(uploads)), files_before)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(url, **self.image_upload((512, 512)))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile.refresh_from_db()
+        self.assertTrue(profile.image.name.startswith('user_images/upload'))
+        self.assertEqual(len(profile.image_hash), 64)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ProfileMediaTests(APITestCase):
+    """Отдача изображений профилей: ETag по содержимому, условные запросы, Range и X-Accel-Redirect"""
+
+    def setUp(self) -> None:
+        self.content: bytes = uuid.uuid4().bytes * 64
+        self.image_hash: str = hashlib.sha256(self.content).hexdigest()
+        self.derivative: str = derivative_name(self.image_hash, 32, 'jpeg')
+        default_storage.save(self.derivative, ContentFile(self.content))
+        self.original: str = default_storage.save('user_images/original.png', ContentFile(self.content))
+
+    @staticmethod
+    def url(name: str) -> str:
+        return reverse('media', kwargs={'name': name}) + signed_query(name)
+
+    async def get(self, name: str, url: Optional[str] = None, **headers):
+        response = await self.async_client.get(url or self.url(name), headers=headers)
+        body: bytes = b''.join([chunk async for chunk in response.streaming_content]) \
+            if response.streaming else response.content
+        return response, body
+
+    async def test_derivative(self) -> None:
+        response, body = await self.get(self.derivative)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(body, self.content)
+        self.assertEqual(response['ETag'], f'"{self.image_hash}-32.jpeg"')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+
+        logger.debug("Conditional requests")
+        response, body = await self.get(self.derivative, if_none_match=f'W/"x", {response["ETag"]}')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(body, b'')
+        response, _ = await self.get(self.derivative, if_modified_since=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    async def test_original_etag_is_content_hash(self) -> None:
+        response, body = await self.get(self.original)
+        self.assertEqual(body, self.content)
+        self.assertEqual(response['ETag'], f'"{self.image_hash}"')
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+    async def test_ranges(self) -> None:
+        size: int = len(self.content)
+        response, body = await self.get(self.derivative, range='bytes=10-19')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(body, self.content[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{size}')
+
+        response, body = await self.get(self.derivative, range='bytes=-5')
+        self.assertEqual(body, self.content[-5:])
+        response, body = await self.get(self.derivative, range=f'bytes={size - 3}-')
+        self.assertEqual(body, self.content[-3:])
+
+        response, _ = await self.get(self.derivative, range=f'bytes={size}-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], f'bytes */{size}')
+
+        logger.debug("Several ranges or a stale If-Range return the whole file")
+        response, body = await self.get(self.derivative, range='bytes=0-1,5-6')
+        self.assertEqual((response.status_code, body), (status.HTTP_200_OK, self.content))
+        response, body = await self.get(self.derivative, range='bytes=0-1', if_range='"stale"')
+        self.assertEqual((response.status_code, body), (status.HTTP_200_OK, self.content))
+
+    async def test_urls_from_api_without_credentials(self) -> None:
+        logger.debug("Image URLs from the API load without Authorization, as <img> requests them")
+        data: Dict = ProfileSerializer(Profile(image=self.original, image_hash=self.image_hash)).data
+        self.assertEqual(data['image'], FastProfileSerializer.to_representation(
+            Profile(image=self.original, image_hash=self.image_hash))['image'])
+        response, body = await self.get(self.original, url=data['image'])
+        self.assertEqual((response.status_code, body), (status.HTTP_200_OK, self.content))
+
+        logger.debug("Originals are not served without a valid signature")
+        for url in (reverse('media', kwargs={'name': self.original}), data['image'] + 'x',
+                    reverse('media', kwargs={'name': 'user_images/other.png'}) + signed_query(self.original)):
+            response, _ = await self.get(self.original, url=url)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, url)
+
+        default_image: str = default_storage.save('default/test.jpg', ContentFile(self.content))
+        response, _ = await self.get(default_image, url=reverse('media', kwargs={'name': default_image}))
+        self.assertEqual((response.status_code, response['Cache-Control']), (status.HTTP_200_OK, 'public, no-cache'))
+
+    async def test_only_profile_images(self) -> None:
+        default_storage.save('certs/key.pem', ContentFile(b'secret'))
+        for name in ('certs/key.pem', 'user_images/../certs/key.pem', 'user_images/missing.png', 'user_images'):
+            response, _ = await self.get(name)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, name)
+
+    @override_settings(MEDIA_SENDFILE='x-accel')
+    async def test_x_accel_redirect(self) -> None:
+        response, body = await self.get(self.derivative, accept='image/webp')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(body, b'')
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.derivative}')
+        self.assertEqual(response['ETag'], f'"{self.image_hash}-32.jpeg"')
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ProfileCacheTests(APITestCase):
+    """Read-through кеш JSON профилей: версии вместо удаления, single-flight для холодных ключей"""
+
+    def setUp(self) -> None:
+        token_cache.clear()
+        profile_cache.clear()
+        self.user = User.objects.create_user(username='Test user')
+        self.account = Account.objects.create(user=self.user)
+        self.company = Company.objects.create(account=self.account, title='Google', industry='it',
+                                              role='менеджер', people=10)
+        self.profile = Profile.objects.create(account=self.account, company=self.company,
+                                              name='Test User', email='test@example.com')
+        self.url: str = reverse('profile', kwargs={'uuid': self.profile.uuid})
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {generate_access_token(self.user)}')
+
+    def get_profile(self) -> Dict:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.profile_queries: int = sum('users_profile' in query['sql'] for query in queries.captured_queries)
+        return response.json()
+
+    def test_hit_skips_database(self) -> None:
+        first: Dict = self.get_profile()
+        self.assertEqual(self.profile_queries, 1)
+        self.assertEqual(self.get_profile(), first)
+        self.assertEqual(self.profile_queries, 0)
+        self.assertEqual(first['company']['title'], 'Google')
+        self.assertEqual(profile_cache.stats(), {'hits': 1, 'misses': 1, 'waits': 0})
+
+    def test_profile_and_company_changes(self) -> None:
+        self.get_profile()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.url, {'phone': '+79990000000'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_profile()['phone'], '+79990000000')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.company.title = 'Yandex'
+            self.company.save()
+        self.assertEqual(self.get_profile()['company']['title'], 'Yandex')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.company.delete()
+        self.assertIsNone(self.get_profile()['company'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        # удаление пользователя сбрасывает и его токены в кеше
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_single_flight(self) -> None:
+        cache = ProfileCache(ttl=60, lock_timeout=1, poll_interval=0.005)
+        profile_uuid: uuid.UUID = uuid.uuid4()
+        loads: List[int] = []
+
+        async def load() -> str:
+            loads.append(1)
+            await asyncio.sleep(0.05)
+            return '{"name": "cold"}'
+
+        results = await asyncio.gather(*[cache.aget(profile_uuid, load) for _ in range(10)])
+        self.assertEqual(set(results), {'{"name": "cold"}'})
+        self.assertEqual(len(loads), 1)
+        self.assertEqual((cache.misses, cache.waits), (1, 9))
+
+        logger.debug("A failed load releases the waiters right away")
+        missing_uuid: uuid.UUID = uuid.uuid4()
+
+        async def missing() -> str:
+            await asyncio.sleep(0.05)
+            raise Profile.DoesNotExist()
+
+        start: float = time.monotonic()
+        results = await asyncio.gather(*[cache.aget(missing_uuid, missing) for _ in range(3)],
+                                       return_exceptions=True)
+        self.assertTrue(all(isinstance(result, Profile.DoesNotExist) for result in results))
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    async def test_load_racing_a_write_is_not_served(self) -> None:
+        cache = ProfileCache(ttl=60, lock_timeout=1)
+        profile_uuid: uuid.UUID = uuid.uuid4()
+
+        async def stale_load() -> str:
+            # профиль изменили, пока шла загрузка
+            await sync_to_async(cache.invalidate)([profile_uuid])
+            return '{"version": "stale"}'
+
+        self.assertEqual(await cache.aget(profile_uuid, stale_load), '{"version": "stale"}')
+
+        async def fresh_load() -> str:
+            return '{"version": "fresh"}'
+
+        self.assertEqual(await cache.aget(profile_uuid, fresh_load), '{"version": "fresh"}')
+        self.assertEqual(await cache.aget(profile_uuid, stale_load), '{"version": "fresh"}')
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ProfileConditionalRequestTests(APITestCase):
+    """ETag и Last-Modified профиля: 304 без сериализации и If-Match для PATCH"""
+
+    def setUp(self) -> None:
+        token_cache.clear()
+        profile_cache.clear()
+        self.user = User.objects.create_user(username='Test user')
+        self.account = Account.objects.create(user=self.user)
+        self.company = Company.objects.create(account=self.account, title='Google', industry='it',
+                                              role='менеджер', people=10)
+        self.profile = Profile.objects.create(account=self.account, company=self.company,
+                                              name='Test User', email='test@example.com')
+        self.url: str = reverse('profile', kwargs={'uuid': self.profile.uuid})
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {generate_access_token(self.user)}')
+
+    def test_not_modified(self) -> None:
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag: str = response['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        profile_queries: List[str] = [q['sql'] for q in queries.captured_queries if 'users_profile' in q['sql']]
+        self.assertEqual(len(profile_queries), 1)
+        self.assertNotIn('users_account', profile_queries[0])
+        self.assertEqual(profile_cache.stats()['hits'], 0)
+
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        logger.debug("A company change produces a new version")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.company.title = 'Yandex'
+            self.company.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['company']['title'], 'Yandex')
+
+    def test_patch_if_match(self) -> None:
+        etag: str = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.url, {'phone': '+79990000000'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get(self.url)['ETag'], response['ETag'])
+
+        logger.debug("A client holding the old version gets 412")
+        response = self.client.patch(self.url, {'phone': '+79991111111'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(Profile.objects.get(uuid=self.profile.uuid).phone, '+79990000000')
+
+
+class ProfileBatchTests(APITestCase):
+    """Несколько профилей одним запросом: один запрос к бд на промахи, кеш общий с ProfileAccount"""
+
+    def setUp(self) -> None:
+        token_cache.clear()
+        profile_cache.clear()
+        self.profiles: List[Profile] = []
+        for number in range(3):
+            user = User.objects.create_user(username=f'Test user {number}')
+            account = Account.objects.create(user=user)
+            company = Company.objects.create(account=account, title=f'Company {number}', industry='it',
+                                             role='менеджер', people=10)
+            self.profiles.append(Profile.objects.create(account=account, company=company,
+                                                        name=f'Test User {number}', email=f'test{number}@example.com'))
+        self.url: str = reverse('profile_batch')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {generate_access_token(user)}')
+
+    def get_batch(self, uuids: List) -> Dict:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {'uuids': [str(u) for u in uuids]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.profile_queries: int = sum('users_profile' in query['sql'] for query in queries.captured_queries)
+        return response.json()
+
+    def test_anonymous(self) -> None:
+        self.client.credentials()
+        response = self.client.post(self.url, {'uuids': [str(self.profiles[0].uuid)]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_partial_result_and_cache(self) -> None:
+        first, second, third = (profile.uuid for profile in self.profiles)
+        unknown: uuid.UUID = uuid.uuid4()
+        # третий профиль уже в кеше после обычного GET
+        self.assertEqual(self.client.get(reverse('profile', kwargs={'uuid': third})).status_code,
+                         status.HTTP_200_OK)
+
+        result: Dict = self.get_batch([second, unknown, first, second, third])
+        self.assertEqual(self.profile_queries, 1)
+        self.assertEqual([profile['uuid'] for profile in result['profiles']], [str(second), str(first), str(third)])
+        self.assertEqual(result['missing'], [str(unknown)])
+        self.assertEqual(result['profiles'][1]['company']['title'], 'Company 0')
+        self.assertEqual(profile_cache.stats(), {'hits': 1, 'misses': 4, 'waits': 0})
+
+        logger.debug("The second batch is served from the cache, changes are visible")
+        self.assertEqual(self.get_batch([second, first, third])['profiles'], result['profiles'])
+        self.assertEqual(self.profile_queries, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            company: Company = self.profiles[0].company
+            company.title = 'Yandex'
+            company.save()
+        result = self.get_batch([first, second])
+        self.assertEqual(self.profile_queries, 1)
+        self.assertEqual(result['profiles'][0]['company']['title'], 'Yandex')
+        self.assertEqual(self.client.get(reverse('profile', kwargs={'uuid': first})).json(), result['profiles'][0])
+
+    def test_validation(self) -> None:
+        for data in ({}, {'uuids': []}, {'uuids': ['not-a-uuid']},
+                     {'uuids': [str(uuid.uuid4()) for _ in range(settings.PROFILE_BATCH_MAX_SIZE + 1)]}):
+            response = self.client.post(self.url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, data)
+
+
+class ORJSONRendererTests(APITestCase):
+    """Рендер и разбор JSON через orjson совместимы с JSONRenderer и JSONParser DRF"""
+
+    def test_render(self) -> None:
+        value_uuid: uuid.UUID = uuid.uuid4()
+        created = timezone.now().replace(microsecond=0)
+        data: Dict = {'uuid': value_uuid, 'created': created, 'price': Decimal('1.50'), 'label': gettext_lazy('Имя'),
+                      'nested': {1: [None, True, 'строка\u2028']}}
+        rendered: bytes = ORJSONRenderer().render(data)
+        self.assertIn(b'\\u2028', rendered)
+        self.assertEqual(json.loads(rendered), json.loads(JSONRenderer().render(data)))
+        self.assertIn(b'\n  "uuid"', ORJSONRenderer().render(data, 'application/json; indent=4'))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+        logger.debug("Profile payloads are identical to the stdlib renderer output")
+        user = User.objects.create_user(username='Test user')
+        account = Account.objects.create(user=user)
+        company = Company.objects.create(account=account, title='Google', industry='it', role='менеджер', people=10,
+                                         links={'site': 'https://example.com', 'tags': ['a', 'б']})
+        profile = Profile.objects.create(account=account, company=company, name='Test User', email='test@example.com')
+        payload: Dict = ProfileSerializer(profile).data
+        self.assertEqual(ORJSONRenderer().render(payload), JSONRenderer().render(payload))
+
+    def test_parse(self) -> None:
+        parser = ORJSONParser()
+        self.assertEqual(parser.parse(io.BytesIO('{"name": "Имя"}'.encode())), {'name': 'Имя'})
+        self.assertEqual(parser.parse(io.BytesIO('{"name": "Имя"}'.encode('cp1251')),
+                                      parser_context={'encoding': 'cp1251'}), {'name': 'Имя'})
+        for body in (b'{"name": ', b'{"value": NaN}'):
+            with self.assertRaises(ParseError):
+                parser.parse(io.BytesIO(body))
+
+        user = User.objects.create_user(username='Test user')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {generate_access_token(user)}')
+        response = self.client.post(reverse('profile_batch'), data=b'{"uuids": [', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class FastSerializerTests(APITestCase):
+    """Read-only сериализация без построения полей DRF: вывод байт в байт как у сериализаторов"""
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='Test user')
+        self.account = Account.objects.create(user=self.user, is_admin=True)
+        company = Company.objects.create(account=self.account, title='Google', industry='it', role='менеджер',
+                                         people=10, links={'site': 'https://example.com', 'tags': ['a', 'б']})
+        Profile.objects.create(account=self.account, company=company, name='С компанией', email='a@example.com',
+                               phone='+79990000000')
+        Profile.objects.create(account=self.account, name='Без компании', email='b@example.com')
+        with_hash = Profile.objects.create(account=self.account, name='С производными', email='c@example.com')
+        Profile.objects.filter(uuid=with_hash.uuid).update(image_hash='ab' * 32, image='user_images/photo.png')
+
+    def test_equivalence(self) -> None:
+        request = APIRequestFactory().get('/')
+        profiles: List[Profile] = list(Profile.objects.select_related('company').order_by('email'))
+        rows: List[Dict] = list(Profile.objects.order_by('email').values(*FastProfileSerializer.values_fields()))
+        self.assertEqual(len(profiles), 3)
+        for context in ({}, {'request': request}):
+            expected: List[bytes] = [JSONRenderer().render(ProfileSerializer(profile, context=context).data)
+                                     for profile in profiles]
+            fast_request = context.get('request')
+            self.assertEqual([JSONRenderer().render(data)
+                              for data in FastProfileSerializer.many(profiles, fast_request)], expected)
+            self.assertEqual([JSONRenderer().render(data)
+                              for data in FastProfileSerializer.many_rows(rows, fast_request)], expected)
+        with timezone.override('Europe/Moscow'):
+            self.assertEqual(FastProfileSerializer.to_representation(profiles[0]),
+                             ProfileSerializer(profiles[0]).data)
+            self.assertTrue(FastProfileSerializer.to_representation(profiles[0])['created'].endswith('+03:00'))
+        self.assertIsNone(FastProfileSerializer.from_row(rows[1])['company'])
+        self.assertTrue(FastProfileSerializer.from_row(rows[2])['srcset'])
+
+        self.assertEqual(ORJSONRenderer().render(FastAccountSerializer.to_representation(self.account)),
+                         ORJSONRenderer().render(AccountSerializer(self.account).data))
+        row: Dict = Account.objects.values(*FastAccountSerializer.values_fields()).get(id=self.account.id)
+        self.assertEqual(FastAccountSerializer.from_row(row), AccountSerializer(self.account).data)
+
+
+class AdminListTests(APITestCase):
+    """Admin списки: keyset пагинация без OFFSET и COUNT, фильтры из параметров запроса"""
+
+    def setUp(self) -> None:
+        token_cache.clear()
+        self.user = User.objects.create_user(username='Admin')
+        self.account = Account.objects.create(user=self.user, is_admin=True)
+        for number in range(7):
+            user = User.objects.create_user(username=f'Test user {number}')
+            account = Account.objects.create(user=user, is_admin=number % 3 == 0)
+            company = Company.objects.create(account=account, title=f'Company {number}',
+                                             industry='it' if number % 2 else 'туризм', role='менеджер', people=10)
+            Profile.objects.create(account=account, company=company, name=f'Test User {number}',
+                                   email=f'test{number}@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {generate_access_token(self.user)}')
+
+    def walk(self, url: str, **params) -> List[Dict]:
+        """Все страницы списка по ссылкам next"""
+        results: List[Dict] = []
+        response = self.client.get(url, {'page_size': 3, **params})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            results.extend(response.data['results'])
+            if response.data['next'] is None:
+                return results
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(response.data['next'])
+            page_query: str = queries.captured_queries[-1]['sql']
+            self.assertIn('LIMIT', page_query)
+            self.assertNotIn('OFFSET', page_query)
+
+    def test_pages(self) -> None:
+        accounts: List[Dict] = self.walk(reverse('admin_accounts'))
+        self.assertEqual([account['id'] for account in accounts],
+                         list(Account.objects.order_by('-id').values_list('id', flat=True)))
+        self.assertEqual(accounts[-1]['username'], 'Admin')
+
+        profiles: List[Dict] = self.walk(reverse('admin_profiles'))
+        self.assertEqual(len(profiles), 7)
+        self.assertEqual(profiles[0]['name'], 'Test User 6')
+        self.assertNotIn('image', profiles[0])
+
+        companies: List[Dict] = self.walk(reverse('admin_companies'))
+        self.assertEqual(len(companies), 7)
+        self.assertNotIn('links', companies[0])
+
+        logger.debug("Mail profiles are paged by id, not by the editable and non unique name")
+        ProfileMail.objects.bulk_create([ProfileMail(email_name_profile='same', email_host='localhost')
+                                         for _ in range(5)])
+        mail_profiles: List[Dict] = self.walk(reverse('profile_mail_list'))
+        self.assertEqual([profile['id'] for profile in mail_profiles],
+                         [str(pk) for pk in ProfileMail.objects.order_by('-id').values_list('id', flat=True)])
+
+    def test_filters(self) -> None:
+        self.assertEqual(len(self.walk(reverse('admin_accounts'), is_admin='true')), 4)
+        self.assertEqual(len(self.walk(reverse('admin_companies'), industry='it', is_admin='false')), 2)
+        self.assertEqual(len(self.walk(reverse('admin_profiles'), role='менеджер', industry='туризм')), 4)
+
+        middle: Profile = Profile.objects.order_by('created')[3]
+        newer: List[Dict] = self.walk(reverse('admin_profiles'), created_after=middle.created.isoformat())
+        self.assertEqual([profile['name'] for profile in newer], [f'Test User {n}' for n in (6, 5, 4, 3)])
+        older: List[Dict] = self.walk(reverse('admin_profiles'), created_before=middle.created.isoformat())
+        self.assertEqual(len(older), 3)
+        self.assertEqual(len(self.walk(reverse('admin_profiles'), created_after='2000-01-01')), 7)
+
+        logger.debug("Invalid filter values are rejected instead of being ignored")
+        for params in ({'is_admin': 'maybe'}, {'industry': 'космос'}, {'created_after': 'вчера'}):
+            url: str = reverse('admin_profiles')
+            self.assertEqual(self.client.get(url, params).status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_demoted_through_orm(self) -> None:
+        logger.debug("Testing changes made outside the API reset the cached admin check")
+        self.assertEqual(self.client.get(reverse('admin_accounts')).status_code, status.HTTP_200_OK)
+        self.account.is_admin = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.account.save()
+        self.assertEqual(self.client.get(reverse('admin_accounts')).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.account.is_admin = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.account.save()
+        self.assertEqual(self.client.get(reverse('admin_accounts')).status_code, status.HTTP_200_OK)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertEqual(self.client.get(reverse('admin_accounts')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_not_admin(self) -> None:
+        Account.objects.filter(id=self.account.id).update(is_admin=False)
+        token_cache.clear()
+        for name in ('admin_accounts', 'admin_companies', 'admin_profiles', 'profile_mail_list'):
+            self.assertEqual(self.client.get(reverse(name)).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ProfileSearchTests(APITestCase):
+    """Admin поиск профилей: префикс выше вхождения, телефон, название компании, выдача без COUNT"""
+
+    def setUp(self) -> None:
+        token_cache.clear()
+        self.user = User.objects.create_user(username='Admin')
+        account = Account.objects.create(user=self.user, is_admin=True)
+        company = Company.objects.create(account=account, title='Petrovich Logistics', industry='it',
+                                         role='менеджер', people=10)
+        for name, email, phone in (('Alexander Petrov', 'alex@example.com', '+79991234567'),
+                                   ('Petr Ivanov', 'ivanov@example.com', None),
+                                   ('Maria Sidorova', 'petrova.m@example.com', '+79997654321'),
+                                   ('Ivan Smirnov', 'smirnov@example.com', None)):
+            Profile.objects.create(account=account, company=company if name.startswith('Ivan') else None,
+                                   name=name, email=email, phone=phone)
+        self.url: str = reverse('admin_profile_search')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {generate_access_token(self.user)}')
+
+    def search(self, query: str, **params) -> Dict:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'q': query, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+        return response.json()
+
+    def test_ranking(self) -> None:
+        names: List[str] = [profile['name'] for profile in self.search('petr')['results']]
+        # совпадения с начала имени или почты первыми, затем вхождения в имя и название компании
+        self.assertEqual(set(names[:2]), {'Petr Ivanov', 'Maria Sidorova'})
+        self.assertEqual(set(names), {'Petr Ivanov', 'Alexander Petrov', 'Maria Sidorova', 'Ivan Smirnov'})
+        self.assertEqual(self.search('Logistics')['results'][0]['company_title'], 'Petrovich Logistics')
+
+        logger.debug("Phone numbers are matched by digits")
+        results: List[Dict] = self.search('+7 999 123')['results']
+        self.assertEqual([profile['name'] for profile in results], ['Alexander Petrov'])
+        self.assertIsNone(results[0]['company_title'])
+
+    def test_pages_and_validation(self) -> None:
+        page: Dict = self.search('example', limit=3)
+        self.assertEqual(len(page['results']), 3)
+        self.assertIsNotNone(page['next'])
+        rest: Dict = self.client.get(page['next']).json()
+        self.assertEqual(len(rest['results']), 1)
+        self.assertIsNone(rest['next'])
+
+        logger.debug("Offsets deeper than the search limit are rejected instead of clamped")
+        with patch.object(SearchPagination, 'max_offset', 2):
+            self.assertEqual(len(self.search('example', limit=1, offset=2)['results']), 1)
+            self.assertEqual(self.client.get(self.url, {'q': 'example', 'offset': 3}).status_code,
+                             status.HTTP_400_BAD_REQUEST)
+
+        self.assertEqual(self.client.get(self.url, {'q': 'pe'}).status_code, status.HTTP_400_BAD_REQUEST)
+        Account.objects.filter(user=self.user).update(is_admin=False)
+        token_cache.clear()
+        self.assertEqual(self.client.get(self.url, {'q': 'petr'}).status_code, status.HTTP_403_FORBIDDEN)
+
+    @skipUnless(connection.vendor == 'postgresql', 'нечеткий поиск по триграммам есть только в Postgres')
+    def test_fuzzy(self) -> None:
+        self.assertEqual(self.search('Alexnder')['results'][0]['name'], 'Alexander Petrov')
+        self.assertEqual(self.search('smirnow')['results'][0]['name'], 'Ivan Smirnov')
+
+
+class LookupConstraintTests(APITestCase):
+    def test_token_per_row(self) -> None:
+        accounts: List[Account] = [Account.objects.create(user=User.objects.create_user(username=f'Token {number}'))
+                                   for number in range(3)]
+        self.assertEqual(len({account.token for account in accounts}), 3)
+        self.assertEqual(Account.objects.select_related('user').get(token=accounts[1].token).user.username,
+                         'Token 1')
+
+        logger.debug("Tokens are unique")
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Account.objects.create(user=accounts[0].user, token=accounts[2].token)
+
+    def test_single_active_mail_profile(self) -> None:
+        active: ProfileMail = ProfileMail.objects.create(email_name_profile='active', email_act_profile=True)
+        ProfileMail.objects.bulk_create([ProfileMail(email_name_profile=f'inactive {number}') for number in range(2)])
+        self.assertEqual(ProfileMail.objects.get(email_act_profile=True), active)
+
+        logger.debug("Second active mail profile is rejected")
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ProfileMail.objects.create(email_name_profile='second', email_act_profile=True)
+        ProfileMail.objects.filter(id=active.id).update(email_act_profile=False)
+        ProfileMail.objects.filter(email_name_profile='inactive 0').update(email_act_profile=True)
+        self.assertEqual(ProfileMail.objects.get(email_act_profile=True).email_name_profile, 'inactive 0')
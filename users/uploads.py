@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+from rest_framework import exceptions, status
+
+
+class UploadTooLarge(exceptions.APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Файл слишком большой'
+    default_code = 'upload_too_large'
+
+
+class MaxSizeUploadHandler(FileUploadHandler):
+    """
+    Первый в цепочке обработчиков загрузки: прерывает разбор запроса, как только файл превысил max_size.
+    Остаток тела не читается, а файл не доходит ни до временного файла, ни до MEDIA_ROOT
+    """
+
+    def __init__(self, request=None, max_size: int = 0):
+        super().__init__(request)
+        self.max_size = max_size
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # обычные поля формы ограничены DATA_UPLOAD_MAX_MEMORY_SIZE, все что сверх - файл
+        if content_length > self.max_size + (settings.DATA_UPLOAD_MAX_MEMORY_SIZE or 0):
+            raise UploadTooLarge()
+
+    def receive_data_chunk(self, raw_data: bytes, start: int) -> bytes:
+        if start + len(raw_data) > self.max_size:
+            raise UploadTooLarge()
+        return raw_data
+
+    def file_complete(self, file_size: int) -> None:
+        return None
@@ -1,10 +1,17 @@
 from django.urls import path
 
-from .views import (ProfileAccount, ProfileMailList, jwt_login_view,
-                    jwt_logout_view, refresh_token_view, registration, signin)
+from .views import (AccountList, CompanyList, ProfileAccount, ProfileBatch,
+                    ProfileList, ProfileMailList, ProfileSearch,
+                    ServiceMetrics, jwt_login_view, jwt_logout_view,
+                    refresh_token_view, registration, signin)
 
 urlpatterns = [
     path('user/profile_mail/', ProfileMailList.as_view(), name='profile_mail_list'),
+    path('user/admin/accounts/', AccountList.as_view(), name='admin_accounts'),
+    path('user/admin/companies/', CompanyList.as_view(), name='admin_companies'),
+    path('user/admin/profiles/', ProfileList.as_view(), name='admin_profiles'),
+    path('user/admin/profiles/search/', ProfileSearch.as_view(), name='admin_profile_search'),
+    path('user/metrics/', ServiceMetrics.as_view(), name='metrics'),
     path('user/registration/', registration, name='registration'),
     # это путь для аутентификации после регистрации
     path('user/signin/<str:email>/<uuid:token>/', signin, name='signin'),
@@ -14,5 +21,6 @@ urlpatterns = [
     path('user/login/token/refresh/', refresh_token_view, name='token_refresh'),
     path('user/logout/token/', jwt_logout_view, name='jwt_logout'),
 
+    path('user/profile/batch/', ProfileBatch.as_view(), name='profile_batch'),
     path('user/profile/<uuid:uuid>/', ProfileAccount.as_view(), name='profile')
 ]
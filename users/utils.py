@@ -7,11 +7,14 @@ from django.contrib.auth.models import User
 
 T = TypeVar('T')
 
+ACCESS_TOKEN_LIFETIME = datetime.timedelta(minutes=5)
+REFRESH_TOKEN_LIFETIME = datetime.timedelta(days=7)
+
 
 def generate_access_token(user: User):
     access_token_payload: Dict[str, T] = {
         'user_id': user.id,
-        'exp': datetime.datetime.utcnow() + datetime.timedelta(days=0, minutes=5),
+        'exp': datetime.datetime.utcnow() + ACCESS_TOKEN_LIFETIME,
         'iat': datetime.datetime.utcnow(),
     }
     access_token = jwt.encode(access_token_payload,
@@ -22,7 +25,7 @@ def generate_access_token(user: User):
 def generate_refresh_token(user: User):
     refresh_token_payload: Dict[str, T] = {
         'user_id': user.id,
-        'exp': datetime.datetime.utcnow() + datetime.timedelta(days=7),
+        'exp': datetime.datetime.utcnow() + REFRESH_TOKEN_LIFETIME,
         'iat': datetime.datetime.utcnow()
     }
 
@@ -1,40 +1,161 @@
-import asyncio
+import json
 import uuid
-from typing import Dict, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-import redis
-from adrf.decorators import api_view as async_api_view
 from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import login
 from django.contrib.auth.models import User
-from django.views.decorators.csrf import csrf_protect, ensure_csrf_cookie
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response
+from django.utils.functional import cached_property
+from django.utils.http import http_date
+from django.utils.translation import get_language_from_request
 from rest_framework import exceptions, generics, status
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny
+from rest_framework.decorators import permission_classes
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
-from .models import Account, BlackListedToken, Company, Profile, ProfileMail
+from .async_views import AsyncAPIView, async_api_view
+from .authentication import enforce_csrf
+from .cache import get_async_redis, token_cache
+from .fast_serializers import FastAccountSerializer, FastProfileSerializer
+from .filters import QueryParamsFilter, choice, parse_bool, parse_moment
+from .hashing import HashingBusy, hashing_executor
+from .images import image_processor
+from .media import SIGNATURE_PARAM, StoredFile, file_response, resolve
+from .models import (INDUSTRY, USER_ROLE, Account, BlackListedToken, Company,
+                     Profile, ProfileMail)
+from .pagination import AdminCursorPagination, SearchPagination
 from .permissions import IsAdminAccount, IsTokenValid
-from .serializers import (AccountSerializer, CompanySerializer,
-                          ProfileMailSerializer, ProfileSerializer,
+from .profile_cache import pack, profile_cache, profile_version, unpack
+from .renderers import ORJSONRenderer
+from .revocation import revocation_store
+from .search import search_profiles
+from .serializers import (AccountSerializer, AdminAccountSerializer,
+                          AdminCompanySerializer, AdminProfileSerializer,
+                          CompanySerializer, ProfileBatchSerializer,
+                          ProfileMailSerializer, ProfileSearchSerializer,
+                          ProfileSerializer, RegistrationSerializer,
                           UserSerializer)
-from .services import create_message, get_payload, get_user
-from .tasks import MailCenter, MessageMail
+from .services import (generate_password, get_payload, register_account,
+                       registration_message)
+from .tasks import MessageMail
+from .uploads import MaxSizeUploadHandler
 from .utils import generate_access_token, generate_refresh_token
 
-redis_obj = redis.StrictRedis(host=settings.REDIS_HOST,
-                              port=settings.REDIS_PORT,
-                              db=settings.REDIS_DB,
-                              decode_responses=True)
+
+class JSONBytesResponse(HttpResponse):
+    """Готовый JSON из кеша, без повторного рендера. data разбирается только по требованию (тесты)"""
+
+    def __init__(self, content, **kwargs):
+        super().__init__(content, content_type='application/json', **kwargs)
+
+    @cached_property
+    def data(self):
+        return json.loads(self.content)
+
+
+def profile_entry(profile: Profile) -> str:
+    """JSON профиля для кеша вместе с версией, компания и аккаунт уже должны быть загружены"""
+    etag, last_modified = profile_version(profile.updated, profile.company.updated if profile.company else None)
+    return pack(etag, last_modified, ORJSONRenderer().render(FastProfileSerializer.to_representation(profile)).decode())
 
 
 # API для admin пользователей
-class ProfileMailList(generics.ListAPIView):
+class AdminListView(generics.ListAPIView):
+    """
+    База admin списков: keyset пагинация по индексированному ordering, фильтры query_filters
+    и только нужные сериализатору колонки в queryset
+    """
+    permission_classes = [IsAdminAccount]
+    pagination_class = AdminCursorPagination
+    filter_backends = [QueryParamsFilter]
+    ordering: Tuple[str, ...] = ('-id',)
+    query_filters: Dict[str, Tuple[str, Callable[[str], Any]]] = {}
+
+
+class ProfileMailList(AdminListView):
     """Для просмотра всех конфигураций SMTP"""
     serializer_class = ProfileMailSerializer
-    permission_classes = [IsAdminAccount]
     queryset = ProfileMail.objects.all()
+    query_filters = {'active': ('email_act_profile', parse_bool)}
+
+
+class AccountList(AdminListView):
+    serializer_class = AdminAccountSerializer
+    queryset = Account.objects.select_related('user').only('id', 'is_admin', 'user__username')
+    query_filters = {'is_admin': ('is_admin', parse_bool)}
+
+
+class CompanyList(AdminListView):
+    serializer_class = AdminCompanySerializer
+    queryset = Company.objects.defer('links')
+    query_filters = {'industry': ('industry', choice(INDUSTRY)),
+                     'role': ('role', choice(USER_ROLE)),
+                     'is_admin': ('account__is_admin', parse_bool)}
+
+
+class ProfileList(AdminListView):
+    serializer_class = AdminProfileSerializer
+    queryset = Profile.objects.only('uuid', 'account_id', 'company_id', 'name', 'email', 'phone', 'created',
+                                    'updated')
+    # created не уникален: профили с одинаковым created (одна микросекунда) курсор листает через OFFSET
+    # в пределах этих строк, их единицы, поэтому ради сортировки по времени создания это допустимо
+    ordering = ('-created',)
+    query_filters = {'created_after': ('created__gte', parse_moment),
+                     'created_before': ('created__lt', parse_moment),
+                     'industry': ('company__industry', choice(INDUSTRY)),
+                     'role': ('company__role', choice(USER_ROLE)),
+                     'is_admin': ('account__is_admin', parse_bool)}
+
+
+class ProfileSearch(generics.ListAPIView):
+    """Admin поиск профилей по имени, почте, телефону и названию компании: ?q=..., от лучшего совпадения"""
+    serializer_class = ProfileSearchSerializer
+    permission_classes = [IsAdminAccount]
+    pagination_class = SearchPagination
+
+    def get_queryset(self):
+        query: str = self.request.query_params.get('q', '').strip()
+        if len(query) < settings.ADMIN_SEARCH_MIN_LENGTH:
+            raise exceptions.ValidationError({'q': f'Нужно не меньше {settings.ADMIN_SEARCH_MIN_LENGTH} символов'})
+        return search_profiles(query).select_related('company') \
+            .only('uuid', 'account_id', 'company', 'company__title', 'name', 'email', 'phone', 'created', 'updated')
+
+
+class ServiceMetrics(AsyncAPIView):
+    """Метрики текущего воркера: кеши, пул хеширования паролей и обработка изображений"""
+    permission_classes = [IsAdminAccount]
+
+    async def get(self, request, *args, **kwargs):
+        return Response(data={'jwt_cache': token_cache.stats(),
+                              'password_hashing': hashing_executor.stats(),
+                              'image_processing': image_processor.stats(),
+                              'profile_cache': profile_cache.stats()},
+                        status=status.HTTP_200_OK)
+
+
+class ProfileMedia(AsyncAPIView):
+    """
+    Изображения профилей из MEDIA_ROOT для <img> и srcset, поэтому без JWT: производные и изображения
+    по умолчанию публичны, оригиналы загрузок - по подписи из ссылки (users.media.resolve).
+    Передача файла - прокси или стрим
+    """
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+    def perform_content_negotiation(self, request, force=False):
+        # ответ - файл, а не рендер DRF, поэтому Accept: image/* не должен давать 406
+        return super().perform_content_negotiation(request, force=True)
+
+    async def get(self, request, name: str, *args, **kwargs):
+        # хеш оригинала считается в потоке, пока он не попал в кеш
+        stored: StoredFile = await sync_to_async(resolve, thread_sensitive=False)(
+            name, request.query_params.get(SIGNATURE_PARAM))
+        return file_response(request, stored)
 
 
 # API клиента
@@ -43,73 +164,72 @@ async def registration(request) -> Response:
     """
     Функция для регистрации пользователя через почту
     """
+    serialized = RegistrationSerializer(data=request.data)
+    await sync_to_async(serialized.is_valid)(raise_exception=True)
     try:
-        serialized = AccountSerializer(data=request.data)
-        username: str = serialized.initial_data['username']
-        email: str = serialized.initial_data['email']
-
-        if sync_to_async(serialized.is_valid)():
-            # если что от сюда убрано поле email при создании пользователя
-            await sync_to_async(User.objects.create_user)(username=username, email=email)
-            token = uuid.uuid4()
-            user: User = await get_user(username=username)
-
-            account: Account = await sync_to_async(Account.objects.create)(user=user, token=token)
-
-            message = create_message(email, token, username)
-            await sync_to_async(user.set_password)(redis_obj.get(f"{username}"))
-            await sync_to_async(user.save)()
-            mess: MessageMail = MessageMail(
-                subject="Сообщение для входа на сайт",
-                priority=1,
-                body=message,
-                to=[email])
-            mc: MailCenter = MailCenter(None, mess)
-            asyncio.ensure_future(mc.send_mail_simple())
-
-            json_account = AccountSerializer(account).data
-            json_user = UserSerializer(user).data
-
-            return Response(data={"account": json_account, "user": json_user},
-                            status=status.HTTP_201_CREATED)
+        username: str = serialized.validated_data['username']
+        email: str = serialized.validated_data['email']
+        token = uuid.uuid4()
+        password: str = generate_password(12)
+        hashed_password: str = await hashing_executor.make_password(password)
+
+        mess: MessageMail = registration_message(email, token, username,
+                                                 locale=get_language_from_request(request._request))
+
+        # пользователь, аккаунт, письмо в outbox и пароль в Redis создаются одной транзакцией
+        # за один переход в поток, письмо отправят воркеры почты (manage.py run_mail_workers)
+        user, account = await sync_to_async(register_account)(username, email, password, hashed_password,
+                                                              token, mess)
+
+        json_account = AccountSerializer(account).data
+        json_user = UserSerializer(user).data
+
+        return Response(data={"account": json_account, "user": json_user},
+                        status=status.HTTP_201_CREATED)
+    except HashingBusy:
+        raise
+    except IntegrityError:
+        return Response(data={"detail": f"Пользователь {request.data.get('username')} уже существует"},
+                        status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response(
             data={"detail": f"Что-то пошло не так в ходе регистрации пользователя. {e}"},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-@api_view(['POST', 'GET'])
-@ensure_csrf_cookie
-def signin(request, email: str, token: uuid) -> Response:
+@async_api_view(['POST', 'GET'])
+async def signin(request, email: str, token: uuid) -> Response:
     """
         Функция для аутентификации пользователя,
         после его переход по уникальной ссылке, со сгенерированным паролем.
         В функции создается ПРОФИЛЬ пользователя. Она отрабатывает только после регистрации
      """
+    # то же, что ensure_csrf_cookie: middleware выставит cookie csrftoken в ответе
+    get_token(request)
     if request.method == 'POST':
         try:
-            account: Account = Account.objects.get(token=token)
+            account: Account = await Account.objects.select_related('user').aget(token=token)
             request.data["account"] = account.id
             serialized = CompanySerializer(data=request.data)
             user = account.user
 
-            password: str = redis_obj.get(user.username)
+            password: str = await get_async_redis().get(user.username)
             if serialized.is_valid(raise_exception=True) and serialized.initial_data['password'] == password:
-                redis_obj.delete(user.username)
-                company: Company = Company.objects.create(account=account,
-                                                          title=serialized.initial_data['title'],
-                                                          industry=serialized.initial_data['industry'],
-                                                          role=serialized.initial_data['role'],
-                                                          people=serialized.initial_data['people'],
-                                                          links=serialized.initial_data['links'])
-                Profile.objects.create(account=account,
-                                       company=company,
-                                       uuid=token,
-                                       name=account.user.username,
-                                       email=email)
+                await get_async_redis().delete(user.username)
+                company: Company = await Company.objects.acreate(account=account,
+                                                                 title=serialized.initial_data['title'],
+                                                                 industry=serialized.initial_data['industry'],
+                                                                 role=serialized.initial_data['role'],
+                                                                 people=serialized.initial_data['people'],
+                                                                 links=serialized.initial_data['links'])
+                await Profile.objects.acreate(account=account,
+                                              company=company,
+                                              uuid=token,
+                                              name=account.user.username,
+                                              email=email)
 
                 # логинем самого пользователя в таблицу User
-                login(request=request, user=user)
+                await sync_to_async(login)(request=request, user=user)
 
                 # логинем аккаунт этого пользователя
                 access_token = generate_access_token(user)
@@ -133,24 +253,24 @@ def signin(request, email: str, token: uuid) -> Response:
                         status=status.HTTP_200_OK)
 
 
-@api_view(['POST'])
+@async_api_view(['POST'])
 @permission_classes([AllowAny])
-@ensure_csrf_cookie  # принудительной отправки Django CSRF cookie в ответе в случае успешного входа в систему
-def jwt_login_view(request) -> Response:
+async def jwt_login_view(request) -> Response:
     """
     Аутентификация по JWT, вход в аккаунт
     """
+    # принудительной отправки Django CSRF cookie в ответе в случае успешного входа в систему
+    get_token(request)
     username: str = request.data.get('username')
-    user = User.objects.get(username=username)
-    response = Response()
-
     if username is None:
         raise exceptions.AuthenticationFailed('username required')
+    user = await User.objects.filter(username=username).afirst()
     if user is None:
         raise exceptions.AuthenticationFailed('user not found')
+    response = Response()
 
-    account = Account.objects.get(user_id=user.id)
-    serialized_account: Dict[str] = AccountSerializer(account).data
+    account = await Account.objects.aget(user_id=user.id)
+    serialized_account: Dict[str] = FastAccountSerializer.to_representation(account)
 
     access_token = generate_access_token(user)
     refresh_token = generate_refresh_token(user)
@@ -165,67 +285,145 @@ def jwt_login_view(request) -> Response:
     return response
 
 
-@api_view(['POST'])
+@async_api_view(['POST'])
 @permission_classes([IsTokenValid])
-def jwt_logout_view(request):
+async def jwt_logout_view(request):
     refresh_token: Optional[str] = request.COOKIES.get('refreshtoken')
-    BlackListedToken.objects.create(token=refresh_token, user=request.user)
+    # таблица остается журналом аудита, проверки идут по списку отзыва в Redis
+    await BlackListedToken.objects.acreate(token=refresh_token, user=request.user)
+    await revocation_store.arevoke(refresh_token)
     return Response({"message": "Вы успешно вышли с аккаунта"}, status=status.HTTP_200_OK)
 
 
-@api_view(['POST'])
+@async_api_view(['POST'])
 @permission_classes([IsTokenValid])
-@csrf_protect
-def refresh_token_view(request):  # протестировать на стороне клиента
+async def refresh_token_view(request):  # протестировать на стороне клиента
     """
     Чтобы получить новый access_token, это представление ожидает 2 важных вещи:
     1. файл cookie, содержащий действительный refresh_token
     2. заголовок "ТОКЕН X-CSRF" с действительным токеном csrf,
      клиентское приложение может получить его из файлов cookie "csrftoken"
     """
+    csrf_error: Optional[exceptions.PermissionDenied] = enforce_csrf(request)
+    if csrf_error:
+        raise csrf_error
     payload = get_payload(request)
-    user = User.objects.get(id=payload['user_id'])
+    user = await User.objects.aget(id=payload['user_id'])
     access_token = generate_access_token(user)
     return Response(data={'access_token': access_token}, status=status.HTTP_200_OK)
 
 
-class ProfileAccount(generics.RetrieveUpdateDestroyAPIView):
+class ProfileAccount(AsyncAPIView, generics.GenericAPIView):
     """Класс профиля для каждого аккаунта пользователей"""
     serializer_class = ProfileSerializer
     permission_classes = (IsTokenValid,)
     queryset = Profile.objects.all()
 
-    def get_object(self):
-        try:
-            profile: Profile = Profile.objects.get(uuid=self.kwargs['uuid'])
-            return profile
-        except Exception:
-            raise Exception
+    def initialize_request(self, request, *args, **kwargs):
+        # размер загружаемого изображения проверяется по мере чтения тела, до записи файла
+        request.upload_handlers.insert(0, MaxSizeUploadHandler(request, settings.PROFILE_IMAGE_MAX_UPLOAD_SIZE))
+        return super().initialize_request(request, *args, **kwargs)
+
+    async def aget_object(self) -> Profile:
+        # компания нужна сериализатору, в асинхронном коде ее нельзя догрузить лениво
+        return await Profile.objects.select_related('company').aget(uuid=self.kwargs['uuid'])
+
+    async def render_profile(self) -> str:
+        """JSON профиля для кеша: один запрос вместе с компанией и аккаунтом"""
+        return profile_entry(await Profile.objects.select_related('company', 'account').aget(uuid=self.kwargs['uuid']))
+
+    @staticmethod
+    def with_version(response, etag: str, last_modified: int):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
 
-    def get(self, request, *args, **kwargs):
+    async def get(self, request, *args, **kwargs):
         """Получаем профиль для текущего аккаунта"""
         try:
-            profile: Profile = self.get_object()
-            serialized = ProfileSerializer(profile)
-            return Response(serialized.data, status=status.HTTP_200_OK)
+            if 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META:
+                # версия - дешевый запрос без сериализации, неизменившийся профиль получает 304
+                updated, company_updated = await Profile.objects.filter(uuid=self.kwargs['uuid']) \
+                    .values_list('updated', 'company__updated').aget()
+                etag, last_modified = profile_version(updated, company_updated)
+                not_modified = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+                if not_modified is not None:
+                    return self.with_version(not_modified, etag, last_modified)
+            etag, last_modified, content = unpack(await profile_cache.aget(self.kwargs['uuid'], self.render_profile))
+            return self.with_version(JSONBytesResponse(content, status=status.HTTP_200_OK), etag, last_modified)
         except Exception as e:
             return Response(data={'detail': f"Профиля с таким uuid не существует, {e}"},
                             status=status.HTTP_404_NOT_FOUND)
 
-    def delete(self, request, *args, **kwargs):
+    async def delete(self, request, *args, **kwargs):
         """Удаление профиля текущего пользователя"""
         user = self.request.user
-        user.delete()
+        user_id: int = user.id
+        await user.adelete()
+        await token_cache.ainvalidate_user(user_id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    def patch(self, request, *args, **kwargs):
+    async def put(self, request, *args, **kwargs):
+        """Полное обновление профиля, как в UpdateModelMixin"""
+        profile: Profile = await self.aget_object()
+        serialized = ProfileSerializer(profile, data=request.data, context=self.get_serializer_context())
+        await sync_to_async(serialized.is_valid)(raise_exception=True)
+        await sync_to_async(serialized.save)()
+        await token_cache.ainvalidate_user(self.request.user.id)
+        return Response(serialized.data, status=status.HTTP_200_OK)
+
+    async def patch(self, request, *args, **kwargs):
         """Обновление профиля текущего пользователя"""
-        profile: Profile = self.get_object()
-        serialized = ProfileSerializer(profile, data=request.data, partial=True)
-        if serialized.is_valid():
+        response = await sync_to_async(self.perform_patch)(request)
+        if response.status_code == status.HTTP_200_OK:
+            await token_cache.ainvalidate_user(self.request.user.id)
+        return response
+
+    def perform_patch(self, request):
+        """
+        Изменение под блокировкой строки профиля: If-Match (оптимистичная блокировка клиента)
+        сверяется именно с той версией, которая будет изменена
+        """
+        with transaction.atomic():
+            profile: Profile = Profile.objects.select_for_update(of=('self',)).select_related('company') \
+                .get(uuid=self.kwargs['uuid'])
+            etag, last_modified = profile_version(profile.updated, profile.company.updated if profile.company else None)
+            precondition_failed = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+            if precondition_failed is not None:
+                return self.with_version(precondition_failed, etag, last_modified)
+
+            serialized = ProfileSerializer(profile, data=request.data, partial=True)
+            if not serialized.is_valid():
+                return Response({"message": "Данные не соответствуют ожидаемому формату и требованиям."},
+                                status=status.HTTP_400_BAD_REQUEST)
             if request.data.get("name"):
                 self.request.user.username = request.data.get("name")
             serialized.save()
-            return Response(serialized.data, status=status.HTTP_200_OK)
-        return Response({"message": "Данные не соответствуют ожидаемому формату и требованиям."},
-                        status=status.HTTP_400_BAD_REQUEST)
+        etag, last_modified = profile_version(profile.updated, profile.company.updated if profile.company else None)
+        return self.with_version(Response(serialized.data, status=status.HTTP_200_OK), etag, last_modified)
+
+
+class ProfileBatch(AsyncAPIView):
+    """
+    Несколько профилей одним запросом (команда, список участников). Профили из кеша не читаются из бд,
+    остальные загружаются одним запросом. Несуществующие uuid не ошибка: они перечислены в missing.
+    Только для аутентифицированных: анонимно пачкой профилей с почтой и телефоном их дешево перебирать
+    """
+    permission_classes = (IsAuthenticated, IsTokenValid)
+
+    @staticmethod
+    async def load_profiles(profile_uuids: List[str]) -> Dict[str, str]:
+        profiles = Profile.objects.filter(uuid__in=profile_uuids).select_related('company', 'account')
+        return {str(profile.uuid): profile_entry(profile) async for profile in profiles}
+
+    async def post(self, request, *args, **kwargs):
+        serialized = ProfileBatchSerializer(data=request.data)
+        serialized.is_valid(raise_exception=True)
+        # порядок ответа - порядок запроса, повторы отдаются один раз
+        profile_uuids: List[str] = list(dict.fromkeys(str(u) for u in serialized.validated_data['uuids']))
+        found: Dict[str, str] = await profile_cache.aget_many(profile_uuids, self.load_profiles)
+        # JSON профилей из кеша вставляется в ответ как есть, без разбора и повторного рендера
+        profiles: str = ','.join(unpack(found[u])[2] for u in profile_uuids if u in found)
+        missing: List[str] = [u for u in profile_uuids if u not in found]
+        return JSONBytesResponse(f'{{"profiles":[{profiles}],"missing":{json.dumps(missing)}}}',
+                                 status=status.HTTP_200_OK)